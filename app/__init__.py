@@ -4,36 +4,20 @@
 from __future__ import print_function, unicode_literals, absolute_import
 
 from flask import Flask
-from sqlalchemy import create_engine
 from .extensions import *
 
 import os
 
 basedir = os.path.abspath(os.path.dirname(__file__))
-app = Flask(__name__, instance_relative_config=True)
 
 
-# 导入模块
-# from .wechat_channel import ws
-# from .wechat import wechat
-from .blog import blog
-from . import index
-
-
-def __init_watchdog():
+def __init_watchdog(app):
     import logging
-    from logging.handlers import SMTPHandler, RotatingFileHandler
-
-    mail_handler = SMTPHandler(
-        (app.config['MAIL_SERVER'], app.config['MAIL_PORT']),
-        app.config['FLASKY_MAIL_SENDER'],
-        [app.config['FLASKY_ADMIN_MAIL']],
-        app.config['FLASKY_MAIL_SUBJECT_PREFIX'] + 'Application Error',
-        credentials=(app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD']),
-        secure=app.config['MAIL_USE_SSL']
-    )
-    mail_handler.setLevel(logging.ERROR)
-    app.logger.addHandler(mail_handler)
+    from logging.handlers import RotatingFileHandler
+    from .error_mail import install_error_mail
+
+    # 错误邮件在后台线程里按相同错误合并后定时发送，不阻塞请求线程
+    install_error_mail(app)
 
     file_handler = RotatingFileHandler(
         app.config['ROTATING_LOG_PATH'],
@@ -44,19 +28,34 @@ def __init_watchdog():
     app.logger.addHandler(file_handler)
 
 
-def init_app():
+def create_app(config=None):
+    """
+    创建应用。config 可以是额外的配置文件路径，也可以是一个 dict，在默认配置之后加载。
+    导入 app 包本身不再创建应用、不连接数据库，gunicorn 使用 wsgi:app，manage.py 在启动时调用这里。
+    微信、socketio、CDN 这些可选模块只在配置打开时才导入。
+    """
+    app = Flask(__name__, instance_relative_config=True)
+
     # 加载配置
     app.config.from_pyfile(os.path.join(basedir, '../config.py'))
+    # 传入了配置时（例如测试）实例目录下的配置文件可以不存在
     if app.config['DEBUG']:
-        app.config.from_pyfile('config_dev.py')
+        app.config.from_pyfile('config_dev.py', silent=config is not None)
     else:
-        app.config.from_pyfile('config_deploy.py')
+        app.config.from_pyfile('config_deploy.py', silent=config is not None)
+    if isinstance(config, dict):
+        app.config.update(config)
+    elif config is not None:
+        app.config.from_pyfile(config)
 
     # 注册蓝图
+    from .blog import blog
+    from .index import index
     app.register_blueprint(blog, url_prefix='/blog')
-    # app.register_blueprint(blog, url_prefix='/')
-    # app.register_blueprint(wechat, url_prefix='/wechat')
-    # app.register_blueprint(wechat, url_prefix='/weixin')
+    app.register_blueprint(index)
+    if app.config['WECHAT_ENABLED']:
+        from .wechat import wechat
+        app.register_blueprint(wechat, url_prefix='/wechat')
 
     # 初始化插件
     mail_engine.init_app(app)
@@ -67,20 +66,31 @@ def init_app():
     page_down.init_app(app)
     principal.init_app(app)
     login_master.init_app(app)
-    # cdn.init_app(app)
-    __init_watchdog()
+    view_counter.init_app(app)
+    render_cache.init_app(app)
+    page_cache.init_app(app)
+    sql_monitor.init_app(app)
+    profiler.init_app(app)
+    mail_dispatcher.init_app(app)
+    avatars.init_app(app)
+    assets.init_app(app)
+    file_offload.init_app(app)
+    if app.config['CDN_ENABLED']:
+        from flask_cdn import CDN
+        CDN(app)
+    if app.config['SOCKETIO_ENABLED']:
+        from .wechat_channel import ws
+        ws.init_app(app)
+    if not app.testing:
+        __init_watchdog(app)
 
     # 补丁
-    from app import monkey_patch
-    monkey_patch.patch_bootstrap_cdn(app)
-
-    engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'], convert_unicode=True)
-    meta.create_all(bind=engine)
-    # ws.init_app(app)
+    if app.config['BOOTSTRAP_PUBLIC_CDN']:
+        from app import monkey_patch
+        monkey_patch.patch_bootstrap_cdn(app)
 
     if not app.config['DEBUG']:
         from werkzeug.contrib.fixers import ProxyFix
         app.wsgi_app = ProxyFix(app.wsgi_app)
 
-
-init_app()
+    return app
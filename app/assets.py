@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+带内容哈希的静态资源
+
+manage.py assets 按 ASSETS_INCLUDE 从各个静态目录里挑出页面真正用到的文件（editor.md 只取压缩后的脚本、样式和字体，
+不包括示例、文档和源码），以内容哈希命名后写到 ASSETS_BUILD_DIR，同时生成 .gz（装了 brotli 时还有 .br）预压缩版本，
+最后写出 manifest.json 记录原文件名到哈希文件名的对应关系。CSS 里的相对 url() 会改写成对应的哈希文件地址。
+
+应用启动时读取 manifest，模板里的 url_for('blog.static', filename=...) 对清单里的文件返回 /assets/ 下的哈希地址，
+这些地址的内容永远不变，响应带一年的 immutable 缓存头，老访客不再重新验证。
+没有执行过构建（例如开发环境）时 url_for 和以前一样直接指向原始文件。
+旧的哈希文件不会被删除，已经缓存了旧页面的客户端仍然可以取到它们引用的资源。
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+from flask import url_for, request, send_file, safe_join, abort, current_app
+from fnmatch import fnmatch
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import posixpath
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST = 'manifest.json'
+IMMUTABLE = 'public, max-age=%d, immutable' % (365 * 24 * 3600)
+# 这些类型压缩后明显变小，图片和字体本身已经压缩过
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.eot', '.ttf', '.ico')
+# 客户端可以接受的预压缩版本，按优先顺序排列
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+_CSS_URL_RE = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+def _static_folder(app, endpoint):
+    if endpoint == 'static':
+        return app.static_folder
+    return app.blueprints[endpoint.rsplit('.', 1)[0]].static_folder
+
+
+def _fingerprinted(path, content):
+    root, ext = posixpath.splitext(path)
+    return '%s.%s%s' % (root, hashlib.sha1(content).hexdigest()[:12], ext)
+
+
+def _gzip(content):
+    buf = io.BytesIO()
+    # 固定 mtime，内容不变时重复构建得到相同的文件
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9, mtime=0) as fp:
+        fp.write(content)
+    return buf.getvalue()
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as fp:
+        fp.write(content)
+    os.replace(tmp, path)
+
+
+class Assets(object):
+    def __init__(self, app=None):
+        self.build_dir = None
+        self.manifest = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.build_dir = app.config.setdefault('ASSETS_BUILD_DIR', None) or \
+            os.path.join(app.instance_path, 'assets')
+        app.config.setdefault('ASSETS_INCLUDE', {})
+        self.manifest = self.load_manifest()
+        app.jinja_env.globals['url_for'] = self.url_for
+        app.extensions['assets'] = self
+
+    def load_manifest(self):
+        try:
+            with io.open(os.path.join(self.build_dir, MANIFEST), encoding='utf-8') as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def url_for(self, endpoint, **values):
+        """模板里使用的 url_for，静态文件在清单里时返回哈希后的地址"""
+        if self.manifest and endpoint.endswith('static') and 'filename' in values:
+            if endpoint == '.static':
+                # 不在蓝本里的请求（如应用级路由、错误页面）交给 flask.url_for 按应用的 static 处理
+                if request.blueprint is None:
+                    return url_for(endpoint, **values)
+                endpoint = request.blueprint + endpoint
+            built = self.manifest.get('%s:%s' % (endpoint, values['filename']))
+            if built is not None:
+                values.pop('filename')
+                return url_for('index.assets', filename=built, **values)
+        return url_for(endpoint, **values)
+
+    def send(self, filename):
+        """发送构建好的文件，客户端支持时优先发送预压缩版本"""
+        path = safe_join(self.build_dir, filename)
+        if path is None or filename == MANIFEST or not os.path.isfile(path):
+            abort(404)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        encoding = None
+        offload = current_app.extensions.get('file_offload')
+        # 交给 nginx 发送时由它的 gzip_static 选择预压缩版本
+        encodings = () if offload is not None and offload.server_encodes else ENCODINGS
+        for name, suffix in encodings:
+            if request.accept_encodings[name] and os.path.isfile(path + suffix):
+                path, encoding = path + suffix, name
+                break
+        response = send_file(path, mimetype=mimetype, conditional=True)
+        if encoding is not None:
+            response.content_encoding = encoding
+        response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = IMMUTABLE
+        return response
+
+    def collect(self, app):
+        """按 ASSETS_INCLUDE 列出 (清单键, 静态端点, 相对路径, 完整路径)，CSS 排在最后以便改写其中的引用"""
+        found = []
+        for endpoint, patterns in sorted(app.config['ASSETS_INCLUDE'].items()):
+            folder = _static_folder(app, endpoint)
+            for dirpath, dirnames, filenames in os.walk(folder):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    full = os.path.join(dirpath, name)
+                    rel = os.path.relpath(full, folder).replace(os.sep, '/')
+                    if any(fnmatch(rel, pattern) for pattern in patterns):
+                        found.append(('%s:%s' % (endpoint, rel), endpoint, rel, full))
+        found.sort(key=lambda item: item[2].endswith('.css'))
+        return found
+
+    def _rewrite_css(self, css, endpoint, rel, manifest):
+        def replace(match):
+            quote, target = match.groups()
+            if re.match(r'^([a-z]+:|/|#)', target):
+                return match.group(0)
+            path, sep, suffix = target.partition('?')
+            if not sep:
+                path, sep, suffix = target.partition('#')
+            resolved = posixpath.normpath(posixpath.join(posixpath.dirname(rel), path))
+            built = manifest.get('%s:%s' % (endpoint, resolved))
+            if built is not None:
+                url = url_for('index.assets', filename=built)
+            else:
+                url = url_for(endpoint, filename=resolved)
+            return 'url(%s%s%s%s%s)' % (quote, url, sep, suffix, quote)
+        return _CSS_URL_RE.sub(replace, css)
+
+    def build(self, app):
+        """生成哈希文件、预压缩文件和清单，返回本次构建的统计"""
+        manifest = {}
+        stats = {'files': 0, 'bytes': 0, 'gzip_bytes': 0, 'brotli_bytes': 0}
+        with app.test_request_context():
+            for key, endpoint, rel, full in self.collect(app):
+                with open(full, 'rb') as fp:
+                    content = fp.read()
+                if rel.endswith('.css'):
+                    content = self._rewrite_css(content.decode('utf-8'), endpoint, rel, manifest).encode('utf-8')
+                built = _fingerprinted('%s/%s' % (endpoint.split('.')[0], rel), content)
+                target = os.path.join(self.build_dir, built)
+                _write(target, content)
+                stats['files'] += 1
+                stats['bytes'] += len(content)
+                if rel.endswith(COMPRESSIBLE):
+                    compressed = _gzip(content)
+                    if len(compressed) < len(content):
+                        _write(target + '.gz', compressed)
+                        stats['gzip_bytes'] += len(compressed)
+                    if brotli is not None:
+                        compressed = brotli.compress(content)
+                        if len(compressed) < len(content):
+                            _write(target + '.br', compressed)
+                            stats['brotli_bytes'] += len(compressed)
+                manifest[key] = built
+        _write(os.path.join(self.build_dir, MANIFEST),
+               json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+        self.manifest = manifest
+        return stats
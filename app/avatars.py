@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+服务端生成的 identicon 头像
+
+以前页面在浏览器里用 identicon.js 根据 User.avatar（邮箱的 md5）现场画头像，每个页面都要加载并执行生成脚本。
+现在 /avatar/v<算法版本>/<md5>-<尺寸>.png 在服务端按同样的算法（5×5 左右对称的方格，颜色取自哈希末 7 位）生成 PNG，
+PNG 只用 zlib 和 struct 编码，不依赖图像库。
+同一个 URL 的内容永远不变，生成结果先放进内存 LRU，配置了 AVATAR_CACHE_DIR 时再写到磁盘上供重启后和其他 worker 复用，
+响应带一年的 immutable 缓存头，浏览器和反向代理之后不会再来请求。
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+from .lru import LRUCache
+import colorsys
+import os
+import re
+import struct
+import zlib
+
+# 生成算法变化时加一，磁盘上旧版本的文件不再使用
+IDENTICON_VERSION = 1
+BACKGROUND = (240, 240, 240)
+SATURATION = 0.7
+LIGHTNESS = 0.5
+MARGIN = 0.08
+
+_DIGEST_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _chunk(tag, data):
+    return struct.pack(b'>I', len(data)) + tag + data + struct.pack(b'>I', zlib.crc32(tag + data) & 0xffffffff)
+
+
+def encode_png(rows, width, height):
+    """rows 为每一行的 RGB 字节串"""
+    raw = b''.join(b'\x00' + row for row in rows)
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        _chunk(b'IHDR', struct.pack(b'>IIBBBBB', width, height, 8, 2, 0, 0, 0)),
+        _chunk(b'IDAT', zlib.compress(raw, 9)),
+        _chunk(b'IEND', b''),
+    ])
+
+
+def identicon_grid(digest):
+    """返回 5×5 的布尔方格，True 表示前景色；前 15 位十六进制数决定中间三列，两侧镜像"""
+    grid = [[False] * 5 for _ in range(5)]
+    for i in range(15):
+        filled = int(digest[i], 16) % 2 == 0
+        column, row = 2 - i // 5, i % 5
+        grid[row][column] = grid[row][4 - column] = filled
+    return grid
+
+
+def identicon_color(digest):
+    hue = int(digest[-7:], 16) / float(0xfffffff)
+    return tuple(int(round(c * 255)) for c in colorsys.hls_to_rgb(hue, LIGHTNESS, SATURATION))
+
+
+def render_identicon(digest, size):
+    margin = int(size * MARGIN)
+    cell = (size - margin * 2) // 5
+    # 尺寸不能被 5 整除时多出来的像素平均分给两边
+    margin = (size - cell * 5) // 2
+    foreground = bytes(bytearray(identicon_color(digest)))
+    background = bytes(bytearray(BACKGROUND))
+
+    blank = background * size
+    rows = []
+    for grid_row in identicon_grid(digest):
+        row = background * margin + b''.join(
+            (foreground if filled else background) * cell for filled in grid_row)
+        rows.extend([row + background * (size - margin - cell * 5)] * cell)
+    rows = [blank] * margin + rows + [blank] * (size - margin - cell * 5)
+    return encode_png(rows, size, size)
+
+
+class AvatarCache(object):
+    def __init__(self, app=None):
+        self.cache_dir = None
+        self.sizes = frozenset()
+        self._memory = LRUCache(512)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._memory = LRUCache(app.config.setdefault('AVATAR_CACHE_SIZE', 512))
+        self.cache_dir = app.config.setdefault('AVATAR_CACHE_DIR', None)
+        # 只生成页面上实际用到的几种尺寸，避免任意尺寸的请求把缓存撑满
+        self.sizes = frozenset(app.config.setdefault('AVATAR_SIZES', (48, 64, 180)))
+        app.extensions['avatars'] = self
+
+    def accepts(self, digest, size):
+        return size in self.sizes and _DIGEST_RE.match(digest) is not None
+
+    def get(self, digest, size):
+        key = '%s-%d' % (digest, size)
+        png = self._memory.get(key)
+        if png is not None:
+            self.hits += 1
+            return png
+
+        png = self._load(key)
+        if png is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            png = render_identicon(digest, size)
+            self._store(key, png)
+        self._memory.set(key, png)
+        return png
+
+    def disk_path(self, digest, size):
+        """磁盘缓存中的文件路径，不存在时返回 None"""
+        if not self.cache_dir:
+            return None
+        path = self._path('%s-%d' % (digest, size))
+        return path if os.path.isfile(path) else None
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'size': len(self._memory),
+            'capacity': self._memory.capacity,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    def clear(self):
+        self._memory.clear()
+        self.hits = self.disk_hits = self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, 'v%d' % IDENTICON_VERSION, key[:2], key + '.png')
+
+    def _load(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(key), 'rb') as fp:
+                return fp.read()
+        except (IOError, OSError):
+            return None
+
+    def _store(self, key, png):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再改名，避免其他 worker 读到写了一半的文件
+            tmp = '%s.%d.tmp' % (path, os.getpid())
+            with open(tmp, 'wb') as fp:
+                fp.write(png)
+            os.replace(tmp, path)
+        except (IOError, OSError):
+            pass
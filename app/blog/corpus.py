@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+博客数据的导出和导入（JSONL）
+
+每行一条记录，"_type" 字段表示记录类型，顺序是 role、user、user_role、category、tag、post、post_tag、comment，
+导入时按顺序读就能保证外键引用的行已经存在。
+
+导出用 stream_results 服务器端游标分批读取，导入每攒够一批就 bulk_insert_mappings 写入，内存占用与数据量无关。
+导入到非空数据库时：角色、分类、标签按名称合并，用户按邮箱合并；
+邮箱不同但用户名已被占用的用户改名为"用户名-新 id"后导入，改名的数量记在 user_renamed 里，
+文章和评论的 id 统一加上目标表当前的最大 id，不需要在内存里保存映射表。
+记录里已经有 body_html 时直接使用，只有缺少渲染结果的行才渲染 Markdown。
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+from datetime import datetime
+from sqlalchemy import select, func, DateTime
+from app.extensions import db, render_cache, view_counter
+from .models import Role, User, Category, Tag, Post, Comment, users_roles, posts_tags
+import json
+
+# (记录类型, 表)，导出和导入都按这个顺序
+TABLES = (
+    ('role', Role.__table__),
+    ('user', User.__table__),
+    ('user_role', users_roles),
+    ('category', Category.__table__),
+    ('tag', Tag.__table__),
+    ('post', Post.__table__),
+    ('post_tag', posts_tags),
+    ('comment', Comment.__table__),
+)
+# 有映射类的表用 bulk_insert_mappings 写入，关联表直接 insert
+MODELS = dict((model.__table__, model) for model in (Role, User, Category, Tag, Post, Comment))
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _decode_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in value else '%Y-%m-%dT%H:%M:%S'
+    return datetime.strptime(value, fmt)
+
+
+def export_corpus(fp, chunk=1000):
+    """把全部数据写入 fp，返回每种记录的条数"""
+    # 还没写回数据库的浏览次数先写回去
+    view_counter.flush()
+    counts = {}
+    connection = db.session.connection().execution_options(stream_results=True)
+    for kind, table in TABLES:
+        order = list(table.primary_key.columns) or list(table.columns)
+        result = connection.execute(select([table]).order_by(*order))
+        counts[kind] = 0
+        while True:
+            rows = result.fetchmany(chunk)
+            if not rows:
+                break
+            for row in rows:
+                record = dict((key, _encode(value)) for key, value in row.items())
+                record['_type'] = kind
+                fp.write(json.dumps(record, ensure_ascii=False))
+                fp.write('\n')
+            counts[kind] += len(rows)
+        result.close()
+    return counts
+
+
+class _Importer(object):
+    def __init__(self, chunk):
+        self.chunk = chunk
+        self.pending = {}
+        self.counts = {}
+        session = db.session
+        # 小表按名称合并，保存旧 id 到新 id 的映射
+        self.roles = dict(session.query(Role.name, Role.id))
+        self.categories = dict(session.query(Category.category_name, Category.id))
+        self.tags = dict(session.query(Tag.name, Tag.id))
+        self.users = dict(session.query(User.email, User.id))
+        self.usernames = set(name for name, in session.query(User.username) if name is not None)
+        self.role_ids, self.category_ids, self.tag_ids, self.user_ids = {}, {}, {}, {}
+        # 合并到已有用户时沿用已有用户的角色
+        self.new_users = set()
+        # 大表整体平移 id
+        self.post_offset = session.query(func.coalesce(func.max(Post.id), 0)).scalar()
+        self.comment_offset = session.query(func.coalesce(func.max(Comment.id), 0)).scalar()
+        self.next_ids = {
+            'role': session.query(func.coalesce(func.max(Role.id), 0)).scalar(),
+            'user': session.query(func.coalesce(func.max(User.id), 0)).scalar(),
+            'category': session.query(func.coalesce(func.max(Category.id), 0)).scalar(),
+            'tag': session.query(func.coalesce(func.max(Tag.id), 0)).scalar(),
+        }
+
+    def _next_id(self, kind):
+        self.next_ids[kind] += 1
+        return self.next_ids[kind]
+
+    def _merge(self, kind, existing, mapping, key, record):
+        """按名称合并的表：已存在就记下映射并跳过，否则分配新 id"""
+        old_id = record['id']
+        if record[key] in existing:
+            mapping[old_id] = existing[record[key]]
+            return None
+        record['id'] = mapping[old_id] = existing[record[key]] = self._next_id(kind)
+        return record
+
+    def _unique_username(self, record):
+        name = record.get('username')
+        if name is None:
+            return
+        if name in self.usernames:
+            # 用户名唯一，和已有用户重名时改名导入，不让整个导入在中途失败
+            suffix = '-%d' % record['id']
+            limit = User.__table__.c.username.type.length
+            renamed = name[:limit - len(suffix)] + suffix
+            while renamed in self.usernames:
+                renamed = renamed[1:] + '-'
+            record['username'] = name = renamed
+            self.counts['user_renamed'] = self.counts.get('user_renamed', 0) + 1
+        self.usernames.add(name)
+
+    def convert(self, kind, record):
+        if kind == 'role':
+            return self._merge(kind, self.roles, self.role_ids, 'name', record)
+        if kind == 'user':
+            record = self._merge(kind, self.users, self.user_ids, 'email', record)
+            if record is not None:
+                self.new_users.add(record['id'])
+                self._unique_username(record)
+            return record
+        if kind == 'category':
+            return self._merge(kind, self.categories, self.category_ids, 'category_name', record)
+        if kind == 'tag':
+            return self._merge(kind, self.tags, self.tag_ids, 'name', record)
+        if kind == 'user_role':
+            record['user_id'] = self.user_ids.get(record['user_id'])
+            record['role_id'] = self.role_ids.get(record['role_id'])
+            if record['user_id'] not in self.new_users or record['role_id'] is None:
+                return None
+        elif kind == 'post_tag':
+            record['tag_id'] = self.tag_ids.get(record['tag_id'])
+            if record['post_id'] is None or record['tag_id'] is None:
+                return None
+            record['post_id'] += self.post_offset
+        elif kind == 'post':
+            record['id'] += self.post_offset
+            record['author_id'] = self.user_ids.get(record['author_id'])
+            record['category_id'] = self.category_ids.get(record['category_id'])
+            if record.get('body_html') is None and record.get('body') is not None:
+                record['body_html'] = render_cache.render(record['body'], 'post')
+        elif kind == 'comment':
+            record['id'] += self.comment_offset
+            record['author_id'] = self.user_ids.get(record['author_id'])
+            if record['post_id'] is not None:
+                record['post_id'] += self.post_offset
+            if record.get('body_html') is None and record.get('body') is not None:
+                record['body_html'] = render_cache.render(record['body'], 'comment')
+        return record
+
+    def add(self, kind, table, record):
+        rows = self.pending.setdefault(kind, [])
+        rows.append(record)
+        if len(rows) >= self.chunk:
+            self.flush(kind, table)
+
+    def flush(self, kind, table):
+        rows = self.pending.pop(kind, None)
+        if not rows:
+            return
+        model = MODELS.get(table)
+        if model is not None:
+            db.session.bulk_insert_mappings(model, rows)
+        else:
+            db.session.execute(table.insert(), rows)
+        self.counts[kind] = self.counts.get(kind, 0) + len(rows)
+
+
+def import_corpus(fp, chunk=1000):
+    """从 fp 读取 export_corpus 写出的记录并写入数据库，返回每种记录写入的条数"""
+    tables = dict(TABLES)
+    columns = dict((kind, set(c.name for c in table.columns)) for kind, table in TABLES)
+    dates = dict((kind, [c.name for c in table.columns if isinstance(c.type, DateTime)])
+                 for kind, table in TABLES)
+    importer = _Importer(chunk)
+    current = None
+    try:
+        for line in fp:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            kind = record.pop('_type')
+            if kind != current:
+                # 换了一种记录，把上一种剩下的先写进去，保证外键引用的行已经存在
+                if current is not None:
+                    importer.flush(current, tables[current])
+                current = kind
+            record = dict((k, v) for k, v in record.items() if k in columns[kind])
+            for name in dates[kind]:
+                if name in record:
+                    record[name] = _decode_datetime(record[name])
+            record = importer.convert(kind, record)
+            if record is not None:
+                importer.add(kind, tables[kind], record)
+        if current is not None:
+            importer.flush(current, tables[current])
+        _reset_sequences()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return importer.counts
+
+
+def _reset_sequences():
+    # 显式写入了 id，PostgreSQL 的序列不会跟着前进
+    if db.session.get_bind(Post.__mapper__).dialect.name != 'postgresql':
+        return
+    for model in MODELS.values():
+        table = model.__tablename__
+        db.session.execute("SELECT setval(pg_get_serial_sequence('%s', 'id'), "
+                           "COALESCE((SELECT MAX(id) FROM %s), 1))" % (table, table))
@@ -9,14 +9,43 @@ from werkzeug.utils import cached_property, escape
 from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from flask_login import UserMixin, AnonymousUserMixin
-from markdown import markdown
-from app import login_master
-from app.extensions import db
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session, object_session
+from app.extensions import db, login_master, cache, view_counter, render_cache
 from app.permissions import permission_admin, permission_moderator, permission_blogger
-import bleach
 import hashlib
 
 
+# 文章正文允许使用的 HTML 标签
+POST_ALLOWED_TAGS = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
+                     'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
+                     'h1', 'h2', 'h3', 'h4', 'p', 'q',
+                     'img', 'hr', 'sub', 'sup', 'del',
+                     'dl', 'dt', 'dd']
+# 加了这个终于可以显示图片了，否则哪怕有上面的也不行
+POST_ALLOWED_ATTRS = {
+    '*': ['class'],
+    'a': ['href', 'rel'],
+    'img': ['src', 'alt'],
+}
+# 以前由浏览器端的 editor.md 渲染，它支持 ``` 围起来的代码块，服务器端渲染时需要打开 fenced_code 扩展。
+# editor.md 的 TeX 公式、flowchart / sequence 图、emoji 和任务列表（- [ ]）在服务器端没有对应的扩展，
+# 改为服务器端渲染后这些写法按普通 Markdown 输出：公式和图表显示为源码，emoji 保持 :smile: 这样的文本
+POST_MARKDOWN_EXTENSIONS = ['markdown.extensions.fenced_code']
+
+# 评论相对较短,对 Markdown 中允许使用的 HTML 标签要求更严格
+COMMENT_ALLOWED_TAGS = ['p', 'a', 'abbr', 'acronym', 'b', 'code', 'em', 'i', 'strong',
+                        'h3', 'h4', 'li', 'ol', 'ul', 'blockquote', 'pre', 'hr', 'img', 'sub', 'sup']
+COMMENT_ALLOWED_ATTRS = {
+    '*': ['class'],
+    'a': ['href', 'rel'],
+    'img': ['src', 'alt'],
+}
+
+render_cache.register_profile('post', POST_ALLOWED_TAGS, POST_ALLOWED_ATTRS, POST_MARKDOWN_EXTENSIONS)
+render_cache.register_profile('comment', COMMENT_ALLOWED_TAGS, COMMENT_ALLOWED_ATTRS)
+
+
 users_roles = db.Table('users_roles',
                        # meta,
                        db.Column('user_id', db.Integer, db.ForeignKey('users.id')),
@@ -162,6 +191,21 @@ class User(UserMixin, db.Model):
         email = self.email
         return hashlib.md5(email.lower().encode('utf-8')).hexdigest()
 
+    @property
+    def role_names(self):
+        return [role.name for role in self.roles]
+
+    def identity_snapshot(self):
+        # 放进身份缓存的精简信息，足够完成权限判断和导航栏、文章列表的渲染
+        return {
+            'id': self.id,
+            'username': self.username,
+            'nickname': self.nickname,
+            'avatar': self.avatar,
+            'active': self.active,
+            'role_names': self.role_names,
+        }
+
     def __repr__(self):
         return '<User %r>' % self.username
 
@@ -169,6 +213,66 @@ class User(UserMixin, db.Model):
         return self.nickname
 
 
+class CachedUser(UserMixin):
+    """
+    从身份缓存恢复出的登录用户，作为 current_user 使用，加载时不需要查询数据库。
+    快照里没有的属性会在第一次访问时加载真正的 User 对象再读取；
+    需要修改用户数据时请使用 user 属性拿到 User 对象。
+    """
+
+    def __init__(self, snapshot, user=None):
+        self.__dict__.update(snapshot)
+        if user is not None:
+            self.__dict__['user'] = user
+
+    @cached_property
+    def user(self):
+        return User.query.get(self.id)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    @cached_property
+    def is_administrator(self):
+        return permission_admin.can()
+
+    @cached_property
+    def is_moderator(self):
+        return permission_moderator.can()
+
+    @property
+    def is_blogger(self):
+        return permission_blogger.can()
+
+    @property
+    def is_active(self):
+        return self.active
+
+    def get_id(self):
+        return self.id
+
+    # 模板里会用 current_user == post.author 判断是不是作者
+    def __eq__(self, other):
+        if isinstance(other, (User, CachedUser)):
+            return self.id == other.id
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return '<CachedUser %r>' % self.username
+
+    def __str__(self):
+        return self.nickname
+
+
 # 出于一致性考虑,我们还定义了 AnonymousUser 类,并实现了 can() 方法和 is_administrator() 方法。
 class AnonymousUser(AnonymousUserMixin):
     provides = []
@@ -206,9 +310,47 @@ Flask-Login 要求程序实现一个回调函数,使用指定的标识符加载
 """
 
 
+IDENTITY_CACHE_KEY = 'identity/%d'
+
+
 @login_master.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # 每个登录用户的请求都要加载身份，先查身份缓存，命中时不需要访问数据库
+    key = IDENTITY_CACHE_KEY % int(user_id)
+    snapshot = cache.get(key)
+    if snapshot is not None:
+        return CachedUser(snapshot)
+    user = User.query.get(int(user_id))
+    if user is None:
+        return None
+    snapshot = user.identity_snapshot()
+    cache.set(key, snapshot, timeout=current_app.config['IDENTITY_CACHE_TIMEOUT'])
+    return CachedUser(snapshot, user)
+
+
+def invalidate_identity(user_id):
+    cache.delete(IDENTITY_CACHE_KEY % int(user_id))
+
+
+# 用户资料、密码或角色变化后清除身份缓存，保证权限立即生效。
+# flush 时只记下用户 id，等事务提交后再删除缓存：如果在 flush 时删除，提交之前的并发请求
+# 会从数据库读到旧的角色和密码重新写进缓存，一直保留到过期
+@db.event.listens_for(User, 'after_update')
+@db.event.listens_for(User, 'after_delete')
+def on_user_changed(mapper, connection, target):
+    session = object_session(target)
+    session.info.setdefault('identity_invalidations', set()).add(target.id)
+
+
+@db.event.listens_for(Session, 'after_commit')
+def on_session_committed(session):
+    for user_id in session.info.pop('identity_invalidations', ()):
+        invalidate_identity(user_id)
+
+
+@db.event.listens_for(Session, 'after_rollback')
+def on_session_rolled_back(session):
+    session.info.pop('identity_invalidations', None)
 
 
 class Post(db.Model):
@@ -219,6 +361,8 @@ class Post(db.Model):
     intro = db.Column(db.Text)
     # intro_html = db.Column(db.Text)
     body = db.Column(db.Text)
+    # body 渲染后的 HTML，由 on_changed_body 在保存时生成，页面直接输出这一列
+    body_html = db.Column(db.Text)
     publish = db.Column(db.Boolean, default=True)  # 不公开的文章只有moderator及以上才可见
     post_date = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     last_modified_date = db.Column(db.DateTime, index=True, default=datetime.utcnow)
@@ -228,38 +372,28 @@ class Post(db.Model):
     comments = db.relationship('Comment', backref='post', lazy='dynamic', cascade='all, delete-orphan')
     category_id = db.Column(db.Integer, db.ForeignKey('categories.id'))
     view_times = db.Column(db.Integer, default=1)
+    # 评论总数和未被禁用的评论数，由 Comment 上的事件维护，列表和分页不再需要对 comments 做 COUNT(*)
+    comment_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    enabled_comment_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
 
     tags = db.relationship('Tag',
                            secondary=posts_tags,
                            backref=db.backref('posts', lazy='dynamic'))
 
+    @property
+    def view_count(self):
+        # 数据库中的值加上还在内存缓冲里、尚未写回的增量
+        return (self.view_times or 0) + view_counter.pending(Post, self.id)
+
     @property
     def category_name(self):
-        return Category.query.filter_by(id=self.category_id).first().category_name
+        # 通过 category 关系取得，列表页已经预先加载了分类，不会再发出查询
+        return self.category.category_name if self.category is not None else None
 
     @staticmethod
     # on_changed_body 函数把 body 字段中的文本渲染成 HTML 格式,结果保存在 body_html 中,
     # 自动且高效地完成 Markdown 文本到 HTML 的转换。
-    # def on_changed_title(target, value, oldvalue, initiator):
-    #     allowed_tags = ['a', 'abbr', 'acronym', 'b', 'code',
-    #                     'em', 'i', 'strong',
-    #                     'h1', 'h2', 'h3']
-    # def on_changed_intro(target, value, oldvalue, initiator):
-    #     allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
-    #                     'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
-    #                     'h1', 'h2', 'h3', 'p']
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
-                        'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
-                        'h1', 'h2', 'h3', 'h4', 'p', 'q',
-                        'img', 'hr', 'sub', 'sup', 'del',
-                        'dl', 'dt', 'dd']
-        # 加了这个终于可以显示图片了，否则哪怕有上面的也不行
-        attrs = {
-            '*': ['class'],
-            'a': ['href', 'rel'],
-            'img': ['src', 'alt'],
-        }
         """
         真正的转换过程分三步完成。
         首先,markdown() 函数初步把 Markdown 文本转换成 HTML。
@@ -268,13 +402,12 @@ class Post(db.Model):
 
         最后一步是很有必要的,因为 Markdown 规范没有为自动生成链接提供官方支持。
         PageDown 以扩展的形式实现了这个功能,因此在服务器上要调用 linkify() 函数。
+
+        转换结果经过 render_cache 缓存，正文没有变化时直接跳过。
         """
-        # target.title_html = bleach.linkify(bleach.clean(markdown(value, output_format='html'),
-        # tags=allowed_tags, strip=True))
-        # target.intro_html = bleach.linkify(bleach.clean(markdown(value, output_format='html'),
-        # tags=allowed_tags, strip=True))
-        target.body_html = bleach.linkify(
-            bleach.clean(markdown(value, output_format='html'), tags=allowed_tags, attributes=attrs, strip=True))
+        if value == oldvalue and target.body_html is not None:
+            return
+        target.body_html = render_cache.render(value, 'post')
 
 
 # on_changed_body 函数注册在 body 字段上,是 SQLAlchemy“set”事件的监听程序,
@@ -291,9 +424,10 @@ class Comment(db.Model):
     body_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     # Comment 模型的属性几乎和 Post 模型一样,不过多了一个 disabled 字段。这是个布尔值字段,协管员通过这个字段查禁不当评论。
-    disabled = db.Column(db.Boolean)
+    # active_history：提交后属性已过期时，修改前也要先读出旧值，计数监听器才能算出差值
+    disabled = db.column_property(db.Column(db.Boolean), active_history=True)
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
+    post_id = db.column_property(db.Column(db.Integer, db.ForeignKey('posts.id')), active_history=True)
 
     @property
     def comment_of_which_post(self):
@@ -305,16 +439,9 @@ class Comment(db.Model):
 
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = ['p', 'a', 'abbr', 'acronym', 'b', 'code', 'em', 'i', 'strong',
-                        'h3', 'h4', 'li', 'ol', 'ul', 'blockquote', 'pre', 'hr', 'img', 'sub', 'sup']
-        attrs = {
-            '*': ['class'],
-            'a': ['href', 'rel'],
-            'img': ['src', 'alt'],
-        }
-        target.body_html = bleach.linkify(bleach.clean(
-            markdown(value, output_format='html'),
-            tags=allowed_tags, attributes=attrs, strip=True))
+        if value == oldvalue and target.body_html is not None:
+            return
+        target.body_html = render_cache.render(value, 'comment')
 
     """
     和博客文章一样,评论也定义了一个事件,在修改 body 字段内容时触发,自动把 Markdown 文本转换成 HTML。
@@ -325,6 +452,43 @@ class Comment(db.Model):
 db.event.listen(Comment.body, 'set', Comment.on_changed_body)
 
 
+def _adjust_comment_counts(connection, post_id, total, enabled):
+    if post_id is None or (not total and not enabled):
+        return
+    posts = Post.__table__
+    connection.execute(posts.update().where(posts.c.id == post_id).values(
+        comment_count=posts.c.comment_count + total,
+        enabled_comment_count=posts.c.enabled_comment_count + enabled))
+
+
+# 评论的增删、禁用状态和所属文章的变化都在同一个 flush 的连接里更新文章上的计数，和评论本身的写入在同一事务中
+@db.event.listens_for(Comment, 'after_insert')
+def on_comment_inserted(mapper, connection, target):
+    _adjust_comment_counts(connection, target.post_id, 1, 0 if target.disabled else 1)
+
+
+@db.event.listens_for(Comment, 'after_delete')
+def on_comment_deleted(mapper, connection, target):
+    _adjust_comment_counts(connection, target.post_id, -1, 0 if target.disabled else -1)
+
+
+@db.event.listens_for(Comment, 'after_update')
+def on_comment_updated(mapper, connection, target):
+    state = inspect(target)
+    post_history = state.attrs.post_id.history
+    disabled_history = state.attrs.disabled.history
+    if not post_history.has_changes() and not disabled_history.has_changes():
+        return
+    old_post_id = post_history.deleted[0] if post_history.deleted else target.post_id
+    old_disabled = disabled_history.deleted[0] if disabled_history.deleted else target.disabled
+    if old_post_id == target.post_id:
+        _adjust_comment_counts(connection, target.post_id, 0,
+                               (0 if target.disabled else 1) - (0 if old_disabled else 1))
+    else:
+        _adjust_comment_counts(connection, old_post_id, -1, 0 if old_disabled else -1)
+        _adjust_comment_counts(connection, target.post_id, 1, 0 if target.disabled else 1)
+
+
 # 为了完成对数据库的修改,User 和 Post 模型还要建立与 comments 表的一对多关系
 
 
@@ -343,6 +507,10 @@ class HomePage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     view_times = db.Column(db.Integer, default=1)
 
+    @property
+    def view_count(self):
+        return (self.view_times or 0) + view_counter.pending(HomePage, self.id)
+
 
 class Tag(db.Model):
     __tablename__ = 'tags'
@@ -355,10 +523,72 @@ class Tag(db.Model):
 
     @staticmethod
     def get_tag(name):
-        name = name.lower()
-        tag = db.session.query(Tag).filter_by(name=name).first()
-        if not tag:
-            tag = Tag(name)
-            db.session.add(tag)
-            db.session.commit()
-        return tag
+        return Tag.get_tags([name])[0]
+
+    @staticmethod
+    def normalize_names(names):
+        # 去掉空白和空标签，统一小写，去重但保持原来的顺序
+        result = []
+        for name in names:
+            name = name.strip().lower()
+            if name and name not in result:
+                result.append(name)
+        return result
+
+    @staticmethod
+    def _by_name(names, for_update=False):
+        query = Tag.query.filter(Tag.name.in_(names))
+        if for_update:
+            query = query.with_for_update()
+        return dict((tag.name, tag) for tag in query)
+
+    @staticmethod
+    def get_tags(names, attempts=3):
+        """
+        按输入顺序返回标签对象。已有的标签用一条 IN 查询取出，缺少的用一条 INSERT 批量插入，
+        并发保存时撞上唯一约束的行会被忽略后重新读取。不提交事务，由调用方统一提交。
+        重新读取用的是加锁读，读到的是其他事务最新提交的行，不受 MySQL REPEATABLE READ 快照的影响；
+        如果仍然缺少（例如插入那一行的事务已经回滚），再插入一次。
+        """
+        names = Tag.normalize_names(names)
+        if not names:
+            return []
+        tags = Tag._by_name(names)
+        missing = [name for name in names if name not in tags]
+        for _ in range(attempts):
+            if not missing:
+                break
+            db.session.execute(_insert_ignoring_conflicts(Tag.__table__, [{'name': name} for name in missing]))
+            tags.update(Tag._by_name(missing, for_update=True))
+            missing = [name for name in missing if name not in tags]
+        if missing:
+            raise RuntimeError('could not create tags: %s' % ', '.join(missing))
+        return [tags[name] for name in names]
+
+
+def _insert_ignoring_conflicts(table, rows):
+    dialect = db.session.get_bind(Tag.__mapper__).dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(table).values(rows).on_conflict_do_nothing()
+    if dialect == 'mysql':
+        return table.insert().prefix_with('IGNORE').values(rows)
+    if dialect == 'sqlite':
+        return table.insert().prefix_with('OR IGNORE').values(rows)
+    return table.insert().values(rows)
+
+
+# 全文搜索的倒排索引，由 app.blog.search 维护
+# 每篇文章一行，记录加权后的词数，计算 BM25 时用于长度归一化
+class SearchDocument(db.Model):
+    __tablename__ = 'search_documents'
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'), primary_key=True)
+    length = db.Column(db.Integer, nullable=False, default=0)
+
+
+# 词 -> 文章，tf 是词在标题、摘要、正文、标签中按字段权重累加的出现次数
+search_postings = db.Table('search_postings',
+                           db.Column('term', db.String(64), primary_key=True),
+                           db.Column('post_id', db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'),
+                                     primary_key=True, index=True),
+                           db.Column('tf', db.Integer, nullable=False))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+键集（keyset / seek）分页
+
+paginate() 使用 OFFSET 加一条 COUNT(*)，越往后翻越慢。
+这里按 (排序字段, id) 定位上一页的边界，每一页都只是一次走索引的范围查询，第 N 页和第 1 页代价相同。
+URL 中的 cursor 参数是不透明的令牌，记录了边界位置和翻页方向。
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+from datetime import datetime
+from sqlalchemy import and_, or_
+import base64
+import json
+
+_DATETIME_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+
+
+def encode_cursor(key, direction):
+    value, ident = key
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, ident, direction], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """解析 cursor 令牌，返回 ((排序值, id), 方向)；令牌无效时返回 None"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        value, ident, direction = json.loads(raw.decode('utf-8'))
+    except (ValueError, TypeError):
+        return None
+    if direction not in ('next', 'prev') or not isinstance(ident, int):
+        return None
+    for fmt in _DATETIME_FORMATS:
+        try:
+            value = datetime.strptime(value, fmt)
+            break
+        except (ValueError, TypeError):
+            continue
+    else:
+        return None
+    return (value, ident), direction
+
+
+class KeysetPagination(object):
+    def __init__(self, items, per_page, has_prev, has_next, key):
+        self.items = items
+        self.per_page = per_page
+        self.has_prev = has_prev and bool(items)
+        self.has_next = has_next and bool(items)
+        self.prev_cursor = encode_cursor(key(items[0]), 'prev') if self.has_prev else None
+        self.next_cursor = encode_cursor(key(items[-1]), 'next') if self.has_next else None
+
+
+def _after(column, id_column, key, descending):
+    # 按排列顺序位于 key 之后的行，等价于 (column, id) < key（降序）或 > key（升序）
+    value, ident = key
+    if descending:
+        return or_(column < value, and_(column == value, id_column < ident))
+    return or_(column > value, and_(column == value, id_column > ident))
+
+
+def keyset_paginate(query, column, id_column, cursor, per_page, descending=True):
+    """
+    按 (column, id_column) 对 query 做键集分页。
+    descending 为 True 时最新的在前，cursor 为 URL 中的令牌，为空或无效时返回第一页。
+    令牌有效但那一侧已经没有数据（边界行被删掉、或者是手工构造的令牌）时也返回第一页，不给出没有翻页链接的空页面。
+    """
+    decoded = decode_cursor(cursor)
+    key, direction = decoded if decoded else (None, 'next')
+    base_query = query
+
+    # 向前翻页时反过来排序，取出后再倒回来
+    forward = direction == 'next'
+    natural = descending == forward
+    order = [column.desc(), id_column.desc()] if natural else [column.asc(), id_column.asc()]
+    if key is not None:
+        query = query.filter(_after(column, id_column, key, natural))
+    rows = query.order_by(*order).limit(per_page + 1).all()
+    if not rows and key is not None:
+        return keyset_paginate(base_query, column, id_column, None, per_page, descending)
+
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if not forward:
+        rows.reverse()
+
+    def row_key(row):
+        return getattr(row, column.key), getattr(row, id_column.key)
+
+    if forward:
+        return KeysetPagination(rows, per_page, has_prev=key is not None, has_next=more, key=row_key)
+    return KeysetPagination(rows, per_page, has_prev=more, has_next=True, key=row_key)
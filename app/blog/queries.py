@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+文章列表页使用的查询
+
+_posts.html 会访问每篇文章的作者、分类和标签，逐条懒加载会变成 N+1 查询。
+这里把它们一次性取出来，无论一页有多少篇文章，查询次数都是固定的。
+评论数直接读取 Post.comment_count 字段。
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+from sqlalchemy.orm import joinedload, subqueryload
+from .models import Post
+
+
+def listing_query(query=None):
+    # 作者和分类是多对一，直接 JOIN 进主查询；标签是多对多，用一条子查询批量加载
+    if query is None:
+        query = Post.query
+    return query.options(joinedload(Post.author),
+                         joinedload(Post.category),
+                         subqueryload(Post.tags))
+
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+文章全文搜索
+
+标题、摘要、正文和标签切分成词后写入倒排索引 search_postings（词、文章 id、加权词频），
+查询时只按词的主键查找命中的文章，在数据库里用 BM25 打分、排序和分页，不需要对 posts.body 做 LIKE 扫描。
+
+中文没有空格分词，连续的汉字（以及日文、韩文）按相邻两个字切成二元组，
+“全文搜索” -> “全文”、“文搜”、“搜索”，查询用同样的方式切分，不需要词典也能找到任意位置的连续片段。
+英文和数字按单词切分并转成小写。
+
+文章新建、修改、删除时由 Post 上的 mapper 事件在同一个事务里更新索引；
+批量导入之类绕过 ORM 事件的写入之后，用 python manage.py reindex 重建。
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+from collections import Counter
+from sqlalchemy import select, func, inspect, case, literal, Float
+from sqlalchemy.orm import subqueryload
+from app.extensions import db
+from .models import Post, SearchDocument, search_postings
+import math
+import re
+
+# 字段权重：标题和标签里出现的词比正文更重要
+FIELD_WEIGHTS = (('title', 3), ('tags', 3), ('intro', 2), ('body', 1))
+# BM25 参数
+K1 = 1.2
+B = 0.75
+
+_CJK = '぀-ヿ㐀-䶿一-鿿가-힯豈-﫿'
+_TOKEN_RE = re.compile(r'[%s]+|[a-z0-9_]+' % _CJK)
+_CJK_RE = re.compile(r'[%s]' % _CJK)
+_MAX_TERM_LENGTH = 64
+
+
+def tokenize(text):
+    """切分成词：中日韩文字取相邻二元组（单独一个字时保留单字），其余按单词切分"""
+    if not text:
+        return []
+    tokens = []
+    for run in _TOKEN_RE.findall(text.lower()):
+        if _CJK_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run[:_MAX_TERM_LENGTH])
+    return tokens
+
+
+def document_terms(post):
+    """返回 (加权词频, 加权长度)"""
+    counts = Counter()
+    fields = {
+        'title': post.title,
+        'intro': post.intro,
+        'body': post.body,
+        'tags': ' '.join(tag.name for tag in post.tags),
+    }
+    for field, weight in FIELD_WEIGHTS:
+        for token in tokenize(fields[field]):
+            counts[token] += weight
+    return counts, sum(counts.values())
+
+
+def _remove(connection, post_ids):
+    connection.execute(search_postings.delete().where(search_postings.c.post_id.in_(post_ids)))
+    connection.execute(SearchDocument.__table__.delete().where(SearchDocument.post_id.in_(post_ids)))
+
+
+def index_posts(connection, posts):
+    """在给定连接上重建这些文章的索引"""
+    posts = list(posts)
+    if not posts:
+        return
+    _remove(connection, [post.id for post in posts])
+    postings, documents = [], []
+    for post in posts:
+        counts, length = document_terms(post)
+        postings.extend({'term': term, 'post_id': post.id, 'tf': tf} for term, tf in counts.items())
+        documents.append({'post_id': post.id, 'length': length})
+    if postings:
+        connection.execute(search_postings.insert(), postings)
+    connection.execute(SearchDocument.__table__.insert(), documents)
+
+
+def reindex(chunk=500):
+    """清空后重建整个索引，返回索引的文章数"""
+    connection = db.session.connection()
+    connection.execute(search_postings.delete())
+    connection.execute(SearchDocument.__table__.delete())
+    count = 0
+    last_id = 0
+    while True:
+        # 按 id 分批，标签用子查询一次取出
+        posts = Post.query.options(subqueryload(Post.tags)).\
+            filter(Post.id > last_id).order_by(Post.id).limit(chunk).all()
+        if not posts:
+            break
+        index_posts(connection, posts)
+        count += len(posts)
+        last_id = posts[-1].id
+        db.session.expunge_all()
+    db.session.commit()
+    return count
+
+
+def search(query, limit=20, offset=0, include_unpublished=False):
+    """
+    返回 (总命中数, [(文章 id, 分数), ...])。
+    命中查询中更多词的文章排在前面，命中词数相同时按 BM25 分数排序。
+    """
+    terms = list(set(tokenize(query)))
+    if not terms:
+        return 0, []
+    session = db.session
+    total_docs, avg_length = session.query(func.count(SearchDocument.post_id),
+                                           func.avg(SearchDocument.length)).one()
+    if not total_docs:
+        return 0, []
+    avg_length = float(avg_length or 1)
+
+    source = search_postings.join(SearchDocument.__table__,
+                                  SearchDocument.post_id == search_postings.c.post_id)
+    if not include_unpublished:
+        source = source.join(Post.__table__, Post.id == search_postings.c.post_id)
+
+    def matching(*columns):
+        query = select(list(columns)).select_from(source).where(search_postings.c.term.in_(terms))
+        if not include_unpublished:
+            query = query.where(Post.publish == True)
+        return query
+
+    # 每个词的文档频率只有查询词个数那么多行，idf 在这里算好，打分、排序和分页都交给数据库，
+    # 常见的二元组命中大半个语料时也不会把所有倒排记录取回来
+    doc_freq = dict(session.execute(matching(search_postings.c.term, func.count()).
+                                    group_by(search_postings.c.term)).fetchall())
+    if not doc_freq:
+        return 0, []
+    idf = dict((term, math.log(1 + (total_docs - n + 0.5) / (n + 0.5))) for term, n in doc_freq.items())
+
+    tf = search_postings.c.tf
+    weight = case([(search_postings.c.term == term, literal(value)) for term, value in idf.items()], else_=0.0)
+    norm = tf + literal(K1 * (1 - B)) + literal(K1 * B / avg_length) * SearchDocument.length
+    score = func.sum(weight * tf * literal(K1 + 1) / norm, type_=Float).label('score')
+    matched = func.count(search_postings.c.term)
+    post_id = search_postings.c.post_id
+    ranked = matching(post_id, score).group_by(post_id).\
+        order_by(matched.desc(), score.desc(), post_id.desc()).limit(limit).offset(offset)
+    total = session.execute(matching(func.count(func.distinct(post_id)))).scalar()
+    return total, [(row.post_id, row.score) for row in session.execute(ranked)]
+
+
+_INDEXED_ATTRS = ('title', 'intro', 'body', 'tags')
+
+
+@db.event.listens_for(Post, 'after_insert')
+def on_post_inserted(mapper, connection, target):
+    index_posts(connection, [target])
+
+
+@db.event.listens_for(Post, 'after_update')
+def on_post_updated(mapper, connection, target):
+    # 只有参与索引的字段变化时才重建，例如只改了 publish 或计数字段时跳过
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in _INDEXED_ATTRS):
+        index_posts(connection, [target])
+
+
+@db.event.listens_for(Post, 'before_delete')
+def on_post_deleted(mapper, connection, target):
+    _remove(connection, [target.id])
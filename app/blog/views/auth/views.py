@@ -6,9 +6,9 @@ from flask import render_template, redirect, request, url_for, flash, current_ap
 from flask_login import login_user, logout_user, login_required, current_user
 from flask_principal import (identity_changed, Identity,
                              AnonymousIdentity)
-from app.blog.models import User
+from app.blog.models import User, invalidate_identity
 from .forms import LoginForm, RegistrationForm, ChangePasswordForm, PasswordResetRequestForm, PasswordResetForm
-from app import db
+from app.extensions import db
 from app.email import send_email
 from app.blog import blog
 from app.permissions import permission_deny, permission_admin
@@ -80,9 +80,13 @@ def register():
 def change_password():
     form = ChangePasswordForm()
     if form.validate_on_submit():
-        if current_user.verify_password(form.old_password.data):
-            current_user.password = form.password.data
-            db.session.add(current_user)
+        # current_user 是身份缓存中的快照，修改密码要使用真正的 User 对象
+        user = User.query.get(current_user.id)
+        if user.verify_password(form.old_password.data):
+            user.password = form.password.data
+            db.session.add(user)
+            db.session.commit()
+            invalidate_identity(user.id)
             flash('你的密码已更新 (｡・`ω´･)')
             return redirect(url_for('blog.index'))
         else:
@@ -118,6 +122,7 @@ def password_reset(token):
         if user is None:
             return redirect(url_for('main.index'))
         if user.reset_password(token, form.password.data):
+            invalidate_identity(user.id)
             flash('你的密码已更新 (｡・`ω´･)')
             return redirect(url_for('blog.login'))
         else:
@@ -2,49 +2,126 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import print_function, unicode_literals, absolute_import
-from flask import render_template, redirect, url_for, abort, flash, request, current_app, make_response
+from collections import namedtuple
+from datetime import datetime
+from flask import render_template, redirect, url_for, abort, flash, request, current_app, make_response, jsonify
 from flask_login import login_required, current_user
-from flask_sqlalchemy import get_debug_queries
-from app.blog.models import Role, User, Post, Comment, Category, HomePage, Tag
-from app import db, cache
+from sqlalchemy import func
+from flask_sqlalchemy import Pagination
+from flask_wtf.csrf import generate_csrf, validate_csrf
+from wtforms import ValidationError
+from app.blog.models import Role, User, Post, Comment, Category, HomePage, Tag, invalidate_identity
+from app.extensions import db, cache, view_counter, page_cache, sql_monitor, profiler
+from app.conditional import make_etag, not_modified, set_validators
+from ..queries import listing_query
+from ..pagination import keyset_paginate
+from ..search import search as search_posts
 from .forms import EditProfileForm, EditProfileAdminForm, PostForm, CommentForm
 from .. import blog
-from app.permissions import permission_blogger, permission_admin
+from app.permissions import permission_blogger, permission_admin, permission_moderator
 
 
 # 为会出现分类列表的排序做准备，涉及到路由'/post/<int:id>'、'/article'和'/article/<category_name>'
+# 分类及其文章数用一条分组查询取出并放进缓存，文章新建、修改、删除时调用 invalidate_category_counts() 清除
+CATEGORY_COUNTS_KEY = 'blog/category_counts'
+CategoryCount = namedtuple('CategoryCount', ['id', 'category_name', 'post_count'])
+
+
 def sort_category():
-    if Category.query.all():
-        category = Category.query.all()
-        dict_cg = {}
-        for i in category:
-            dict_cg[i] = i.posts.count()
-        category = sorted(dict_cg, key=dict_cg.__getitem__, reverse=True)
-        return category
+    categories = cache.get(CATEGORY_COUNTS_KEY)
+    if categories is None:
+        post_count = func.count(Post.id)
+        rows = db.session.query(Category.id, Category.category_name, post_count).\
+            outerjoin(Post, Post.category_id == Category.id).\
+            group_by(Category.id, Category.category_name).\
+            order_by(post_count.desc()).all()
+        categories = [CategoryCount(*row) for row in rows]
+        cache.set(CATEGORY_COUNTS_KEY, categories,
+                  timeout=current_app.config['FLASKY_CATEGORY_CACHE_TIMEOUT'])
+    return categories
+
+
+def invalidate_category_counts():
+    cache.delete(CATEGORY_COUNTS_KEY)
+
+
+# 列表页的 ETag 由这一页文章的版本数据、翻页位置、侧边栏和访问者的权限类别算出，不需要渲染模板
+def listing_etag(posts, pagination, categories):
+    return make_etag('listing', page_cache.viewer_class(),
+                     pagination.prev_cursor, pagination.next_cursor, categories,
+                     [(post.id, post.last_modified_date, post.comment_count) for post in posts])
 
 
 # 报告缓慢的数据库查询
 """
-这个功能使用 after_app_request 处理程序实现,它和 before_app_request 处理程序的工作方式类似,只不过在视图函数处理完请求之后执行。
-Flask 把响应对象传给 after_app_ request 处理程序,以防需要修改响应。
-在这里,after_app_request 处理程序没有修改响应,只是获取 Flask-SQLAlchemy 记录 的查询时间并把缓慢的查询写入日志。
-
+慢查询日志、每个请求的查询次数和 Server-Timing 响应头都由 app.sql_monitor 在请求钩子里完成，
+这里只提供一个管理员查看各 endpoint 汇总数据（包括疑似 N+1 的语句）的入口。
 """
 
 
-@blog.after_app_request
-def after_request(response):
-    """
-    get_debug_queries() 函数返回一个列表,其元素是请求中执行的查询
-    遍历 get_debug_queries() 函数获取的列表,把持续时间比设定阈值长的查询写入日志。
-    写入的日志被设为“警告”等级。如果换成“错误”等级,发 现缓慢的查询时还会发送电子邮件。
-    """
-    for query in get_debug_queries():
-        if query.duration >= current_app.config['FLASKY_SLOW_DB_QUERY_TIME']:
-            current_app.logger.warning(
-                'Slow query: %s\nParameters: %s\nDuration: %fs\nContext: %s\n'
-                % (query.statement, query.parameters, query.duration, query.context))
-    return response
+@blog.route('/admin/sql-stats')
+@login_required
+@permission_admin.require(403)
+def sql_stats():
+    return jsonify(sql_monitor.endpoint_stats())
+
+
+# 会改变状态的管理操作只接受 POST，CSRF token 放在表单字段 csrf_token 或请求头 X-CSRFToken 里；
+# token 由对应的 GET 状态接口返回
+def check_csrf():
+    if current_app.config.get('WTF_CSRF_ENABLED', True):
+        try:
+            validate_csrf(request.form.get('csrf_token') or request.headers.get('X-CSRFToken'))
+        except ValidationError:
+            abort(400)
+
+
+# 当前 worker 进程的连接池状态（附带 csrf_token），POST reset 清零等待时间等累计数据
+@blog.route('/admin/pool-stats')
+@login_required
+@permission_admin.require(403)
+def pool_stats():
+    return jsonify(dict(db.pool_status(), csrf_token=generate_csrf()))
+
+
+@blog.route('/admin/pool-stats/reset', methods=['POST'])
+@login_required
+@permission_admin.require(403)
+def pool_stats_reset():
+    check_csrf()
+    pool = db.get_engine(current_app._get_current_object()).pool
+    if hasattr(pool, 'reset_stats'):
+        pool.reset_stats()
+    return jsonify(db.pool_status())
+
+
+# 采样分析器：GET 查看状态（附带 csrf_token），GET folded 下载 collapsed stack（可用 ?endpoint= 过滤）
+@blog.route('/admin/profiler')
+@login_required
+@permission_admin.require(403)
+def profiler_status():
+    return jsonify(dict(profiler.status(), csrf_token=generate_csrf()))
+
+
+@blog.route('/admin/profiler/folded')
+@login_required
+@permission_admin.require(403)
+def profiler_folded():
+    return current_app.response_class(profiler.collapsed(request.args.get('endpoint')),
+                                      mimetype='text/plain')
+
+
+# on / off 打开关闭，reset 清空数据
+@blog.route('/admin/profiler/<any(on, off, reset):action>', methods=['POST'])
+@login_required
+@permission_admin.require(403)
+def profiler_switch(action):
+    check_csrf()
+    if action == 'reset':
+        profiler.reset()
+    else:
+        profiler.switch(action == 'on')
+    return jsonify(profiler.status())
 
 
 """
@@ -75,15 +152,8 @@ def index():
         homepages = HomePage(view_times=1)
         db.session.add(homepages)
         db.session.commit()
-    try:
-        if homepages.view_times > 0:
-            homepages.view_times += 1
-        else:
-            homepages.view_times = 1
-        db.session.add(homepages)
-        db.session.commit()
-    except:
-        pass
+    # 访问计数先记在内存缓冲里，定期批量写回，不在每次 GET 时提交事务
+    view_counter.hit(HomePage, homepages.id)
     return render_template('index.html')
 
 
@@ -94,7 +164,7 @@ def user(username):
         abort(404)
         # 用户发布的博客文章列表通过 User.posts 关系获取,User.posts 返回的是查询对象,
         # 因此可在其上调用过滤器,例如 order_by()。
-    posts = user.posts.order_by(Post.post_date.desc()).all()
+    posts = listing_query(user.posts).order_by(Post.post_date.desc()).all()
     return render_template('user.html', user=user, posts=posts)
 
 
@@ -102,18 +172,20 @@ def user(username):
 @login_required
 def edit_profile():
     form = EditProfileForm()
+    # current_user 是身份缓存中的快照，修改资料要使用真正的 User 对象
+    user = User.query.get_or_404(current_user.id)
     if form.validate_on_submit():
-        current_user.name = form.name.data
-        current_user.location = form.location.data
-        current_user.about_me = form.about_me.data
-        db.session.add(current_user)
+        user.name = form.name.data
+        user.location = form.location.data
+        user.about_me = form.about_me.data
+        db.session.add(user)
         db.session.commit()
         flash('资料已更新 (｡・`ω´･)')
-        return redirect(url_for('.user', username=current_user.username))
+        return redirect(url_for('.user', username=user.username))
     # 为所有字段设定了初始值
-    form.name.data = current_user.name
-    form.location.data = current_user.location
-    form.about_me.data = current_user.about_me
+    form.name.data = user.name
+    form.location.data = user.location
+    form.about_me.data = user.about_me
     return render_template('edit_profile.html', form=form)
 
 
@@ -135,6 +207,7 @@ def edit_profile_admin(id):
         user.about_me = form.about_me.data
         db.session.add(user)
         db.session.commit()
+        invalidate_identity(user.id)
         flash('资料已更新 (｡・`ω´･)')
         return redirect(url_for('.user', username=user.username))
     form.email.data = user.email
@@ -152,6 +225,15 @@ def edit_profile_admin(id):
 def post(id):
     post = Post.query.get_or_404(id)
     post.body_show = True
+    # 匿名访问者看到的页面里没有评论表单（也就没有 CSRF 令牌），可以先用版本数据做条件 GET
+    etag = None
+    if request.method == 'GET' and not current_user.is_authenticated:
+        etag = make_etag('post', post.id, post.last_modified_date, post.comment_count,
+                         post.enabled_comment_count, request.args.get('page'), sort_category())
+        response = not_modified(etag)
+        if response is not None:
+            view_counter.hit(Post, post.id)
+            return response
     # 这个视图函数实例化了一个评论表单,并将其转入 post.html 模板,以便渲染。
     input_hint = '''### h3标题（注意：换行是先敲两个空格再敲回车！）  
 ***  
@@ -169,11 +251,12 @@ def post(id):
     form = CommentForm(body=input_hint)
     # 提交表单 后,插入新评论的逻辑和处理博客文章的过程差不多
     if form.validate_on_submit():
-        # 和 Post 模型一样,评论的 author 字段也不能直接设为 current_user,因为这个变量是上下文代理对象。
-        # 真正的 User 对象要 使用表达式 current_user._get_current_object() 获取。
-        comment = Comment(body=form.body.data, post=post, author=current_user._get_current_object())
+        # 和 Post 模型一样,评论的 author 字段也不能直接设为 current_user,因为这个变量是上下文代理对象,
+        # 代理的也只是身份缓存中的快照,所以这里直接设置 author_id。
+        comment = Comment(body=form.body.data, post=post, author_id=current_user.id)
         db.session.add(comment)
         db.session.commit()
+        page_cache.invalidate('post:%d' % post.id)
         flash('评论已提交 (｡・`ω´･)')
         # 提交评论后,请求结果是一个重定 向,转回之前的 URL,但是在 url_for() 函数的参数中把 page 设为 -1,
         # 这是个特殊的页 数,用来请求评论的最后一页,所以刚提交的评论才会出现在页面中。
@@ -182,7 +265,7 @@ def post(id):
     page = request.args.get('page', 1, type=int)
     if page == -1:
         # " // "来表示整数除法，返回不大于结果的一个最大的整数，而" / " 则单纯的表示浮点数除法
-        page = (post.comments.count() - 1) // \
+        page = (post.comment_count - 1) // \
                current_app.config['FLASKY_COMMENTS_PER_PAGE'] + 1
     # 文章的评论列表通过 post.comments 一对多关系获取,按照时间戳顺序进行排列,再使 用与博客文章相同的技术分页显示。
     pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(
@@ -190,15 +273,13 @@ def post(id):
         error_out=False)
     comments = pagination.items
     category = sort_category()
-    if post.view_times > 0:
-        post.view_times += 1
-    else:
-        post.view_times = 1
-    db.session.add(post)
-    db.session.commit()
+    view_counter.hit(Post, post.id)
     # 评论列表对象和分页对象都传入了模板,以便渲染。
-    return render_template('post.html', posts=[post], form=form, categories=category, comments=comments,
-                           pagination=pagination)
+    response = make_response(render_template('post.html', posts=[post], form=form, categories=category,
+                                             comments=comments, pagination=pagination))
+    if etag is not None:
+        set_validators(response, etag)
+    return response
     # 评论的渲染过程在新模板 _comments.html 中进行,类似于 _posts.html,但使用的 CSS 类不 同。
     # _comments.html 模板要引入 post.html 中,放在文章正文下方,后面再显示分页导航。
 
@@ -217,15 +298,17 @@ def edit(id):
     post = Post.query.get_or_404(id)
     if post.category_id:
         category = Category.query.get_or_404(post.category_id)
+    old_category_id = post.category_id
     if current_user.id != post.author_id:
         abort(403)
     # 这里使用 的 PostForm 表单类和首页中使用的是同一个。
     form = PostForm()
     if form.validate_on_submit():
         post.title = form.title.data
+        post.last_modified_date = datetime.utcnow()
         post.intro = form.intro.data
         post.body = form.body.data
-        post.tags = [Tag.get_tag(t_n.strip()) for t_n in form.tags.data.split(',') if t_n]
+        post.tags = Tag.get_tags(form.tags.data.split(','))
         if form.category.data:
             category_name_exists = Category.query.filter_by(category_name=form.category.data).first()
             if not category_name_exists:
@@ -237,6 +320,9 @@ def edit(id):
                 post.category_id = category_name_exists.id
         db.session.add(post)
         db.session.commit()
+        invalidate_category_counts()
+        page_cache.invalidate('post:%d' % post.id, 'categories',
+                              'category:%s' % old_category_id, 'category:%s' % post.category_id)
         flash('文章已提交 (｡・`ω´･)')
         return redirect(url_for('.post', id=post.id))
     form.title.data = post.title
@@ -274,12 +360,11 @@ def show_followed():
 @login_required
 @permission_blogger.require(403)
 def moderate():
-    page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False)
+    cursor = request.args.get('cursor')
+    pagination = keyset_paginate(Comment.query, Comment.timestamp, Comment.id, cursor,
+                                 per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'])
     comments = pagination.items
-    return render_template('moderate.html', comments=comments, pagination=pagination, page=page)
+    return render_template('moderate.html', comments=comments, pagination=pagination, cursor=cursor)
 
 
 """
@@ -297,7 +382,7 @@ def moderate_enable(id):
     comment.disabled = False
     db.session.add(comment)
     db.session.commit()
-    return redirect(url_for('.moderate', page=request.args.get('page', 1, type=int)))
+    return redirect(url_for('.moderate', cursor=request.args.get('cursor')))
 
 
 @blog.route('/moderate/disable/<int:id>')
@@ -308,7 +393,7 @@ def moderate_disable(id):
     comment.disabled = True
     db.session.add(comment)
     db.session.commit()
-    return redirect(url_for('.moderate', page=request.args.get('page', 1, type=int)))
+    return redirect(url_for('.moderate', cursor=request.args.get('cursor')))
 
 
 @blog.route('/article_new', methods=['GET', 'POST'])
@@ -317,15 +402,17 @@ def article_new():
     form = PostForm()
     if request.method == 'POST' and form.validate_on_submit():
         post_obj = Post(title=form.title.data, intro=form.intro.data, body=form.body.data,
-                        author=current_user._get_current_object(),
+                        author_id=current_user.id,
                         category=Category.query.get(form.category.data))
-        post_obj.tags.extend([Tag.get_tag(t_n.strip()) for t_n in form.tags.data.split(',') if t_n])
+        post_obj.tags.extend(Tag.get_tags(form.tags.data.split(',')))
         try:
             db.session.add(post_obj)
         except Exception:
             db.session.rollback()
         else:
             db.session.commit()
+            invalidate_category_counts()
+            page_cache.invalidate('posts', 'categories', 'category:%s' % post_obj.category_id)
         return redirect(url_for('.article'))
     # form.category.data = Category.query.first_or_404()
     return render_template('article_new.html', form=form)
@@ -334,23 +421,28 @@ def article_new():
 
 
 @blog.route('/article', methods=['GET', 'POST'])
-@cache.cached(timeout=120, key_prefix='home/%s')
+@page_cache.cached(timeout=120)
 def article():
-    page = request.args.get('page', 1, type=int)
-    query = Post.query
-    pagination = query.order_by(Post.post_date.desc()).paginate(
-        page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
+    page_cache.tag('posts', 'categories')
+    pagination = keyset_paginate(listing_query(), Post.post_date, Post.id, request.args.get('cursor'),
+                                 per_page=current_app.config['FLASKY_POSTS_PER_PAGE'])
     # posts = Post.query.order_by(Post.post_date.desc()).all()
     posts = pagination.items
     category = sort_category()
+    page_cache.tag(*['post:%d' % post.id for post in posts])
+    etag = listing_etag(posts, pagination, category)
+    response = not_modified(etag)
+    if response is not None:
+        return response
     for post in posts:
         post.body_show = False
-    return render_template('article.html', posts=posts, categories=category, show_followed=show_followed,
-                           pagination=pagination)
+    return set_validators(make_response(render_template('article.html', posts=posts, categories=category,
+                                                        show_followed=show_followed, pagination=pagination)),
+                          etag)
 
 
 @blog.route('/article/<category_name>', methods=['GET', 'POST'])
+@page_cache.cached(timeout=120)
 def article_category_name(category_name):
     # form = PostForm()
     # if current_user.can(Permission.WRITE_ARTICLES) and form.validate_on_submit():
@@ -358,19 +450,43 @@ def article_category_name(category_name):
     # author=current_user._get_current_object())
     #     db.session.add(post)
     #     return redirect(url_for('.article'))
-    page = request.args.get('page', 1, type=int)
-    if not Category.query.filter_by(category_name=category_name).all():
-        abort(404)
+    page_cache.tag('categories')
     _category = Category.query.filter_by(category_name=category_name).first()
-    pagination = Post.query.filter_by(category_id=_category.id).order_by(Post.post_date.desc()).paginate(
-        page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
+    if _category is None:
+        abort(404)
+    page_cache.tag('category:%d' % _category.id)
+    pagination = keyset_paginate(listing_query().filter_by(category_id=_category.id),
+                                 Post.post_date, Post.id, request.args.get('cursor'),
+                                 per_page=current_app.config['FLASKY_POSTS_PER_PAGE'])
     posts = pagination.items
     category = sort_category()
+    page_cache.tag(*['post:%d' % post.id for post in posts])
+    etag = listing_etag(posts, pagination, category)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    for post in posts:
+        post.body_show = False
+    return set_validators(make_response(render_template('article.html', posts=posts, categories=category,
+                                                        show_followed=show_followed, pagination=pagination)),
+                          etag)
+
+
+@blog.route('/search')
+def search():
+    # 结果按相关度排序，不能用键集分页，这里只对命中的文章 id 做偏移分页
+    q = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = current_app.config['FLASKY_POSTS_PER_PAGE']
+    total, hits = search_posts(q, limit=per_page, offset=(page - 1) * per_page,
+                               include_unpublished=permission_moderator.can())
+    ids = [post_id for post_id, score in hits]
+    posts = dict((post.id, post) for post in listing_query().filter(Post.id.in_(ids))) if ids else {}
+    posts = [posts[post_id] for post_id in ids if post_id in posts]
     for post in posts:
         post.body_show = False
-    return render_template('article.html', posts=posts, categories=category, show_followed=show_followed,
-                           pagination=pagination)
+    pagination = Pagination(None, page, per_page, total, posts)
+    return render_template('search.html', q=q, posts=posts, pagination=pagination)
 
 
 @blog.route('/delete-article/<int:id>')
@@ -380,6 +496,8 @@ def delete_article(id):
     post = Post.query.get_or_404(id)
     db.session.delete(post)
     db.session.commit()
+    invalidate_category_counts()
+    page_cache.invalidate('post:%d' % id, 'posts', 'categories', 'category:%s' % post.category_id)
     flash('你已成功删除了文章《%s》' % post.title)
     return redirect(url_for('.article'))
 
@@ -391,23 +509,24 @@ def delete_comment(id):
     comment = Comment.query.get_or_404(id)
     db.session.delete(comment)
     db.session.commit()
+    page_cache.invalidate('post:%s' % comment.post_id)
     flash('你已成功删除了文章《%s》的评论"%s"' % (comment.comment_of_which_post, comment.body))
-    return redirect(url_for('.moderate', page=request.args.get('page', 1, type=int)))
+    return redirect(url_for('.moderate', cursor=request.args.get('cursor')))
 
 
 @blog.route('/resume')
-@cache.cached(timeout=120, key_prefix='home/%s')
+@page_cache.cached(timeout=120)
 def resume():
     return render_template('resume.html')
 
 
 @blog.route('/contact')
-@cache.cached(timeout=120, key_prefix='home/%s')
+@page_cache.cached(timeout=120)
 def contact():
     return render_template('contact.html')
 
 
 @blog.route('/lab')
-@cache.cached(timeout=120, key_prefix='home/%s')
+@page_cache.cached(timeout=120)
 def lab():
     return render_template('lab.html')
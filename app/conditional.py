@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+条件 GET（ETag / Last-Modified / 304）
+
+视图在渲染模板之前先用版本数据（文章 id、最后修改时间、评论数等）算出验证器，
+浏览器或反向代理带着 If-None-Match / If-Modified-Since 来重新验证时，
+如果内容没有变化就直接返回 304，不再执行分页查询和模板渲染。
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+from flask import request, session, current_app
+from flask_login import current_user
+import hashlib
+
+
+def make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def set_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # 每次使用前都要重新验证；登录用户的页面不允许共享缓存保存
+    response.cache_control.no_cache = True
+    if current_user.is_authenticated:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    return response
+
+
+def not_modified(etag, last_modified=None):
+    """请求携带的验证器仍然有效时返回 304 响应，否则返回 None"""
+    if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+        return None
+    if request.if_none_match:
+        matched = request.if_none_match.contains(etag)
+    elif last_modified is not None and request.if_modified_since:
+        # HTTP 日期只精确到秒
+        matched = last_modified.replace(microsecond=0) <= request.if_modified_since
+    else:
+        matched = False
+    if not matched:
+        return None
+    return set_validators(current_app.response_class(status=304), etag, last_modified)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+浏览计数的写回缓冲（write-behind）
+
+每次访问只在内存中累加增量，达到数量或时间阈值时（以及进程退出时）
+把所有增量合并成批量的 UPDATE ... SET view_times = view_times + n 语句写入数据库。
+这样热门的只读页面不再变成写事务，并发的 gunicorn worker 之间也不会互相覆盖计数。
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+from collections import defaultdict
+from threading import Lock
+from flask import has_app_context
+from sqlalchemy import bindparam, func
+import atexit
+import time
+
+
+class ViewCounter(object):
+    def __init__(self, db, app=None):
+        self.db = db
+        self.app = None
+        self.flush_size = 100
+        self.flush_interval = 30
+        self._pending = defaultdict(int)
+        self._lock = Lock()
+        self._last_flush = time.time()
+        self._flush_registered = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        # 待写入的不同计数器数量达到 flush_size，或距上次写入超过 flush_interval 秒，就触发一次写入
+        self.flush_size = app.config.setdefault('VIEW_COUNTER_FLUSH_SIZE', 100)
+        self.flush_interval = app.config.setdefault('VIEW_COUNTER_FLUSH_INTERVAL', 30)
+        app.extensions['view_counter'] = self
+        # worker 正常退出时把剩余的增量写回去；多次 create_app 时只注册一次
+        if not self._flush_registered:
+            atexit.register(self.flush)
+            self._flush_registered = True
+
+    def hit(self, model, ident, n=1):
+        """记录一次访问，model 是带有 view_times 字段的模型类"""
+        with self._lock:
+            self._pending[(model.__table__, ident)] += n
+            due = (len(self._pending) >= self.flush_size or
+                   time.time() - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def pending(self, model, ident):
+        """返回尚未写入数据库的增量，页面显示时加到 view_times 上即可得到接近实时的数值"""
+        return self._pending.get((model.__table__, ident), 0)
+
+    def flush(self):
+        if self.app is not None and not has_app_context():
+            # atexit 调用时没有应用上下文；已有上下文时不能再推一个，它结束时会清掉当前的 db.session
+            with self.app.app_context():
+                return self.flush()
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+            self._last_flush = time.time()
+        if not pending or self.app is None:
+            return
+
+        batches = defaultdict(list)
+        for (table, ident), n in pending.items():
+            batches[table].append({'_id': ident, '_n': n})
+
+        try:
+            # 使用独立的连接和事务，不干扰当前请求的 db.session
+            with self.db.get_engine(self.app).begin() as conn:
+                for table, params in batches.items():
+                    stmt = table.update().\
+                        where(table.c.id == bindparam('_id')).\
+                        values(view_times=func.coalesce(table.c.view_times, 0) + bindparam('_n'))
+                    conn.execute(stmt, params)
+        except Exception:
+            # 写入失败时把增量放回去，等待下一次写入
+            with self._lock:
+                for key, n in pending.items():
+                    self._pending[key] += n
+            self.app.logger.exception('Failed to flush view counters')
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+数据库引擎和连接池的统一配置
+
+整个应用只有 Flask-SQLAlchemy 管理的一个引擎，连接池参数全部来自配置：
+SQLALCHEMY_POOL_SIZE / SQLALCHEMY_MAX_OVERFLOW / SQLALCHEMY_POOL_TIMEOUT / SQLALCHEMY_POOL_RECYCLE
+由 Flask-SQLAlchemy 读取，这里在 apply_driver_hacks 中把连接池换成 MonitoredQueuePool，
+并按 SQLALCHEMY_POOL_PRE_PING 在每次取出连接时先 SELECT 1 检查连接是否还活着
+（SQLAlchemy 1.1 还没有 pool_pre_ping，这里用的是官方文档里 checkout 事件的做法，检查失败时连接池会换一个新连接）。
+
+MonitoredQueuePool 记录取连接的次数、等待时间和超时次数，db.pool_status() 返回这些数据以及当前借出、溢出的连接数，
+可以据此为每个 gunicorn worker 设置合适的连接池大小。
+
+配置了 SQLALCHEMY_REPLICA_URIS 时，每个只读副本注册为一个 bind（replica0、replica1……），
+RoutingSession 把 GET/HEAD 请求中的 SELECT 随机发到某个副本，其余语句和写操作都走主库。
+为了让用户马上看到自己刚写入的数据，提交过写操作的用户在之后 SQLALCHEMY_REPLICA_STICKY_SECONDS 秒内的请求
+全部走主库（时间记在 Flask session 里）；同一个请求里写过之后的读也走主库。
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+from threading import Lock
+from flask import current_app, request, session, has_request_context
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy, SignallingSession
+from sqlalchemy import event, exc, orm
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.selectable import Select, CompoundSelect
+import os
+import random
+import time
+
+REPLICA_BIND = 'replica%d'
+# Flask session 里记录最近一次写操作时间的键
+LAST_WRITE_KEY = '_db_last_write'
+
+# SQLite 文件数据库用 NullPool，内存数据库用 StaticPool，这些参数对它们无效
+_QUEUE_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle')
+
+
+def _ping_connection(dbapi_connection, connection_record, connection_proxy):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+    except Exception:
+        # 连接池收到 DisconnectionError 后会丢弃这个连接并重新连接
+        raise exc.DisconnectionError()
+    finally:
+        cursor.close()
+
+
+class MonitoredQueuePool(QueuePool):
+    def __init__(self, creator, ping_on_checkout=False, **kw):
+        super(MonitoredQueuePool, self).__init__(creator, **kw)
+        self.ping_on_checkout = ping_on_checkout
+        if ping_on_checkout and not event.contains(self, 'checkout', _ping_connection):
+            event.listen(self, 'checkout', _ping_connection)
+        self._stats_lock = Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def _do_get(self):
+        # 包括在队列里等待空闲连接和新建连接的时间
+        started = time.time()
+        try:
+            return super(MonitoredQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.time() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_time += waited
+                self.max_wait = max(self.max_wait, waited)
+
+    def recreate(self):
+        pool = super(MonitoredQueuePool, self).recreate()
+        pool.ping_on_checkout = self.ping_on_checkout
+        return pool
+
+    def status(self):
+        with self._stats_lock:
+            return {
+                'pid': os.getpid(),
+                'pool_size': self.size(),
+                'max_overflow': self._max_overflow,
+                'checked_in': self.checkedin(),
+                'checked_out': self.checkedout(),
+                'overflow': max(self.overflow(), 0),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'avg_wait_ms': self.wait_time * 1000 / self.checkouts if self.checkouts else 0.0,
+                'max_wait_ms': self.max_wait * 1000,
+                'pre_ping': self.ping_on_checkout,
+            }
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.checkouts = self.timeouts = 0
+            self.wait_time = self.max_wait = 0.0
+
+
+class RoutingSession(SignallingSession):
+    def __init__(self, db, *args, **kwargs):
+        super(RoutingSession, self).__init__(db, *args, **kwargs)
+        # SignallingSession 只保存了 app，选择只读副本的引擎时还要用到 db
+        self.db = db
+        self.wrote = False
+
+    def _use_replica(self, clause):
+        if not isinstance(clause, (Select, CompoundSelect)) or self.wrote:
+            return False
+        if not self.app.config['SQLALCHEMY_REPLICA_URIS'] or not has_request_context():
+            return False
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        last_write = session.get(LAST_WRITE_KEY)
+        return last_write is None or \
+            time.time() - last_write >= self.app.config['SQLALCHEMY_REPLICA_STICKY_SECONDS']
+
+    def get_bind(self, mapper=None, clause=None):
+        info = getattr(getattr(mapper, 'mapped_table', None), 'info', {})
+        # 显式指定了其他 bind 的模型不参与路由
+        if not info.get('bind_key') and self._use_replica(clause):
+            index = random.randrange(len(self.app.config['SQLALCHEMY_REPLICA_URIS']))
+            return self.db.get_engine(self.app, bind=REPLICA_BIND % index)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _on_flush(db_session, flush_context):
+    db_session.wrote = True
+
+
+def _mark_write():
+    session[LAST_WRITE_KEY] = time.time()
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _on_commit(db_session):
+    if db_session.wrote and has_request_context():
+        _mark_write()
+    db_session.wrote = False
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _on_rollback(db_session):
+    db_session.wrote = False
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+    def init_app(self, app):
+        replicas = app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('SQLALCHEMY_REPLICA_STICKY_SECONDS', 10)
+        if replicas:
+            binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+            binds.update((REPLICA_BIND % i, uri) for i, uri in enumerate(replicas))
+            app.config['SQLALCHEMY_BINDS'] = binds
+        super(SQLAlchemy, self).init_app(app)
+
+        if replicas:
+            @app.after_request
+            def mark_pending_write(response):
+                # SQLALCHEMY_COMMIT_ON_TEARDOWN 的提交发生在 session cookie 写出之后，这里提前记下
+                db_session = self.session()
+                if db_session.wrote or db_session.new or db_session.dirty or db_session.deleted:
+                    _mark_write()
+                return response
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        super(SQLAlchemy, self).apply_driver_hacks(app, info, options)
+        if info.drivername.startswith('sqlite'):
+            for name in _QUEUE_POOL_OPTIONS:
+                options.pop(name, None)
+            return
+        options['poolclass'] = MonitoredQueuePool
+        options['ping_on_checkout'] = app.config.get('SQLALCHEMY_POOL_PRE_PING', True)
+
+    def pool_status(self, app=None):
+        pool = self.get_engine(app or current_app._get_current_object()).pool
+        if isinstance(pool, MonitoredQueuePool):
+            return pool.status()
+        return {'pid': os.getpid(), 'pool': type(pool).__name__, 'status': pool.status()}
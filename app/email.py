@@ -4,13 +4,7 @@
 from __future__ import print_function, unicode_literals, absolute_import
 from flask import render_template, current_app
 from flask_mail import Message
-from threading import Thread
-from .extensions import mail_engine
-
-
-def __send_async_email(cur_app, msg):
-    with cur_app.app_context():
-        mail_engine.send(msg)
+from .extensions import mail_dispatcher
 
 
 def send_email(to, subject, template, **kwargs):
@@ -18,9 +12,5 @@ def send_email(to, subject, template, **kwargs):
                   sender=current_app.config['FLASKY_MAIL_SENDER'], recipients=[to])
     msg.body = render_template(template + '.txt', **kwargs)
     msg.html = render_template(template + '.html', **kwargs)
-    fork = Thread(target=__send_async_email, args=[current_app, msg])
-    fork.start()
-    return fork
-
-
-
+    # 交给发信队列，由固定数量的后台线程复用 SMTP 连接发送
+    return mail_dispatcher.submit(msg)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+错误日志邮件
+
+请求线程里只把日志记录放进有界队列（ErrorQueueHandler，队列满了直接丢弃并计数，从不阻塞），
+QueueListener 在后台线程里把记录交给 DigestMailHandler。
+DigestMailHandler 按指纹（日志来源、代码位置、异常类型、去掉数字后的消息）合并相同的错误，
+每隔 ERROR_MAIL_DIGEST_INTERVAL 秒把这段时间内的错误和各自的次数汇总成一封邮件发出。
+每小时最多发送 ERROR_MAIL_MAX_PER_HOUR 封，超出后继续累计，到下一个小时再发。
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+from collections import OrderedDict
+from datetime import datetime
+from email.message import EmailMessage
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue, Full
+from threading import Thread, Event, Lock
+import atexit
+import hashlib
+import logging
+import re
+import smtplib
+import time
+
+_DIGITS_RE = re.compile(r'\d+')
+# 已经安装过错误邮件的 logger -> (QueueListener, DigestMailHandler)
+_installed = {}
+_install_lock = Lock()
+
+
+def fingerprint(record):
+    exc_type = record.exc_info[0].__name__ if record.exc_info and record.exc_info[0] else ''
+    first_line = record.getMessage().split('\n', 1)[0]
+    raw = '|'.join((record.name, record.pathname, str(record.lineno), exc_type,
+                    _DIGITS_RE.sub('#', first_line)))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class ErrorQueueHandler(QueueHandler):
+    """请求线程使用的 handler：计算指纹后放进队列，队列满时丢弃"""
+
+    def __init__(self, queue):
+        super(ErrorQueueHandler, self).__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # prepare 会把异常格式化进消息并清掉 exc_info，指纹要在这之前算
+        record.fingerprint = fingerprint(record)
+        return super(ErrorQueueHandler, self).prepare(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+
+class DigestMailHandler(logging.Handler):
+    def __init__(self, mailhost, fromaddr, toaddrs, subject, credentials=None, use_ssl=False,
+                 interval=60, max_per_window=10, window=3600):
+        super(DigestMailHandler, self).__init__()
+        self.mailhost = mailhost
+        self.fromaddr = fromaddr
+        self.toaddrs = toaddrs
+        self.subject = subject
+        self.credentials = credentials
+        self.use_ssl = use_ssl
+        self.interval = interval
+        self.max_per_window = max_per_window
+        self.window = window
+        self.pending = OrderedDict()
+        # 前面的 ErrorQueueHandler，用于在邮件里报告被丢弃的记录数
+        self.source = None
+        self._reported_drops = 0
+        self._sent = []
+        self._lock = Lock()
+        self._stopped = Event()
+        self._timer = None
+
+    def start(self):
+        self._timer = Thread(target=self._run, name='error-mail-digest')
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.flush()
+
+    def emit(self, record):
+        fp = getattr(record, 'fingerprint', None) or fingerprint(record)
+        with self._lock:
+            entry = self.pending.get(fp)
+            if entry is None:
+                self.pending[fp] = {'count': 1, 'first': record.created, 'last': record.created,
+                                    'text': self.format(record)}
+            else:
+                entry['count'] += 1
+                entry['last'] = record.created
+
+    def _allowed(self, now):
+        self._sent = [t for t in self._sent if now - t < self.window]
+        return len(self._sent) < self.max_per_window
+
+    def flush(self):
+        now = time.time()
+        with self._lock:
+            if not self.pending or not self._allowed(now):
+                return
+            pending, self.pending = self.pending, OrderedDict()
+        dropped = self.source.dropped - self._reported_drops if self.source is not None else 0
+        try:
+            self.send(self.subject + ' (%d)' % sum(e['count'] for e in pending.values()),
+                      self.render(pending, dropped))
+            # 只有发送成功的邮件才占用每小时的配额，丢弃数也在发出去之后才算已报告
+            with self._lock:
+                self._sent.append(now)
+                self._reported_drops += dropped
+        except Exception:
+            # 发送失败时放回去，下一轮和新的错误一起发
+            with self._lock:
+                for fp, entry in pending.items():
+                    current = self.pending.get(fp)
+                    if current is None:
+                        self.pending[fp] = entry
+                    else:
+                        current['count'] += entry['count']
+                        current['first'] = entry['first']
+
+    def render(self, pending, dropped=0):
+        def fmt(ts):
+            return datetime.utcfromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+        parts = []
+        if dropped:
+            parts.append('%d log records were dropped because the queue was full.\n' % dropped)
+        for entry in sorted(pending.values(), key=lambda e: -e['count']):
+            parts.append('%d occurrence(s), first %s UTC, last %s UTC\n\n%s\n'
+                         % (entry['count'], fmt(entry['first']), fmt(entry['last']), entry['text']))
+        return ('\n' + '-' * 70 + '\n').join(parts)
+
+    def send(self, subject, body):
+        msg = EmailMessage()
+        msg['From'] = self.fromaddr
+        msg['To'] = ', '.join(self.toaddrs)
+        msg['Subject'] = subject
+        msg.set_content(body)
+        host, port = self.mailhost
+        smtp = (smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP)(host, port, timeout=10)
+        try:
+            if self.credentials and self.credentials[0]:
+                smtp.login(*self.credentials)
+            smtp.send_message(msg)
+        finally:
+            smtp.quit()
+
+    def close(self):
+        self._stopped.set()
+        self.flush()
+        super(DigestMailHandler, self).close()
+
+
+def _stop_all():
+    for listener, digest in list(_installed.values()):
+        listener.stop()
+        digest.close()
+
+
+def install_error_mail(app):
+    """给 app.logger 加上异步的错误摘要邮件，返回 QueueListener；同一个 logger 只安装一次"""
+    with _install_lock:
+        if app.logger in _installed:
+            listener, digest = _installed[app.logger]
+            # Flask 每次创建 logger 时会清空同名 logger 上的 handler，需要重新挂上
+            if digest.source not in app.logger.handlers:
+                app.logger.addHandler(digest.source)
+            return listener
+        if not _installed:
+            atexit.register(_stop_all)
+        listener = _install(app)
+        _installed[app.logger] = listener, listener.handlers[0]
+        return listener
+
+
+def _install(app):
+    digest = DigestMailHandler(
+        (app.config['MAIL_SERVER'], app.config['MAIL_PORT']),
+        app.config['FLASKY_MAIL_SENDER'],
+        [app.config['FLASKY_ADMIN_MAIL']],
+        app.config['FLASKY_MAIL_SUBJECT_PREFIX'] + 'Application Error',
+        credentials=(app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD']),
+        use_ssl=app.config['MAIL_USE_SSL'],
+        interval=app.config.setdefault('ERROR_MAIL_DIGEST_INTERVAL', 60),
+        max_per_window=app.config.setdefault('ERROR_MAIL_MAX_PER_HOUR', 10),
+    )
+    digest.setFormatter(logging.Formatter(
+        '%(levelname)s in %(module)s [%(pathname)s:%(lineno)d]\n%(message)s'))
+
+    handler = ErrorQueueHandler(Queue(app.config.setdefault('ERROR_MAIL_QUEUE_SIZE', 1000)))
+    handler.setLevel(logging.ERROR)
+    digest.source = handler
+    app.logger.addHandler(handler)
+
+    listener = QueueListener(handler.queue, digest)
+    listener.start()
+    digest.start()
+    return listener
@@ -6,15 +6,26 @@ from flask_moment import Moment
 from flask_pagedown import PageDown
 from flask_principal import Principal
 from flask_login import LoginManager
-from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import MetaData
 from flask_cache import Cache
 from flask_mail import Mail
 from flask_bootstrap import Bootstrap
-from flask_cdn import CDN
+from .database import SQLAlchemy
+from .counters import ViewCounter
+from .render_cache import RenderCache
+from .page_cache import PageCache
+from .sql_monitor import QueryMonitor
+from .profiler import SamplingProfiler
+from .mail_queue import MailDispatcher
+from .avatars import AvatarCache
+from .assets import Assets
+from .sendfile import FileOffload
 
 __all__ = ['mail_engine', 'db', 'cache', 'bootstrap', 'moment',
-           'page_down', 'principal', 'login_master', 'meta', 'cdn']
+           'page_down', 'principal', 'login_master', 'meta',
+           'view_counter', 'render_cache', 'page_cache', 'sql_monitor',
+           'profiler', 'mail_dispatcher', 'avatars', 'assets',
+           'file_offload']
 
 mail_engine = Mail()
 db = SQLAlchemy()
@@ -25,4 +36,12 @@ page_down = PageDown()
 principal = Principal()
 login_master = LoginManager()
 meta = MetaData()
-cdn = CDN()
+view_counter = ViewCounter(db)
+render_cache = RenderCache()
+page_cache = PageCache(cache)
+sql_monitor = QueryMonitor()
+profiler = SamplingProfiler(cache)
+mail_dispatcher = MailDispatcher(mail_engine)
+avatars = AvatarCache()
+assets = Assets()
+file_offload = FileOffload()
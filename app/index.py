@@ -2,18 +2,54 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import print_function, unicode_literals, absolute_import
-from flask import send_from_directory, redirect, url_for
+from flask import Blueprint, send_from_directory, send_file, redirect, url_for, abort, current_app, request
 from . import basedir
-from . import app
+from .extensions import avatars, assets, file_offload
+from .avatars import IDENTICON_VERSION
 import os.path
 
+index = Blueprint('index', __name__)
 
-@app.route('/favicon.ico')
+
+@index.route('/favicon.ico')
 def favicon():
     return send_from_directory(os.path.join(basedir, 'static/img'),
                                'favicon.ico')
 
 
-@app.route('/')
+@index.url_defaults
+def add_identicon_version(endpoint, values):
+    # 头像地址带上生成算法的版本，算法变化后浏览器和反向代理不会继续使用缓存的旧图片
+    if endpoint == 'index.avatar':
+        values.setdefault('version', IDENTICON_VERSION)
+
+
+@index.route('/avatar/<string(length=32):digest>-<int:size>.png', defaults={'version': 0})
+@index.route('/avatar/v<int:version>/<string(length=32):digest>-<int:size>.png')
+def avatar(version, digest, size):
+    if not avatars.accepts(digest, size):
+        abort(404)
+    if version != IDENTICON_VERSION:
+        # 缓存的旧页面里还是旧版本（或不带版本）的地址，转到当前版本
+        return redirect(url_for('.avatar', digest=digest, size=size), 301)
+    png = avatars.get(digest, size)
+    path = avatars.disk_path(digest, size)
+    if file_offload.enabled and path is not None:
+        response = send_file(path, mimetype='image/png', conditional=True)
+    else:
+        response = current_app.response_class(png, mimetype='image/png')
+        # URL 已经包含了决定图片内容的全部信息，内容永远不会变
+        response.set_etag('v%d-%s-%d' % (IDENTICON_VERSION, digest, size))
+        response = response.make_conditional(request)
+    response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % (365 * 24 * 3600)
+    return response
+
+
+@index.route('/assets/<path:filename>', endpoint='assets')
+def built_asset(filename):
+    return assets.send(filename)
+
+
+@index.route('/')
 def redirect_blog():
     return redirect(url_for('blog.index'))
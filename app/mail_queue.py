@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+有界队列 + 固定数量的发信线程
+
+send_email 只负责把邮件放进队列，MAIL_WORKERS 个后台线程从队列里取邮件发送。
+每个线程保持一个 SMTP 连接（Mail.connect()），一次取出最多 MAIL_BATCH_SIZE 封在同一个连接上连续发送，
+空闲超过 MAIL_IDLE_TIMEOUT 秒才断开；发送失败时重新连接并按指数退避重试 MAIL_MAX_RETRIES 次。
+队列满时 submit() 等待 MAIL_QUEUE_PUT_TIMEOUT 秒后放弃并记录日志，突发的大量请求不会堆出成百上千个线程和连接。
+进程退出时 drain() 把队列中剩下的邮件发完（最多等待 MAIL_DRAIN_TIMEOUT 秒）。
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+from threading import Thread, Lock
+from queue import Queue, Empty, Full
+import atexit
+import os
+import time
+
+_STOP = object()
+
+
+class MailDispatcher(object):
+    def __init__(self, mail, app=None):
+        self.mail = mail
+        self.app = None
+        self.workers = 2
+        self.batch_size = 20
+        self.max_retries = 3
+        self.retry_backoff = 1.0
+        self.idle_timeout = 30
+        self.put_timeout = 1.0
+        self.drain_timeout = 10
+        self.queue = None
+        self._threads = []
+        self._pid = None
+        self._lock = Lock()
+        self._drain_registered = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.setdefault('MAIL_WORKERS', 2)
+        self.batch_size = app.config.setdefault('MAIL_BATCH_SIZE', 20)
+        self.max_retries = app.config.setdefault('MAIL_MAX_RETRIES', 3)
+        self.retry_backoff = app.config.setdefault('MAIL_RETRY_BACKOFF', 1.0)
+        self.idle_timeout = app.config.setdefault('MAIL_IDLE_TIMEOUT', 30)
+        self.put_timeout = app.config.setdefault('MAIL_QUEUE_PUT_TIMEOUT', 1.0)
+        self.drain_timeout = app.config.setdefault('MAIL_DRAIN_TIMEOUT', 10)
+        self.queue = Queue(app.config.setdefault('MAIL_QUEUE_SIZE', 1000))
+        app.extensions['mail_dispatcher'] = self
+        # 同一个 dispatcher 可能被多次 create_app 初始化（测试、应用工厂），退出钩子只注册一次
+        if not self._drain_registered:
+            atexit.register(self.drain)
+            self._drain_registered = True
+
+    def _ensure_workers(self):
+        # 线程在第一次发信时才启动；预加载应用后 fork 出的 worker 进程里没有父进程的线程，需要重新启动
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._threads = []
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = Thread(target=self._work, name='mail-worker-%d' % len(self._threads))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, msg):
+        """把邮件放进发送队列，队列已满时返回 False"""
+        self._ensure_workers()
+        try:
+            self.queue.put(msg, timeout=self.put_timeout)
+        except Full:
+            self.app.logger.error('Mail queue is full, dropped message to %s: %s' % (msg.recipients, msg.subject))
+            return False
+        return True
+
+    def _take_batch(self):
+        """阻塞等待第一封邮件，再顺带取出已经在排队的邮件；空闲超时返回 None"""
+        try:
+            first = self.queue.get(timeout=self.idle_timeout)
+        except Empty:
+            return None
+        batch = [first]
+        while first is not _STOP and len(batch) < self.batch_size:
+            try:
+                msg = self.queue.get_nowait()
+            except Empty:
+                break
+            batch.append(msg)
+            if msg is _STOP:
+                break
+        return batch
+
+    def _work(self):
+        connection = None
+        try:
+            while True:
+                batch = self._take_batch()
+                if batch is None:
+                    connection = self._close(connection)
+                    continue
+                stop = batch[-1] is _STOP
+                if stop:
+                    batch.pop()
+                with self.app.app_context():
+                    for msg in batch:
+                        connection = self._send(connection, msg)
+                for _ in range(len(batch) + (1 if stop else 0)):
+                    self.queue.task_done()
+                if stop:
+                    break
+        finally:
+            self._close(connection)
+
+    def _connect(self):
+        connection = self.mail.connect()
+        connection.__enter__()
+        return connection
+
+    def _close(self, connection):
+        if connection is not None:
+            try:
+                with self.app.app_context():
+                    connection.__exit__(None, None, None)
+            except Exception:
+                pass
+        return None
+
+    def _send(self, connection, msg):
+        """在已有连接上发送，失败时断开重连并退避重试，返回之后继续使用的连接"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                if connection is None:
+                    connection = self._connect()
+                connection.send(msg)
+                return connection
+            except Exception as e:
+                connection = self._close(connection)
+                if attempt == self.max_retries:
+                    self.app.logger.error('Failed to send mail to %s after %d attempts: %r'
+                                          % (msg.recipients, attempt + 1, e))
+                else:
+                    time.sleep(self.retry_backoff * 2 ** attempt)
+        return connection
+
+    def drain(self, timeout=None):
+        """通知发信线程把队列里的邮件发完后退出，最多等待 timeout 秒"""
+        with self._lock:
+            threads = [t for t in self._threads if t.is_alive()] if self._pid == os.getpid() else []
+            self._threads = []
+        if not threads:
+            return
+        for _ in threads:
+            self.queue.put(_STOP)
+        deadline = time.time() + (self.drain_timeout if timeout is None else timeout)
+        for thread in threads:
+            thread.join(max(0, deadline - time.time()))
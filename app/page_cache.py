@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+整页缓存
+
+缓存键由路径、规范化后的查询参数和访问者的权限类别组成：
+/article?cursor=... 不会拿到第一页的内容，管理员页面上的编辑链接也不会出现在匿名访问者的页面里。
+导航栏上显示了登录用户的用户名，所以已登录用户的权限类别中还带上了用户 id。
+
+每个缓存条目带有依赖标签（例如 post:3、category:2），写操作调用 invalidate() 使相关标签失效，
+依赖这些标签的页面在下次访问时重新生成，不必等待过期时间。
+标签失效通过写入新的版本号实现，读取时条目记录的版本与当前版本不一致即视为过期。
+条目记录的是视图调用 tag() 时的版本，所以视图应在读取数据之前声明依赖；
+只有读完数据才知道的标签（例如列表中各篇文章的 post:N），如果在渲染开始之后被 invalidate() 过，
+说明页面可能是用旧数据生成的，这次的结果不写入缓存。
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+from functools import wraps
+from flask import request, session, g, current_app, make_response
+from flask_login import current_user
+from app.permissions import permission_admin, permission_moderator, permission_blogger, permission_user
+import hashlib
+import time
+import uuid
+
+
+def _new_version(timestamp):
+    return '%r:%s' % (timestamp, uuid.uuid4().hex)
+
+
+def _version_time(version):
+    try:
+        return float(version.split(':', 1)[0])
+    except (AttributeError, ValueError):
+        return 0.0
+
+
+class PageCache(object):
+    def __init__(self, cache, app=None):
+        self.cache = cache
+        self.default_timeout = 120
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.default_timeout = app.config.setdefault('PAGE_CACHE_TIMEOUT', 120)
+        app.extensions['page_cache'] = self
+
+    @staticmethod
+    def viewer_class():
+        if not current_user.is_authenticated:
+            return 'anonymous'
+        for name, permission in (('admin', permission_admin),
+                                 ('moderator', permission_moderator),
+                                 ('blogger', permission_blogger),
+                                 ('user', permission_user)):
+            if permission.can():
+                return '%s:%s' % (name, current_user.id)
+        return 'deny:%s' % current_user.id
+
+    def make_key(self):
+        args = sorted((k, v) for k, v in request.args.items(multi=True) if v)
+        raw = '%s?%s#%s' % (request.path, '&'.join('%s=%s' % kv for kv in args), self.viewer_class())
+        return 'page/' + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def tag(self, *tags):
+        """在视图中声明当前页面依赖的数据，应在读取这些数据之前调用"""
+        if not hasattr(g, 'page_cache_tags'):
+            g.page_cache_tags = {}
+        tags = [t for t in tags if t not in g.page_cache_tags]
+        versions = self._snapshot_versions(tags)
+        g.page_cache_tags.update(versions)
+        started = g.get('page_cache_started')
+        if started is not None and any(_version_time(v) >= started for v in versions.values()):
+            g.page_cache_stale = True
+
+    def invalidate(self, *tags):
+        if tags:
+            version = _new_version(time.time())
+            for t in tags:
+                self.cache.set('page-tag/' + t, version, timeout=0)
+
+    def _current_versions(self, tags):
+        keys = ['page-tag/' + t for t in tags]
+        return dict(zip(tags, self.cache.get_many(*keys))) if keys else {}
+
+    def _snapshot_versions(self, tags):
+        versions = self._current_versions(tags)
+        for t, version in versions.items():
+            if version is None:
+                # 从未失效过（或已被淘汰）的标签，不代表数据刚刚变化
+                versions[t] = _new_version(0)
+                self.cache.set('page-tag/' + t, versions[t], timeout=0)
+        return versions
+
+    def _is_fresh(self, entry):
+        tags = list(entry['tags'])
+        return self._current_versions(tags) == entry['tags']
+
+    def cached(self, timeout=None):
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                # 只缓存 GET/HEAD；有待显示的 flash 消息时页面因人而异，不走缓存
+                if request.method not in ('GET', 'HEAD') or session.get('_flashes') or \
+                        current_app.config.get('PAGE_CACHE_DISABLED'):
+                    return f(*args, **kwargs)
+
+                key = self.make_key()
+                entry = self.cache.get(key)
+                if entry is not None and self._is_fresh(entry):
+                    response = current_app.response_class(entry['data'], status=entry['status'],
+                                                          content_type=entry['content_type'],
+                                                          headers=entry['headers'])
+                    # 缓存的页面带着视图设置的 ETag，验证器仍然有效时直接返回 304
+                    return response.make_conditional(request)
+
+                g.page_cache_tags = {}
+                g.page_cache_stale = False
+                g.page_cache_started = time.time()
+                response = make_response(f(*args, **kwargs))
+                if response.status_code == 200 and not response.direct_passthrough and not g.page_cache_stale:
+                    self.cache.set(key, {
+                        'data': response.get_data(),
+                        'status': response.status_code,
+                        'content_type': response.content_type,
+                        'headers': [(k, v) for k, v in response.headers
+                                    if k in ('ETag', 'Last-Modified', 'Cache-Control')],
+                        'tags': g.page_cache_tags,
+                    }, timeout=timeout if timeout is not None else self.default_timeout)
+                return response
+            return decorated_function
+        return decorator
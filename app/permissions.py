@@ -7,7 +7,6 @@ from flask_login import current_user
 # from flask import abort
 from flask_principal import (identity_loaded,
                              Permission, RoleNeed, UserNeed)
-from app import app
 
 
 # class Permissions(object):
@@ -30,14 +29,15 @@ permission_blogger = Permission(role_blogger, role_moderator, role_admin) & perm
 permission_user = Permission(role_user, role_blogger, role_moderator, role_admin) & permission_deny
 
 
-@identity_loaded.connect_via(app)
+# 不绑定具体的 app，由工厂创建的每个应用都会收到
+@identity_loaded.connect
 def on_identity_loaded(sender, identity):
     identity.user = current_user
     if hasattr(current_user, "id"):
         identity.provides.add(UserNeed(current_user.id))
-    if hasattr(current_user, 'roles'):
-        for role in current_user.roles:
-            identity.provides.add(RoleNeed(role.name))
+    if hasattr(current_user, 'role_names'):
+        for name in current_user.role_names:
+            identity.provides.add(RoleNeed(name))
 
 
 # def permission_required_any(*needs):
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+生产环境可用的采样分析器
+
+打开之后，请求开始时按 1/PROFILER_SAMPLE_RATE 的概率决定是否采样，只有选中的请求会登记给后台线程，
+后台线程每隔 PROFILER_INTERVAL 秒抓取一次这些线程的调用栈，没选中的请求没有额外开销。
+调用栈按 endpoint 累加，输出为 collapsed stack 格式（每行 “frame;frame;frame 次数”），
+可以直接交给 flamegraph.pl 或 speedscope 生成火焰图。
+
+请求开始时还不知道它会不会慢，所以设置了 PROFILER_LATENCY_THRESHOLD 之后每个请求都要采样，
+结束时再丢弃没被选中、耗时也没超过阈值的请求，开销和全量采样相同，只适合短时间排查慢请求。
+
+开关保存在共享缓存里，管理员向 /blog/admin/profiler/on|off POST（需要 CSRF token）切换后，
+所有 worker 会在几秒内跟着切换。
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+from collections import Counter, defaultdict
+from threading import Lock, Thread, get_ident
+from flask import request
+import atexit
+import codecs
+import os
+import random
+import sys
+import time
+
+PROFILER_SWITCH_KEY = 'profiler/enabled'
+
+
+class SamplingProfiler(object):
+    def __init__(self, cache, app=None):
+        self.cache = cache
+        self.app = None
+        self.sample_rate = 100
+        self.latency_threshold = None
+        self.interval = 0.005
+        self.output_dir = None
+        self._enabled = False
+        self._checked_at = 0
+        self._active = {}
+        self._stacks = defaultdict(Counter)
+        self._lock = Lock()
+        self._sampler = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.sample_rate = app.config.setdefault('PROFILER_SAMPLE_RATE', 100)
+        self.latency_threshold = app.config.setdefault('PROFILER_LATENCY_THRESHOLD', None)
+        self.interval = app.config.setdefault('PROFILER_INTERVAL', 0.005)
+        self.output_dir = app.config.setdefault('PROFILER_DIR', None)
+        app.config.setdefault('PROFILER_SWITCH_POLL', 5)
+        app.extensions['profiler'] = self
+        app.before_request(self._start_request)
+        app.teardown_request(self._finish_request)
+        atexit.register(self.dump)
+
+    @property
+    def enabled(self):
+        # 每隔几秒从共享缓存读取一次开关状态
+        now = time.time()
+        if now - self._checked_at >= self.app.config['PROFILER_SWITCH_POLL']:
+            self._checked_at = now
+            self._enabled = bool(self.cache.get(PROFILER_SWITCH_KEY))
+        return self._enabled
+
+    def switch(self, enabled):
+        self.cache.set(PROFILER_SWITCH_KEY, enabled, timeout=0)
+        self._enabled = enabled
+        self._checked_at = time.time()
+
+    def _ensure_sampler(self):
+        if self._sampler is None or not self._sampler.is_alive():
+            self._sampler = Thread(target=self._sample_loop, name='sampling-profiler')
+            self._sampler.daemon = True
+            self._sampler.start()
+
+    def _sample_loop(self):
+        while self._enabled:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            for ident, samples in list(self._active.items()):
+                frame = frames.get(ident)
+                if frame is not None:
+                    samples[_collapse(frame)] += 1
+
+    def _start_request(self):
+        if not self.enabled:
+            return
+        chosen = random.randrange(self.sample_rate) == 0
+        if not chosen and self.latency_threshold is None:
+            return
+        request.environ['profiler.chosen'] = chosen
+        request.environ['profiler.started'] = time.time()
+        self._active[get_ident()] = Counter()
+        self._ensure_sampler()
+
+    def _finish_request(self, exc=None):
+        samples = self._active.pop(get_ident(), None)
+        if not samples:
+            return
+        if not request.environ.get('profiler.chosen'):
+            elapsed = time.time() - request.environ['profiler.started']
+            if elapsed < self.latency_threshold:
+                return
+        with self._lock:
+            self._stacks[request.endpoint or 'unknown'].update(samples)
+
+    def collapsed(self, endpoint=None):
+        with self._lock:
+            endpoints = [endpoint] if endpoint else sorted(self._stacks)
+            lines = []
+            for name in endpoints:
+                for stack, count in self._stacks.get(name, {}).items():
+                    lines.append('%s;%s %d' % (name, stack, count))
+            return '\n'.join(lines) + '\n' if lines else ''
+
+    def status(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'sample_rate': self.sample_rate,
+                'latency_threshold': self.latency_threshold,
+                'interval': self.interval,
+                'endpoints': dict((name, sum(stacks.values())) for name, stacks in self._stacks.items()),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+
+    def dump(self):
+        """把当前进程累计的调用栈写到 PROFILER_DIR/<endpoint>.<pid>.folded"""
+        if not self.output_dir or not self._stacks:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        with self._lock:
+            for name in self._stacks:
+                path = os.path.join(self.output_dir, '%s.%d.folded' % (name, os.getpid()))
+                with codecs.open(path, 'w', encoding='utf-8') as fp:
+                    for stack, count in self._stacks[name].items():
+                        fp.write('%s %d\n' % (stack, count))
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    names.reverse()
+    return ';'.join(names)
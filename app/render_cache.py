@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Markdown 渲染缓存
+
+渲染结果按 (原文, 标签白名单配置, 渲染器版本) 的哈希值寻址，
+相同的正文（重复保存未修改的文章、内容相同的评论）直接复用之前的结果，
+不再重复执行 markdown() -> bleach.clean() -> bleach.linkify()。
+修改白名单或提升 RENDERER_VERSION 后哈希随之改变，旧结果自然失效。
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+from markdown import markdown
+from .lru import LRUCache
+import bleach
+import codecs
+import hashlib
+import json
+import os
+
+# 渲染逻辑本身（markdown 版本、扩展、清洗方式）变化时加一
+RENDERER_VERSION = 1
+
+
+def render_markdown(text, tags, attrs, extensions=()):
+    return bleach.linkify(bleach.clean(
+        markdown(text or '', output_format='html', extensions=list(extensions)),
+        tags=tags, attributes=attrs, strip=True))
+
+
+class RenderProfile(object):
+    def __init__(self, name, tags, attrs, extensions=()):
+        self.name = name
+        self.tags = list(tags)
+        self.attrs = dict(attrs)
+        self.extensions = tuple(extensions)
+        self.fingerprint = hashlib.sha1(json.dumps(
+            [RENDERER_VERSION, sorted(self.tags),
+             sorted((k, sorted(v)) for k, v in self.attrs.items()),
+             list(self.extensions)]).encode('utf-8')).hexdigest()
+
+    def render(self, text):
+        return render_markdown(text, self.tags, self.attrs, self.extensions)
+
+
+class RenderCache(object):
+    def __init__(self, app=None):
+        self.profiles = {}
+        self.cache_dir = None
+        self._memory = LRUCache(1024)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._memory = LRUCache(app.config.setdefault('RENDER_CACHE_SIZE', 1024))
+        # 配置了目录时把渲染结果同时写到磁盘上，进程重启和多个 worker 之间都能复用
+        self.cache_dir = app.config.setdefault('RENDER_CACHE_DIR', None)
+        app.extensions['render_cache'] = self
+
+    def register_profile(self, name, tags, attrs, extensions=()):
+        profile = RenderProfile(name, tags, attrs, extensions)
+        self.profiles[name] = profile
+        return profile
+
+    def key(self, text, profile_name):
+        profile = self.profiles[profile_name]
+        digest = hashlib.sha1(profile.fingerprint.encode('utf-8'))
+        digest.update((text or '').encode('utf-8'))
+        return digest.hexdigest()
+
+    def render(self, text, profile_name):
+        key = self.key(text, profile_name)
+        html = self._memory.get(key)
+        if html is not None:
+            self.hits += 1
+            return html
+
+        html = self._load(key)
+        if html is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            html = self.profiles[profile_name].render(text)
+            self._store(key, html)
+        self._memory.set(key, html)
+        return html
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'size': len(self._memory),
+            'capacity': self._memory.capacity,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    def clear(self):
+        self._memory.clear()
+        self.hits = self.disk_hits = self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.html')
+
+    def _load(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with codecs.open(self._path(key), encoding='utf-8') as fp:
+                return fp.read()
+        except (IOError, OSError):
+            return None
+
+    def _store(self, key, html):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再改名，避免其他 worker 读到写了一半的文件
+            tmp = '%s.%d.tmp' % (path, os.getpid())
+            with codecs.open(tmp, 'w', encoding='utf-8') as fp:
+                fp.write(html)
+            os.replace(tmp, path)
+        except (IOError, OSError):
+            pass
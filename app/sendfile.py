@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+把文件传输交给前端服务器
+
+SENDFILE_MODE 为 'x-sendfile'（Apache mod_xsendfile、lighttpd）或 'x-accel-redirect'（nginx）时，
+打开 Flask 的 USE_X_SENDFILE，send_file 只返回带 X-Sendfile 头的空响应，文件内容由前端服务器发送，
+静态文件、favicon、/assets/ 下的构建结果和磁盘缓存中的头像都会这样处理，worker 只做动态的工作。
+
+nginx 需要的是内部 location 的 URI 而不是文件路径，这里按 SENDFILE_ACCEL_MAPPING 把路径前缀换成 URI 前缀，
+不在映射范围内的文件仍由 worker 自己发送。nginx 会用自己的 ETag（"修改时间-大小"的十六进制）替换上游的 ETag，
+所以这里也按同样的格式生成 ETag，保证 worker 和 nginx 对 If-None-Match 的判断一致。
+
+Range 请求由前端服务器按原始请求头处理，worker 不能先截出 206 响应，否则前端服务器会在部分内容上再截一次。
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+from flask import request, current_app
+from werkzeug.wsgi import wrap_file
+import os
+
+MODES = (None, 'x-sendfile', 'x-accel-redirect')
+
+
+def nginx_etag(path):
+    stat = os.stat(path)
+    return '%x-%x' % (int(stat.st_mtime), stat.st_size)
+
+
+class FileOffload(object):
+    def __init__(self, app=None):
+        self.mode = None
+        self.mapping = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.mode = app.config.setdefault('SENDFILE_MODE', None)
+        if self.mode not in MODES:
+            raise ValueError('SENDFILE_MODE must be one of %r' % (MODES,))
+        # 较长的前缀优先匹配
+        self.mapping = sorted(app.config.setdefault('SENDFILE_ACCEL_MAPPING', {}).items(),
+                              key=lambda item: len(item[0]), reverse=True)
+        app.config['USE_X_SENDFILE'] = self.mode is not None
+        app.after_request(self._offload)
+        app.extensions['file_offload'] = self
+
+    @property
+    def enabled(self):
+        return current_app.config['USE_X_SENDFILE']
+
+    @property
+    def server_encodes(self):
+        """nginx 的内部跳转不保留上游的 Content-Encoding，预压缩版本交给 gzip_static 选择"""
+        return self.enabled and self.mode == 'x-accel-redirect'
+
+    def internal_uri(self, path):
+        for prefix, uri in self.mapping:
+            # 前缀必须在路径分隔处结束，/srv/app 不能匹配 /srv/app-cache/x.png
+            if path == prefix or path.startswith(prefix.rstrip('/') + '/'):
+                return uri + path[len(prefix):].lstrip('/')
+        return None
+
+    def _offload(self, response):
+        path = response.headers.get('X-Sendfile')
+        if path is None:
+            return response
+        if response.status_code == 304:
+            del response.headers['X-Sendfile']
+            return response
+        if response.status_code == 206:
+            response.status_code = 200
+            response.response = []
+            del response.headers['Content-Range']
+            response.headers['Content-Length'] = os.path.getsize(path)
+        if self.mode != 'x-accel-redirect':
+            return response
+
+        del response.headers['X-Sendfile']
+        uri = self.internal_uri(path)
+        if uri is None:
+            current_app.logger.warning('%s is not covered by SENDFILE_ACCEL_MAPPING, sent by the worker', path)
+            response.response = wrap_file(request.environ, open(path, 'rb'))
+            response.direct_passthrough = True
+            return response
+
+        etag = nginx_etag(path)
+        response.set_etag(etag)
+        if request.if_none_match.contains(etag):
+            response.status_code = 304
+            response.response = []
+            response.headers.pop('Content-Length', None)
+            return response
+        response.headers['X-Accel-Redirect'] = uri
+        return response
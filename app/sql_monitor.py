@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+按请求统计 SQL
+
+在 SQLAlchemy 的 Engine 事件里给每条语句计时并计算指纹（去掉字面量、合并 IN 列表后的语句），
+统计每个请求的查询次数和数据库耗时，通过 Server-Timing 响应头返回给浏览器，
+同时按 endpoint 汇总，供 /blog/admin/sql-stats 查看。
+同一个请求里相同指纹的语句出现次数达到阈值时，记为疑似 N+1，并记录发起它的视图和模板。
+不依赖 SQLALCHEMY_RECORD_QUERIES，生产环境也可以一直打开。
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+from collections import Counter, defaultdict
+from threading import Lock
+from flask import g, request, current_app, has_request_context, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .lru import LRUCache
+import re
+import time
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\bIN\s*\((?:\s*\?\s*,)*\s*\?\s*\)', re.IGNORECASE)
+_PLACEHOLDER_RE = re.compile(r'%\(\w+\)s|%s|:\w+|\?')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def fingerprint(statement):
+    s = _STRING_RE.sub('?', statement)
+    s = _PLACEHOLDER_RE.sub('?', s)
+    s = _NUMBER_RE.sub('?', s)
+    s = _IN_LIST_RE.sub('IN (?)', s)
+    return _SPACE_RE.sub(' ', s).strip()
+
+
+class QueryMonitor(object):
+    def __init__(self, app=None):
+        self.app = None
+        self.slow_query_time = 0.5
+        self.n_plus_one_threshold = 5
+        self._fingerprints = LRUCache(2048)
+        self._endpoints = {}
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.slow_query_time = app.config.setdefault('FLASKY_SLOW_DB_QUERY_TIME', 0.5)
+        self.n_plus_one_threshold = app.config.setdefault('SQL_MONITOR_N_PLUS_ONE_THRESHOLD', 5)
+        app.extensions['sql_monitor'] = self
+        if not app.config.setdefault('SQL_MONITOR_ENABLED', True):
+            return
+
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        before_render_template.connect(self._on_render_template, app)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def _fingerprint(self, statement):
+        fp = self._fingerprints.get(statement)
+        if fp is None:
+            fp = fingerprint(statement)
+            self._fingerprints.set(statement, fp)
+        return fp
+
+    def _on_render_template(self, sender, template, context, **extra):
+        stats = g.get('sql_stats')
+        if stats is not None:
+            stats['template'] = template.name
+
+    def _start_request(self):
+        g.sql_stats = {
+            'started': time.time(),
+            'count': 0,
+            'duration': 0.0,
+            'template': None,
+            'fingerprints': Counter(),
+            'origins': {},
+        }
+
+    def record(self, statement, parameters, duration):
+        stats = g.get('sql_stats')
+        if stats is None:
+            return
+        fp = self._fingerprint(statement)
+        stats['count'] += 1
+        stats['duration'] += duration
+        stats['fingerprints'][fp] += 1
+        # 记录这个指纹第一次出现时所在的视图和模板
+        stats['origins'].setdefault(fp, '%s (%s)' % (request.endpoint, stats['template'] or 'view'))
+        if duration >= self.slow_query_time:
+            self.app.logger.warning(
+                'Slow query: %s\nParameters: %s\nDuration: %fs\nContext: %s\n'
+                % (statement, parameters, duration, stats['origins'][fp]))
+
+    def _finish_request(self, response):
+        stats = g.get('sql_stats')
+        if stats is None:
+            return response
+        total = time.time() - stats['started']
+        response.headers.add('Server-Timing', 'db;dur=%.1f;desc="%d queries"'
+                             % (stats['duration'] * 1000, stats['count']))
+        response.headers.add('Server-Timing', 'app;dur=%.1f' % (total * 1000))
+
+        suspects = dict((fp, n) for fp, n in stats['fingerprints'].items()
+                        if n >= self.n_plus_one_threshold)
+        for fp, n in suspects.items():
+            self.app.logger.warning('Probable N+1: %d x %s\nOrigin: %s' % (n, fp, stats['origins'][fp]))
+
+        endpoint = request.endpoint or 'unknown'
+        with self._lock:
+            agg = self._endpoints.get(endpoint)
+            if agg is None:
+                agg = self._endpoints[endpoint] = {
+                    'requests': 0, 'queries': 0, 'db_time': 0.0,
+                    'max_queries': 0, 'n_plus_one': defaultdict(int), 'origins': {},
+                }
+            agg['requests'] += 1
+            agg['queries'] += stats['count']
+            agg['db_time'] += stats['duration']
+            agg['max_queries'] = max(agg['max_queries'], stats['count'])
+            for fp, n in suspects.items():
+                agg['n_plus_one'][fp] += 1
+                agg['origins'][fp] = stats['origins'][fp]
+        return response
+
+    def endpoint_stats(self):
+        with self._lock:
+            result = {}
+            for endpoint, agg in self._endpoints.items():
+                result[endpoint] = {
+                    'requests': agg['requests'],
+                    'avg_queries': agg['queries'] / agg['requests'],
+                    'max_queries': agg['max_queries'],
+                    'avg_db_ms': agg['db_time'] * 1000 / agg['requests'],
+                    'n_plus_one': [{'statement': fp, 'requests': n, 'origin': agg['origins'][fp]}
+                                   for fp, n in sorted(agg['n_plus_one'].items(), key=lambda kv: -kv[1])],
+                }
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.time())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_start_time')
+    if not started:
+        return
+    duration = time.time() - started.pop()
+    if not has_request_context():
+        return
+    monitor = current_app.extensions.get('sql_monitor')
+    if monitor is not None:
+        monitor.record(statement, parameters, duration)
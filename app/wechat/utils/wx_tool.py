@@ -2,9 +2,9 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import print_function, unicode_literals, absolute_import
-from flask import request, redirect
+from flask import request, redirect, current_app as app
 from wechat_sdk import WechatBasic
-from app import db, app
+from app.extensions import db
 from Crypto.Cipher import AES
 from Crypto import Random
 import functools
@@ -4,7 +4,7 @@
 from __future__ import print_function, unicode_literals, absolute_import
 from flask import session
 from flask_socketio import emit, join_room, leave_room
-from app import ws
+from app.wechat_channel import ws
 
 
 @ws.on('joined', namespace='/chat')
@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+路由级别的压力测试
+
+seed 模块向本地 SQLite 数据库写入可配置规模的合成数据（用户、分类、标签、文章、评论），
+runner 模块通过 Flask 测试客户端或本地 WSGI 服务器并发访问各个路由，
+统计 p50/p95/p99 延迟、吞吐量和每个请求的查询次数，结果保存为 JSON 以便对比。
+入口是 python manage.py benchmark。
+"""
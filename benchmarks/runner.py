@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals, absolute_import
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+from datetime import datetime
+from werkzeug.serving import make_server
+from flask_login.utils import _create_identifier
+from app.extensions import db
+from app.blog.models import User, Post, Category
+import codecs
+import json
+import math
+import os
+import platform
+import re
+import time
+from urllib.request import urlopen, Request
+from urllib.error import HTTPError
+
+USER_AGENT = 'flask-blog-benchmark'
+_QUERIES_RE = re.compile(r'db;dur=([\d.]+);desc="(\d+) queries"')
+
+# 每个场景：名称、是否以管理员身份访问、生成 URL 的函数（参数是样本数据和第几次请求）
+SCENARIOS = (
+    ('article', False, lambda s, i: '/blog/article'),
+    ('article_deep', False, lambda s, i: s['deep_pages'][i % len(s['deep_pages'])]),
+    ('article_category', False, lambda s, i: '/blog/article/%s' % s['categories'][i % len(s['categories'])]),
+    ('post', False, lambda s, i: '/blog/post/%d' % s['post_ids'][i % len(s['post_ids'])]),
+    ('user', False, lambda s, i: '/blog/user/%s' % s['usernames'][i % len(s['usernames'])]),
+    ('moderate', True, lambda s, i: '/blog/moderate'),
+)
+
+
+def percentile(values, p):
+    """最近秩法计算百分位数，values 已排序"""
+    if not values:
+        return 0.0
+    return values[max(0, int(math.ceil(p / 100.0 * len(values))) - 1)]
+
+
+def _sample_urls(app, deep_pages=5):
+    """从数据库里挑选要访问的文章、用户和分类，并沿着游标翻几页得到较深的列表页"""
+    with app.app_context():
+        post_ids = [row[0] for row in db.session.query(Post.id).order_by(Post.id.desc()).limit(200)]
+        usernames = [row[0] for row in db.session.query(User.username).limit(20)]
+        categories = [row[0] for row in db.session.query(Category.category_name).limit(20)]
+        admin_id = User.query.order_by(User.id).first().id
+
+    pages = []
+    client = app.test_client()
+    url = '/blog/article'
+    for _ in range(deep_pages):
+        rv = client.get(url)
+        match = re.search(r'href="([^"]*cursor=[^"]+)"', rv.get_data(as_text=True))
+        if not match:
+            break
+        url = match.group(1).replace('&amp;', '&')
+        pages.append(url)
+    return {'post_ids': post_ids, 'usernames': usernames, 'categories': categories,
+            'deep_pages': pages or ['/blog/article'], 'admin_id': admin_id}
+
+
+def _session_keys(app, user_id, environ_base):
+    # Flask-Login 和 Flask-Principal 使用的 session 键，直接写入即可跳过登录表单。
+    # SESSION_PROTECTION 为 strong 时 _id 必须和按请求来源地址、User-Agent 算出的标识一致，否则 session 会被清空
+    with app.test_request_context(environ_base=environ_base):
+        ident = _create_identifier()
+    return {'user_id': str(user_id), '_fresh': True, '_id': ident,
+            'identity.id': user_id, 'identity.auth_type': None}
+
+
+def _login(client, user_id):
+    keys = _session_keys(client.application, user_id, client.environ_base)
+    with client.session_transaction() as sess:
+        sess.update(keys)
+
+
+class _ClientDriver(object):
+    """在进程内通过 Flask 测试客户端发请求，每个线程一个客户端"""
+
+    def __init__(self, app, admin_id):
+        self.app = app
+        self.admin_id = admin_id
+        self.clients = {}
+
+    def get(self, url, admin, worker):
+        key = (worker, admin)
+        client = self.clients.get(key)
+        if client is None:
+            client = self.clients[key] = self.app.test_client()
+            if admin:
+                _login(client, self.admin_id)
+        rv = client.get(url)
+        return rv.status_code, rv.headers.get_all('Server-Timing')
+
+    def close(self):
+        pass
+
+
+class _ServerDriver(_ClientDriver):
+    """在本机启动一个多线程 WSGI 服务器，用 HTTP 请求访问，包含完整的请求解析和网络开销"""
+
+    def __init__(self, app, admin_id):
+        super(_ServerDriver, self).__init__(app, admin_id)
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.base = 'http://127.0.0.1:%d' % self.server.server_port
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.admin_cookie = self._admin_cookie()
+
+    def _admin_cookie(self):
+        # 用应用的密钥签出一个已登录管理员的 session cookie
+        serializer = self.app.session_interface.get_signing_serializer(self.app)
+        value = serializer.dumps(_session_keys(self.app, self.admin_id,
+                                               {'REMOTE_ADDR': '127.0.0.1', 'HTTP_USER_AGENT': USER_AGENT}))
+        return '%s=%s' % (self.app.session_cookie_name, value)
+
+    def get(self, url, admin, worker):
+        req = Request(self.base + url, headers={'User-Agent': USER_AGENT})
+        if admin:
+            req.add_header('Cookie', self.admin_cookie)
+        try:
+            resp = urlopen(req)
+        except HTTPError as e:
+            resp = e
+        resp.read()
+        return resp.getcode(), resp.info().get_all('Server-Timing') or []
+
+    def close(self):
+        self.server.shutdown()
+
+
+def run(app, requests=200, concurrency=8, scenarios=None, driver='client', warmup=10):
+    """依次压测各个场景，返回按场景汇总的结果"""
+    sample = _sample_urls(app)
+    driver = (_ServerDriver if driver == 'server' else _ClientDriver)(app, sample['admin_id'])
+    results = {}
+    try:
+        for name, admin, make_url in SCENARIOS:
+            if scenarios and name not in scenarios:
+                continue
+            for i in range(warmup):
+                driver.get(make_url(sample, i), admin, 'warmup')
+
+            def one(i):
+                started = time.time()
+                status, timing = driver.get(make_url(sample, i), admin, i % concurrency)
+                elapsed = time.time() - started
+                queries, db_ms = 0, 0.0
+                for value in timing:
+                    match = _QUERIES_RE.search(value)
+                    if match:
+                        db_ms, queries = float(match.group(1)), int(match.group(2))
+                return elapsed, status, queries, db_ms
+
+            started = time.time()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                samples = list(pool.map(one, range(requests)))
+            wall = time.time() - started
+
+            latencies = sorted(s[0] * 1000 for s in samples)
+            results[name] = {
+                'requests': requests,
+                'errors': sum(1 for s in samples if s[1] >= 400),
+                'throughput': requests / wall if wall else 0.0,
+                'p50_ms': percentile(latencies, 50),
+                'p95_ms': percentile(latencies, 95),
+                'p99_ms': percentile(latencies, 99),
+                'max_ms': latencies[-1],
+                'avg_queries': sum(s[2] for s in samples) / float(requests),
+                'max_queries': max(s[2] for s in samples),
+                'avg_db_ms': sum(s[3] for s in samples) / float(requests),
+            }
+            print_result(name, results[name])
+    finally:
+        driver.close()
+    return results
+
+
+def print_result(name, r):
+    print('%-18s %8.1f req/s  p50 %7.1fms  p95 %7.1fms  p99 %7.1fms  %5.1f queries  %d errors'
+          % (name, r['throughput'], r['p50_ms'], r['p95_ms'], r['p99_ms'], r['avg_queries'], r['errors']))
+
+
+def save(path, results, dataset, options):
+    report = {
+        'created': datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'dataset': dataset,
+        'options': options,
+        'results': results,
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with codecs.open(path, 'w', encoding='utf-8') as fp:
+        json.dump(report, fp, indent=2, sort_keys=True)
+    return report
+
+
+def compare(baseline_path, results):
+    """和之前保存的结果对比，打印每个场景 p95 和吞吐量的变化"""
+    with codecs.open(baseline_path, 'r', encoding='utf-8') as fp:
+        baseline = json.load(fp)['results']
+    for name in sorted(results):
+        old = baseline.get(name)
+        if old is None:
+            continue
+        new = results[name]
+        print('%-18s p95 %7.1fms -> %7.1fms (%+.0f%%)  %8.1f -> %8.1f req/s  queries %.1f -> %.1f'
+              % (name, old['p95_ms'], new['p95_ms'],
+                 (new['p95_ms'] - old['p95_ms']) * 100 / old['p95_ms'] if old['p95_ms'] else 0,
+                 old['throughput'], new['throughput'], old['avg_queries'], new['avg_queries']))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals, absolute_import
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam
+from werkzeug.security import generate_password_hash
+from app.extensions import db, render_cache
+from app.blog.models import User, Role, Post, Comment, Category, Tag, posts_tags, users_roles
+import random
+import time
+
+_WORDS = ('flask python sqlalchemy cache index query render template worker pool '
+          'latency throughput replica shard cursor token stream batch').split()
+_HANZI = '的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经'
+
+
+def _sentence(rnd, words=12):
+    parts = []
+    for _ in range(words):
+        if rnd.random() < 0.5:
+            parts.append(rnd.choice(_WORDS))
+        else:
+            parts.append(''.join(rnd.choice(_HANZI) for _ in range(rnd.randint(2, 6))))
+    return ' '.join(parts)
+
+
+def _markdown_body(rnd, paragraphs):
+    blocks = ['### ' + _sentence(rnd, 4)]
+    for _ in range(paragraphs):
+        blocks.append(_sentence(rnd, 40))
+    blocks.append('```\nprint("%s")\n```' % rnd.choice(_WORDS))
+    return '\n\n'.join(blocks)
+
+
+def _execute(statement, rows, chunk=5000):
+    # rows 可以是生成器，每凑满 chunk 行执行一次，几十万行的数据不会同时留在内存里
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= chunk:
+            db.session.execute(statement, batch)
+            batch = []
+    if batch:
+        db.session.execute(statement, batch)
+
+
+def _insert(table, rows, chunk=5000):
+    _execute(table.insert(), rows, chunk)
+
+
+def seed(users=50, categories=20, tags=500, posts=10000, comments=500000,
+         body_variants=100, comment_variants=200, random_seed=1):
+    """写入合成数据，返回各表的行数。正文只生成有限的几种并预先渲染，避免逐行渲染 Markdown"""
+    rnd = random.Random(random_seed)
+    started = time.time()
+    db.drop_all()
+    db.create_all()
+
+    roles = [Role(name=name, description=name) for name in ('admin', 'moderator', 'blogger', 'user', 'deny')]
+    db.session.add_all(roles)
+    db.session.flush()
+
+    password_hash = generate_password_hash('benchmark')
+    now = datetime.utcnow()
+    _insert(User.__table__, [{
+        'id': i, 'email': 'user%d@example.com' % i, 'username': 'user%d' % i,
+        'nickname': 'user%d' % i, 'password_hash': password_hash, 'active': True,
+        'member_since': now, 'last_seen': now,
+    } for i in range(1, users + 1)])
+    # 第一个用户是管理员，其余是博主
+    _insert(users_roles, [{'user_id': i, 'role_id': roles[0].id if i == 1 else roles[2].id}
+                          for i in range(1, users + 1)])
+    _insert(Category.__table__, [{'id': i, 'category_name': 'category-%d' % i}
+                                 for i in range(1, categories + 1)])
+    _insert(Tag.__table__, [{'id': i, 'name': 'tag-%d' % i} for i in range(1, tags + 1)])
+
+    bodies = [_markdown_body(rnd, rnd.randint(3, 12)) for _ in range(body_variants)]
+    bodies = [(body, render_cache.render(body, 'post')) for body in bodies]
+    replies = [_sentence(rnd, rnd.randint(5, 30)) for _ in range(comment_variants)]
+    replies = [(body, render_cache.render(body, 'comment')) for body in replies]
+
+    # 各表的行都由生成器逐行产生、分批写入；文章先以 0 条评论写入，评论写完后再补上计数
+    def post_rows():
+        for i in range(1, posts + 1):
+            body, body_html = rnd.choice(bodies)
+            date = now - timedelta(minutes=posts - i)
+            yield {
+                'id': i, 'title': _sentence(rnd, 5), 'intro': _sentence(rnd, 15),
+                'body': body, 'body_html': body_html, 'publish': True,
+                'post_date': date, 'last_modified_date': date,
+                'author_id': rnd.randint(1, users), 'category_id': rnd.randint(1, categories),
+                'view_times': rnd.randint(1, 1000),
+                'comment_count': 0, 'enabled_comment_count': 0,
+            }
+
+    def tag_rows():
+        for i in range(1, posts + 1):
+            for tag_id in rnd.sample(range(1, tags + 1), min(3, tags)):
+                yield {'post_id': i, 'tag_id': tag_id}
+
+    # 评论按文章随机分布，同时累计每篇文章的评论计数
+    counts = [0] * (posts + 1)
+    enabled = [0] * (posts + 1)
+
+    def comment_rows():
+        for i in range(1, comments + 1):
+            post_id = rnd.randint(1, posts)
+            disabled = rnd.random() < 0.02
+            body, body_html = rnd.choice(replies)
+            counts[post_id] += 1
+            enabled[post_id] += 0 if disabled else 1
+            yield {
+                'id': i, 'body': body, 'body_html': body_html, 'disabled': disabled,
+                'timestamp': now - timedelta(seconds=comments - i),
+                'author_id': rnd.randint(1, users), 'post_id': post_id,
+            }
+
+    _insert(Post.__table__, post_rows())
+    _insert(posts_tags, tag_rows())
+    _insert(Comment.__table__, comment_rows())
+    table = Post.__table__
+    _execute(table.update().where(table.c.id == bindparam('_id')).
+             values(comment_count=bindparam('_total'), enabled_comment_count=bindparam('_enabled')),
+             ({'_id': i, '_total': counts[i], '_enabled': enabled[i]} for i in range(1, posts + 1) if counts[i]))
+    db.session.commit()
+
+    sizes = {'users': users, 'categories': categories, 'tags': tags,
+             'posts': posts, 'comments': comments}
+    print('seeded %s in %.1fs' % (', '.join('%d %s' % (n, k) for k, n in sorted(sizes.items())),
+                                   time.time() - started))
+    return sizes
@@ -10,9 +10,32 @@ DEBUG = False
 # database
 SQLALCHEMY_DATABASE_URI = ''
 SQLALCHEMY_TRACK_MODIFICATIONS = True
+# 连接池（SQLite 不使用）：常驻连接数、额外允许的溢出连接数、取连接的最长等待时间（秒）、
+# 连接的最长存活时间（秒，需小于数据库的 wait_timeout）、取出连接时是否先检查连接是否可用。
+# 每个 gunicorn worker 各有一个连接池，总连接数 = worker 数 × (POOL_SIZE + MAX_OVERFLOW)，
+# 可以参考 /blog/admin/pool-stats 里的等待时间和溢出数调整
+SQLALCHEMY_POOL_SIZE = 5
+SQLALCHEMY_MAX_OVERFLOW = 10
+SQLALCHEMY_POOL_TIMEOUT = 10
+SQLALCHEMY_POOL_RECYCLE = 1800
+SQLALCHEMY_POOL_PRE_PING = True
+# 只读副本的连接串列表，GET/HEAD 请求里的查询会随机发到其中一个，留空则全部走主库
+SQLALCHEMY_REPLICA_URIS = []
+# 用户写入数据后多少秒内的请求仍然读主库，避免副本同步延迟导致看不到自己刚写的内容
+SQLALCHEMY_REPLICA_STICKY_SECONDS = 10
 # SQLALCHEMY_RECORD_QUERIES 告诉 Flask-SQLAlchemy 启用记录查询统计数字的功能。
-SQLALCHEMY_RECORD_QUERIES = True
+# 查询统计和慢查询日志已经由 app.sql_monitor 完成，不再需要它
+SQLALCHEMY_RECORD_QUERIES = False
 FLASKY_SLOW_DB_QUERY_TIME = 0.5
+# 同一请求里相同的语句出现多少次算作疑似 N+1
+SQL_MONITOR_ENABLED = True
+SQL_MONITOR_N_PLUS_ONE_THRESHOLD = 5
+# 采样分析器：每 N 个请求采样一个；慢请求阈值（秒），设置后每个请求都要采样，超过阈值的全部保留，开销较大；
+# 采样间隔（秒）；collapsed stack 输出目录
+PROFILER_SAMPLE_RATE = 100
+PROFILER_LATENCY_THRESHOLD = None
+PROFILER_INTERVAL = 0.005
+PROFILER_DIR = None
 SQLALCHEMY_ECHO = False
 SQLALCHEMY_COMMIT_ON_TEARDOWN = True
 
@@ -38,6 +61,20 @@ MAIL_PORT = 465
 MAIL_USE_SSL = True
 MAIL_USERNAME = ''
 MAIL_PASSWORD = ''
+# 发信队列：队列长度、队列满时最多等待多少秒（之后丢弃并记录日志）、发信线程数、每批在同一个 SMTP 连接上连续发送的封数、
+# 失败重试次数和首次退避时间（秒，之后每次翻倍）、连接空闲多久后断开、退出时等待队列发完的最长时间
+MAIL_QUEUE_SIZE = 1000
+MAIL_QUEUE_PUT_TIMEOUT = 1.0
+MAIL_WORKERS = 2
+MAIL_BATCH_SIZE = 20
+MAIL_MAX_RETRIES = 3
+MAIL_RETRY_BACKOFF = 1.0
+MAIL_IDLE_TIMEOUT = 30
+MAIL_DRAIN_TIMEOUT = 10
+# 错误日志邮件：相同错误合并后每隔多少秒发一封摘要、每小时最多发几封、日志队列长度（满了丢弃，不阻塞请求）
+ERROR_MAIL_DIGEST_INTERVAL = 60
+ERROR_MAIL_MAX_PER_HOUR = 10
+ERROR_MAIL_QUEUE_SIZE = 1000
 FLASKY_MAIL_SUBJECT_PREFIX = '[OAOA的小站]'
 FLASKY_MAIL_SENDER = ''
 FLASKY_ADMIN_NAME = ''
@@ -47,7 +84,40 @@ FLASKY_ADMIN_ABOUT = ''
 FLASKY_POSTS_PER_PAGE = 10
 FLASKY_FOLLOWERS_PER_PAGE = 20
 FLASKY_COMMENTS_PER_PAGE = 10
+# 浏览计数缓冲：累计多少个不同的计数器或多少秒后批量写回数据库
+VIEW_COUNTER_FLUSH_SIZE = 100
+VIEW_COUNTER_FLUSH_INTERVAL = 30
+# Markdown 渲染缓存：内存中最多保留的条目数，以及可选的磁盘缓存目录
+RENDER_CACHE_SIZE = 1024
+RENDER_CACHE_DIR = None
+# 头像：允许生成的尺寸（像素，页面上按 2 倍像素显示）、内存中最多保留的 PNG 数，以及可选的磁盘缓存目录
+AVATAR_SIZES = (48, 64, 180)
+AVATAR_CACHE_SIZE = 512
+AVATAR_CACHE_DIR = None
+# 静态资源构建（manage.py assets）：输出目录（默认为实例目录下的 assets），以及每个静态目录里要构建的文件
+ASSETS_BUILD_DIR = None
+ASSETS_INCLUDE = {
+    'blog.static': ['css/*.css', 'js/*.js', 'img/*',
+                    'editor.md/editormd.min.js', 'editor.md/css/*.min.css',
+                    'editor.md/fonts/*', 'editor.md/images/*'],
+}
+# 文件发送方式：None 由 worker 发送；'x-sendfile'（Apache/lighttpd）或 'x-accel-redirect'（nginx）交给前端服务器发送。
+# nginx 需要把文件路径前缀映射到 internal location，例如 {'/srv/flask-blog/': '/_sendfile/'}，
+# 对应的 location 里用 alias 指回同一目录，并打开 gzip_static 以便发送 /assets/ 的预压缩版本
+SENDFILE_MODE = None
+SENDFILE_ACCEL_MAPPING = {}
+# 侧边栏分类文章数的缓存时间（秒），写操作会主动清除；多个 worker 时请使用共享的 CACHE_TYPE
+FLASKY_CATEGORY_CACHE_TIMEOUT = 300
+# 整页缓存的过期时间（秒），相关数据变化时会按标签主动清除
+PAGE_CACHE_TIMEOUT = 120
+# 登录用户身份（id、是否启用、角色）的缓存时间（秒），用户资料或角色变化时会主动清除
+IDENTITY_CACHE_TIMEOUT = 60
 PUBLIC_CDN_DOMAIN = 'cdn.bootcss.com'  # 公用js文件的cdn地址
+BOOTSTRAP_PUBLIC_CDN = True  # Bootstrap、jQuery 等从 PUBLIC_CDN_DOMAIN 加载
+# 可选模块，打开后 create_app 才会导入
+WECHAT_ENABLED = False
+SOCKETIO_ENABLED = False
+CDN_ENABLED = False
 
 # flask-login
 SESSION_PROTECTION = 'strong'  # strong basic None
@@ -3,20 +3,33 @@
 
 from __future__ import print_function, unicode_literals, absolute_import
 from flask_migrate import MigrateCommand, Migrate
-from flask_script import Manager, Shell
-from app import app
-from app.extensions import db
-from app.blog.models import User, Role, Post, Category
+from flask import current_app
+from flask_script import Manager, Shell, Command, Option
+from app import create_app
+from app.extensions import db, render_cache
+from app.blog.models import User, Role, Post, Category, Comment, invalidate_identity
+from app.blog.views.home import invalidate_category_counts
 from app.permissions import (role_admin, role_moderator,
                              role_blogger, role_user, role_deny)
 import codecs
+import time
 
-master = Manager(app)
-migrate = Migrate(app, db)
+migrate = Migrate()
+
+
+def make_app(config=None):
+    app = create_app(config)
+    migrate.init_app(app, db)
+    return app
+
+
+# 命令执行时才创建应用，python manage.py -c <配置文件> ... 可以额外加载一个配置文件
+master = Manager(make_app)
+master.add_option('-c', '--config', dest='config', required=False)
 
 
 def make_shell_context():
-    return dict(app=app, db=db, User=User, Role=Role,
+    return dict(app=current_app._get_current_object(), db=db, User=User, Role=Role,
                 Post=Post, Category=Category)
 
 
@@ -28,7 +41,7 @@ master.add_command('db', MigrateCommand)
                help='user password, required')
 def create_admin(password):
     admin_user = User.query.filter_by(
-        username=app.config['FLASKY_ADMIN_NAME']).first()
+        username=current_app.config['FLASKY_ADMIN_NAME']).first()
     if admin_user is not None:
         return
 
@@ -47,12 +60,12 @@ def create_admin(password):
         db.session.add(role)
 
     # 创建admin用户
-    admin_user = User(app.config['FLASKY_ADMIN_MAIL'],
+    admin_user = User(current_app.config['FLASKY_ADMIN_MAIL'],
                       password,
-                      username=app.config['FLASKY_ADMIN_NAME'],
+                      username=current_app.config['FLASKY_ADMIN_NAME'],
                       active=True,
-                      nickname=app.config['FLASKY_ADMIN_NICK'],
-                      about_me=app.config['FLASKY_ADMIN_ABOUT'])
+                      nickname=current_app.config['FLASKY_ADMIN_NICK'],
+                      about_me=current_app.config['FLASKY_ADMIN_ABOUT'])
     db.session.add(admin_user)
 
     admin = Role.query.filter_by(name=role_admin.value).first()
@@ -66,6 +79,237 @@ def deploy():
     from flask_migrate import upgrade
 
     upgrade()
+    render_posts()
+    repair_comment_counts()
+    assets()
+
+
+@master.command
+def create_db():
+    """Create the tables that are not managed by migrations."""
+    # 以前在导入 app 时执行，每个 worker、每条 manage.py 命令都会连一次数据库
+    from app.extensions import meta
+    db.create_all()
+    meta.create_all(bind=db.engine)
+
+
+@master.option('-n', '--top', dest='top', type=int, default=20,
+               help='number of slowest imports to show')
+def boot_report(top):
+    """Report import time and app creation time in a fresh interpreter."""
+    # 在新的解释器里用 -X importtime 导入并创建应用，当前进程已经加载过的模块不影响结果
+    import subprocess
+    import sys
+    script = ('import time; t0 = time.time(); import app; t1 = time.time(); '
+              'app.create_app(); t2 = time.time(); '
+              'print("%f %f" % (t1 - t0, t2 - t1))')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', script],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        print(result.stderr)
+        return
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative_us), int(self_us), name.rstrip()))
+    import_time, create_time = (float(v) for v in result.stdout.split())
+    print('import app: %.0fms, create_app(): %.0fms, %d modules imported'
+          % (import_time * 1000, create_time * 1000, len(imports)))
+    print('%12s %12s  module' % ('cumulative', 'self'))
+    for cumulative_us, self_us, name in sorted(imports, reverse=True)[:top]:
+        print('%10.1fms %10.1fms %s' % (cumulative_us / 1000.0, self_us / 1000.0, name))
+
+
+@master.option('-a', '--all', dest='everything', action='store_true', default=False,
+               help='re-render every post, not only the ones without body_html')
+@master.option('-c', '--chunk', dest='chunk', type=int, default=500,
+               help='posts loaded and committed per round trip')
+def render_posts(everything=False, chunk=500):
+    """Backfill posts.body_html from the stored Markdown."""
+    # posts.body_html 是后加的字段，迁移之后老文章的这一列为空，需要补上渲染结果。
+    # 和 _rerender_model 一样按 id 分批读取和提交，不把所有文章一次载入内存
+    last_id = 0
+    count = 0
+    while True:
+        query = Post.query.filter(Post.id > last_id).order_by(Post.id)
+        if not everything:
+            query = query.filter(Post.body_html.is_(None))
+        posts = query.limit(chunk).all()
+        if not posts:
+            break
+        last_id = posts[-1].id
+        for post in posts:
+            Post.on_changed_body(post, post.body, None, None)
+        count += len(posts)
+        db.session.commit()
+        db.session.expunge_all()
+    print('rendered %d posts' % count)
+
+
+@master.option('-n', '--dry-run', dest='dry_run', action='store_true', default=False,
+               help='only report the posts whose counters have drifted')
+def repair_comment_counts(dry_run=False):
+    """Recompute posts.comment_count and posts.enabled_comment_count."""
+    from sqlalchemy import select, func, or_, and_
+
+    posts = Post.__table__
+    comments = Comment.__table__
+    total = select([func.count(comments.c.id)]).\
+        where(comments.c.post_id == posts.c.id).as_scalar()
+    enabled = select([func.count(comments.c.id)]).\
+        where(and_(comments.c.post_id == posts.c.id,
+                   or_(comments.c.disabled.is_(None), comments.c.disabled == False))).as_scalar()
+    drifted = or_(posts.c.comment_count != total, posts.c.enabled_comment_count != enabled)
+
+    count = db.session.execute(select([func.count(posts.c.id)]).where(drifted)).scalar()
+    if count and not dry_run:
+        db.session.execute(posts.update().where(drifted).
+                           values(comment_count=total, enabled_comment_count=enabled))
+        db.session.commit()
+    print('%d posts with drifted comment counts%s' % (count, '' if dry_run else ' repaired'))
+
+
+def _render_rows(profile_name, rows):
+    # 在进程池的子进程中执行，返回 (id, 渲染结果)
+    return [(ident, render_cache.render(body, profile_name)) for ident, body in rows]
+
+
+def _rerender_model(model, profile_name, executor, from_id, chunk, workers, dry_run):
+    last_id = from_id - 1
+    scanned = changed = 0
+    started = time.time()
+    while True:
+        rows = db.session.query(model.id, model.body, model.body_html).\
+            filter(model.id > last_id).order_by(model.id).limit(chunk).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        old_html = dict((row.id, row.body_html) for row in rows)
+
+        # 每个子进程处理一小片，一个 chunk 尽量均匀地分给所有 worker
+        step = max(1, len(rows) // workers)
+        slices = [[(row.id, row.body) for row in rows[i:i + step]] for i in range(0, len(rows), step)]
+        mappings = []
+        for rendered in executor.map(_render_rows, [profile_name] * len(slices), slices):
+            mappings.extend({'id': ident, 'body_html': html}
+                            for ident, html in rendered if old_html[ident] != html)
+
+        scanned += len(rows)
+        changed += len(mappings)
+        if mappings and not dry_run:
+            db.session.bulk_update_mappings(model, mappings)
+            db.session.commit()
+        elapsed = time.time() - started
+        print('%s: %d scanned, %d changed, last id %d, %.1f rows/s'
+              % (model.__tablename__, scanned, changed, last_id, scanned / elapsed if elapsed else 0))
+    return scanned, changed, time.time() - started
+
+
+@master.option('-t', '--target', dest='target', default='all',
+               help='what to re-render: posts, comments or all')
+@master.option('-f', '--from-id', dest='from_id', type=int, default=0,
+               help='resume from this id (inclusive), only with --target posts or comments')
+@master.option('-c', '--chunk', dest='chunk', type=int, default=1000,
+               help='rows fetched and written per round trip')
+@master.option('-w', '--workers', dest='workers', type=int, default=None,
+               help='render processes, defaults to the number of CPUs')
+@master.option('-n', '--dry-run', dest='dry_run', action='store_true', default=False,
+               help='only count the rows whose body_html would change')
+def rerender(target, from_id, chunk, workers, dry_run):
+    """Re-render body_html of posts and comments after changing the whitelists."""
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    targets = {'posts': [(Post, 'post')],
+               'comments': [(Comment, 'comment')],
+               'all': [(Post, 'post'), (Comment, 'comment')]}
+    if target not in targets:
+        raise ValueError('Unknown target %s' % target)
+    # 文章和评论的 id 各自编号，同一个续跑位置不能同时用于两张表
+    if from_id and target == 'all':
+        raise ValueError('--from-id needs --target posts or --target comments')
+    workers = workers or multiprocessing.cpu_count()
+
+    # 子进程通过 fork 继承已经加载好的模型和渲染配置，只负责渲染，不访问数据库
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for model, profile_name in targets[target]:
+            scanned, changed, elapsed = _rerender_model(model, profile_name, executor,
+                                                        from_id, chunk, workers, dry_run)
+            print('%s done: %d rows in %.1fs (%.1f rows/s), %d %s'
+                  % (model.__tablename__, scanned, elapsed, scanned / elapsed if elapsed else 0,
+                     changed, 'would change' if dry_run else 'updated'))
+
+
+@master.command
+def assets():
+    """Build fingerprinted, precompressed static assets and their manifest."""
+    from app.extensions import assets as asset_builder
+    from app.assets import brotli
+    started = time.time()
+    stats = asset_builder.build(current_app._get_current_object())
+    print('built %d files (%d bytes, gzip %d bytes%s) into %s in %.1fs' % (
+        stats['files'], stats['bytes'], stats['gzip_bytes'],
+        ', brotli %d bytes' % stats['brotli_bytes'] if brotli is not None else ', brotli not installed',
+        asset_builder.build_dir, time.time() - started))
+    print('restart the workers to pick up the new manifest')
+
+
+@master.option('-o', '--output', dest='output', default='-',
+               help='JSONL file to write, - for stdout')
+@master.option('-c', '--chunk', dest='chunk', type=int, default=1000,
+               help='rows fetched per round trip')
+def export(output, chunk):
+    """Stream users, categories, tags, posts and comments as JSONL."""
+    import sys
+    from app.blog.corpus import export_corpus
+    started = time.time()
+    if output == '-':
+        counts = export_corpus(sys.stdout, chunk)
+    else:
+        with codecs.open(output, 'w', encoding='utf-8') as fp:
+            counts = export_corpus(fp, chunk)
+    sys.stderr.write('exported %s in %.1fs\n' % (
+        ', '.join('%d %s' % (counts[k], k) for k in sorted(counts)), time.time() - started))
+
+
+class ImportCorpus(Command):
+    """Load a JSONL file written by export into the current database."""
+    # import 是关键字，不能用 @master.option 注册
+
+    option_list = (
+        Option('-i', '--input', dest='input_file', required=True, help='JSONL file to read'),
+        Option('-c', '--chunk', dest='chunk', type=int, default=1000,
+               help='rows per bulk insert'),
+    )
+
+    def run(self, input_file, chunk):
+        from app.blog.corpus import import_corpus
+        started = time.time()
+        with codecs.open(input_file, 'r', encoding='utf-8') as fp:
+            counts = import_corpus(fp, chunk)
+        from app.extensions import page_cache
+        from app.blog.search import reindex
+        invalidate_category_counts()
+        page_cache.invalidate('posts', 'categories')
+        # 批量写入不触发 Post 上的事件，搜索索引需要重建
+        print('indexed %d posts for search' % reindex())
+        print('imported %s in %.1fs' % (
+            ', '.join('%d %s' % (counts[k], k) for k in sorted(counts)), time.time() - started))
+
+
+master.add_command('import', ImportCorpus())
+
+
+@master.option('-c', '--chunk', dest='chunk', type=int, default=500,
+               help='posts loaded per batch')
+def reindex(chunk):
+    """Rebuild the full-text search index from scratch."""
+    from app.blog.search import reindex as rebuild
+    started = time.time()
+    print('indexed %d posts in %.1fs' % (rebuild(chunk), time.time() - started))
 
 
 @master.option('-r', '--role', dest='role', default='user',
@@ -90,6 +334,7 @@ def create_user(role, name, email, pwd, nick, about):
     db.session.add(user)
     db.session.add(role_instance)
     db.session.commit()
+    invalidate_identity(user.id)
 
 
 @master.option('-s', '--string', dest='strings', default=None,
@@ -109,6 +354,7 @@ def add_category(strings, json_file):
             c = Category(name)
             db.session.add(c)
     db.session.commit()
+    invalidate_category_counts()
 
 
 @master.command
@@ -120,12 +366,82 @@ def test():
 
 @master.option('-l', '--length', dest='length', default=25)
 @master.option('-d', '--dir', dest='profile_dir', default=None)
-def profile(length, profile_dir):
+@master.option('-s', '--sample', dest='sample_rate', type=int, default=None,
+               help='use the sampling profiler and keep 1 in N requests')
+@master.option('-t', '--threshold', dest='threshold', type=float, default=None,
+               help='with --sample, always keep requests slower than this many seconds')
+def profile(length, profile_dir, sample_rate, threshold):
     """Start the application under the code profiler."""
     # 使用 python manage.py profile 启动程序后,终端会显示每条请求的分析数据,其中包含运行最慢的 25 个函数。
     # --length 选项可以修改报告中显示的函数数量
     # 如果指定了--profile-dir 选项,每条请求的分析数据就会保存到指定目录下的一个文件中
+    # 指定 --sample 时改用采样分析器,结果按 endpoint 累加,退出时写到 --dir 指定的目录下的 .folded 文件中
+    if sample_rate is not None:
+        from app.extensions import profiler
+        profiler.sample_rate = sample_rate
+        if threshold is not None:
+            profiler.latency_threshold = threshold
+        if profile_dir is not None:
+            profiler.output_dir = profile_dir
+        profiler.switch(True)
+        current_app.run()
+        return
+
     from werkzeug.contrib.profiler import ProfilerMiddleware
+    app = current_app._get_current_object()
     app.wsgi_app = ProfilerMiddleware(app.wsgi_app, restrictions=[length],
                                       profile_dir=profile_dir)
     app.run()
+
+
+@master.option('-o', '--output', dest='output', default=None,
+               help='write the JSON report here (default: benchmarks/results/<timestamp>.json)')
+@master.option('-b', '--baseline', dest='baseline', default=None,
+               help='compare with an earlier JSON report')
+@master.option('--db', dest='db_path', default='benchmarks/bench.sqlite')
+@master.option('--reuse', dest='reuse', action='store_true', default=False,
+               help='benchmark the existing database instead of seeding a new one')
+@master.option('--posts', dest='posts', type=int, default=10000)
+@master.option('--comments', dest='comments', type=int, default=500000)
+@master.option('--users', dest='users', type=int, default=50)
+@master.option('--tags', dest='tags', type=int, default=500)
+@master.option('--categories', dest='categories', type=int, default=20)
+@master.option('-r', '--requests', dest='requests', type=int, default=200)
+@master.option('-c', '--concurrency', dest='concurrency', type=int, default=8)
+@master.option('-s', '--scenario', dest='scenarios', action='append', default=None,
+               help='only run this scenario (repeatable)')
+@master.option('--server', dest='server', action='store_true', default=False,
+               help='drive a local WSGI server over HTTP instead of the test client')
+@master.option('--cached', dest='cached', action='store_true', default=False,
+               help='keep the page cache enabled')
+def benchmark(output, baseline, db_path, reuse, posts, comments, users, tags, categories,
+              requests, concurrency, scenarios, server, cached):
+    """Seed a synthetic dataset and load test the main routes."""
+    # 压测使用单独的 SQLite 文件，不会碰开发数据库
+    # 默认关闭整页缓存，测量的是真正执行查询和渲染模板的开销
+    from benchmarks import seed, runner
+    import os
+    # 扩展在 create_app 时读取配置（例如 SQL_MONITOR_ENABLED），所以用修改后的配置重新创建一个应用
+    app = make_app(dict(current_app.config,
+                        SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.abspath(db_path),
+                        PAGE_CACHE_DISABLED=not cached,
+                        SQL_MONITOR_ENABLED=True))
+
+    with app.app_context():
+        if not reuse or not os.path.exists(db_path):
+            sizes = seed.seed(users=users, categories=categories, tags=tags,
+                              posts=posts, comments=comments)
+        else:
+            sizes = {'posts': Post.query.count(), 'comments': Comment.query.count()}
+
+    results = runner.run(app, requests=requests, concurrency=concurrency, scenarios=scenarios,
+                         driver='server' if server else 'client')
+    if output is None:
+        output = os.path.join('benchmarks', 'results', time.strftime('%Y%m%d-%H%M%S') + '.json')
+    runner.save(output, results, sizes, {
+        'requests': requests, 'concurrency': concurrency,
+        'driver': 'server' if server else 'client', 'page_cache': cached,
+    })
+    print('report written to %s' % output)
+    if baseline:
+        runner.compare(baseline, results)
@@ -0,0 +1,12 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 测试使用内存数据库，不需要实例目录下的配置文件
+TEST_CONFIG = {
+    'TESTING': True,
+    'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+    'SECRET_KEY': 'testing',
+    'WTF_CSRF_ENABLED': False,
+    'CACHE_TYPE': 'simple',
+    'MAIL_SUPPRESS_SEND': True,
+}
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from flask import render_template_string
+from app import create_app
+from app.extensions import assets
+from tests import TEST_CONFIG
+
+
+class AssetsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.build_dir = tempfile.mkdtemp()
+        self.app = create_app(dict(TEST_CONFIG, ASSETS_BUILD_DIR=self.build_dir))
+        self.client = self.app.test_client()
+        assets.build(self.app)
+
+    def tearDown(self):
+        assets.manifest = {}
+        shutil.rmtree(self.build_dir)
+
+    def test_only_selected_files_are_built(self):
+        self.assertIn('blog.static:css/styles.css', assets.manifest)
+        self.assertIn('blog.static:editor.md/editormd.min.js', assets.manifest)
+        self.assertNotIn('blog.static:editor.md/editormd.js', assets.manifest)
+        self.assertFalse(any('/examples/' in key for key in assets.manifest))
+
+    def test_css_references_are_fingerprinted(self):
+        with io.open(os.path.join(self.build_dir, assets.manifest['blog.static:css/styles.css']), encoding='utf-8') as fp:
+            css = fp.read()
+        self.assertIn('/assets/' + assets.manifest['blog.static:img/quote_l.gif'], css)
+
+    def test_url_for_uses_manifest(self):
+        with self.app.test_request_context():
+            url = render_template_string("{{ url_for('blog.static', filename='css/styles.css') }}")
+            self.assertEqual(url, '/assets/' + assets.manifest['blog.static:css/styles.css'])
+            url = render_template_string("{{ url_for('blog.static', filename='editor.md/lib/') }}")
+            self.assertEqual(url, '/blog/static/editor.md/lib/')
+
+    def test_relative_static_outside_a_blueprint(self):
+        with self.app.test_request_context('/blog/article'):
+            url = render_template_string("{{ url_for('.static', filename='css/styles.css') }}")
+            self.assertEqual(url, '/assets/' + assets.manifest['blog.static:css/styles.css'])
+        # 请求不属于任何蓝本时 request.blueprint 是 None，按应用的 static 生成地址
+        with self.app.test_request_context('/no-such-page'):
+            url = render_template_string("{{ url_for('.static', filename='favicon.ico') }}")
+            self.assertEqual(url, '/static/favicon.ico')
+
+    def test_precompressed_asset_is_immutable(self):
+        url = '/assets/' + assets.manifest['blog.static:css/styles.css']
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.mimetype, 'text/css')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertNotIn('Content-Encoding', self.client.get(url).headers)
+        self.assertEqual(self.client.get('/assets/manifest.json').status_code, 404)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+from flask import url_for
+from app import create_app
+from app.extensions import avatars
+from app.avatars import render_identicon, identicon_grid, IDENTICON_VERSION
+from tests import TEST_CONFIG
+
+DIGEST = hashlib.md5(b'john@example.com').hexdigest()
+
+
+class IdenticonTestCase(unittest.TestCase):
+    def test_grid_is_mirrored(self):
+        for row in identicon_grid(DIGEST):
+            self.assertEqual(row, row[::-1])
+
+    def test_png_dimensions(self):
+        png = render_identicon(DIGEST, 64)
+        self.assertEqual(png[:8], b'\x89PNG\r\n\x1a\n')
+        self.assertEqual(struct.unpack('>II', png[16:24]), (64, 64))
+        start = png.index(b'IDAT')
+        length = struct.unpack('>I', png[start - 4:start])[0]
+        self.assertEqual(len(zlib.decompress(png[start + 4:start + 4 + length])), 64 * (1 + 64 * 3))
+
+
+class AvatarEndpointTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.app = create_app(dict(TEST_CONFIG, AVATAR_CACHE_DIR=self.cache_dir))
+        self.client = self.app.test_client()
+        avatars.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    @staticmethod
+    def url(digest, size):
+        return '/avatar/v%d/%s-%d.png' % (IDENTICON_VERSION, digest, size)
+
+    def test_url_and_etag_include_identicon_version(self):
+        with self.app.test_request_context():
+            self.assertEqual(url_for('index.avatar', digest=DIGEST, size=64), self.url(DIGEST, 64))
+        etag = self.client.get(self.url(DIGEST, 64)).headers['ETag']
+        self.assertIn('v%d-' % IDENTICON_VERSION, etag)
+
+    def test_outdated_urls_redirect_to_current_version(self):
+        for url in ('/avatar/%s-64.png' % DIGEST, '/avatar/v%d/%s-64.png' % (IDENTICON_VERSION + 1, DIGEST)):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 301)
+            self.assertTrue(response.location.endswith(self.url(DIGEST, 64)))
+
+    def test_avatar_is_immutable(self):
+        response = self.client.get(self.url(DIGEST, 64))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertEqual(response.data, render_identicon(DIGEST, 64))
+
+        response = self.client.get(self.url(DIGEST, 64),
+                                   headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_disk_cache_survives_memory_clear(self):
+        self.client.get(self.url(DIGEST, 64))
+        avatars.clear()
+        self.client.get(self.url(DIGEST, 64))
+        self.assertEqual(avatars.stats()['disk_hits'], 1)
+
+    def test_unknown_size_is_rejected(self):
+        self.assertEqual(self.client.get(self.url(DIGEST, 65)).status_code, 404)
+        self.assertEqual(self.client.get(self.url('z' * 32, 64)).status_code, 404)
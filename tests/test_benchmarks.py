@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+from app import create_app
+from app.extensions import db
+from tests import TEST_CONFIG
+from app.blog.models import Post, Comment
+from benchmarks import seed, runner
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TEST_CONFIG)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(runner.percentile(values, 50), 50)
+        self.assertEqual(runner.percentile(values, 99), 99)
+        self.assertEqual(runner.percentile([], 95), 0.0)
+
+    def test_seeded_comment_counts_are_consistent(self):
+        seed.seed(users=3, categories=2, tags=5, posts=10, comments=50,
+                  body_variants=2, comment_variants=3)
+        self.assertEqual(Post.query.count(), 10)
+        for post in Post.query:
+            self.assertEqual(post.comment_count, Comment.query.filter_by(post_id=post.id).count())
+            self.assertIsNotNone(post.body_html)
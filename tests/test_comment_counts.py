@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import unittest
+from contextlib import redirect_stdout
+from app import create_app
+from app.extensions import db
+from tests import TEST_CONFIG
+from app.blog.models import Post, Comment
+
+
+class CommentCountTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TEST_CONFIG)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.first = Post(title='first', body='b')
+        self.second = Post(title='second', body='b')
+        db.session.add_all([self.first, self.second])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def counts(self, post):
+        db.session.refresh(post)
+        return post.comment_count, post.enabled_comment_count
+
+    def add_comment(self, post, disabled=False):
+        comment = Comment(body='c', post_id=post.id, disabled=disabled)
+        db.session.add(comment)
+        db.session.commit()
+        return comment
+
+    def test_insert_and_delete(self):
+        comment = self.add_comment(self.first)
+        self.add_comment(self.first, disabled=True)
+        self.assertEqual(self.counts(self.first), (2, 1))
+
+        db.session.delete(comment)
+        db.session.commit()
+        self.assertEqual(self.counts(self.first), (1, 0))
+
+    def test_toggle_disabled(self):
+        comment = self.add_comment(self.first)
+        comment.disabled = True
+        db.session.commit()
+        self.assertEqual(self.counts(self.first), (1, 0))
+        comment.disabled = False
+        db.session.commit()
+        self.assertEqual(self.counts(self.first), (1, 1))
+
+    def test_move_to_another_post(self):
+        comment = self.add_comment(self.first)
+        self.add_comment(self.first, disabled=True)
+        comment.post_id = self.second.id
+        comment.disabled = True
+        db.session.commit()
+        self.assertEqual(self.counts(self.first), (1, 0))
+        self.assertEqual(self.counts(self.second), (1, 0))
+
+    def test_repair_fixes_drifted_rows(self):
+        from manage import repair_comment_counts
+        self.add_comment(self.first)
+        self.add_comment(self.first, disabled=True)
+        db.session.execute(Post.__table__.update().values(comment_count=7, enabled_comment_count=5))
+        db.session.commit()
+
+        with redirect_stdout(io.StringIO()) as output:
+            repair_comment_counts(dry_run=True)
+        self.assertIn('2 posts', output.getvalue())
+        self.assertEqual(self.counts(self.first), (7, 5))
+
+        with redirect_stdout(io.StringIO()):
+            repair_comment_counts()
+        self.assertEqual(self.counts(self.first), (2, 1))
+        self.assertEqual(self.counts(self.second), (0, 0))
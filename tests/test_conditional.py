@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+from datetime import datetime, timedelta
+from app import create_app
+from app.extensions import db, cache, page_cache, view_counter
+from app.permissions import role_user
+from benchmarks.runner import _login
+from tests import TEST_CONFIG
+from app.blog.models import User, Role, Post, Category
+
+
+class ConditionalGetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(dict(TEST_CONFIG, VIEW_COUNTER_FLUSH_SIZE=1000, VIEW_COUNTER_FLUSH_INTERVAL=3600))
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        cache.clear()
+        author = User('author@example.com', 'pwd', username='author', active=True)
+        author.roles.append(Role(name=role_user.value))
+        category = Category('python')
+        db.session.add_all([author, category])
+        db.session.add(Post(title='hello', body='*hello*', author=author, category=category))
+        db.session.commit()
+        self.author_id = author.id
+        self.post = Post.query.first()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        view_counter._pending.clear()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def revalidate(self, url, response, client=None):
+        return (client or self.client).get(url, headers={'If-None-Match': response.headers['ETag']})
+
+    def logged_in_client(self):
+        client = self.app.test_client()
+        _login(client, self.author_id)
+        return client
+
+    def edit_post(self):
+        # 和 edit 视图一样更新修改时间并让相关页面失效
+        self.post.body = '*edited*'
+        self.post.last_modified_date = datetime.utcnow() + timedelta(seconds=1)
+        db.session.commit()
+        page_cache.invalidate('post:%d' % self.post.id)
+
+    def test_unchanged_post_is_not_modified(self):
+        url = '/blog/post/%d' % self.post.id
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('public', first.headers['Cache-Control'])
+        self.assertIn('no-cache', first.headers['Cache-Control'])
+
+        views = view_counter.pending(Post, self.post.id)
+        second = self.revalidate(url, first)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.data, b'')
+        self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+        # 304 也算一次浏览
+        self.assertEqual(view_counter.pending(Post, self.post.id), views + 1)
+
+        # 用 Last-Modified 的方式重新验证时不会误判为未修改
+        response = self.client.get(url, headers={'If-Modified-Since': 'Sun, 01 Jan 2017 00:00:00 GMT'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_post_changes_after_comment_and_edit(self):
+        url = '/blog/post/%d' % self.post.id
+        first = self.client.get(url)
+
+        writer = self.logged_in_client()
+        response = writer.post(url, data={'body': 'nice post'})
+        self.assertEqual(response.status_code, 302)
+        after_comment = self.revalidate(url, first)
+        self.assertEqual(after_comment.status_code, 200)
+        self.assertNotEqual(after_comment.headers['ETag'], first.headers['ETag'])
+
+        self.edit_post()
+        after_edit = self.revalidate(url, after_comment)
+        self.assertEqual(after_edit.status_code, 200)
+        self.assertIn('edited', after_edit.get_data(as_text=True))
+
+    def test_post_for_logged_in_users_is_always_rendered(self):
+        url = '/blog/post/%d' % self.post.id
+        anonymous = self.client.get(url)
+        # 登录用户的页面里有评论表单和 CSRF 令牌，不做条件 GET
+        client = self.logged_in_client()
+        response = self.revalidate(url, anonymous, client)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response.headers)
+
+    def test_pending_flash_bypasses_not_modified(self):
+        url = '/blog/post/%d' % self.post.id
+        first = self.client.get(url)
+        with self.client.session_transaction() as sess:
+            sess['_flashes'] = [('message', 'hello')]
+        self.assertEqual(self.revalidate(url, first).status_code, 200)
+        # flash 显示过之后恢复 304
+        self.assertEqual(self.revalidate(url, first).status_code, 304)
+
+    def test_listing_pages_are_revalidated(self):
+        for url in ('/blog/article', '/blog/article/python'):
+            first = self.client.get(url)
+            self.assertEqual(first.status_code, 200)
+            self.assertIn('public', first.headers['Cache-Control'])
+            self.assertEqual(self.revalidate(url, first).status_code, 304)
+
+        self.edit_post()
+        for url in ('/blog/article', '/blog/article/python'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+            # 不同身份的访问者 ETag 不同，登录用户的页面只允许私有缓存
+            mine = self.revalidate(url, response, self.logged_in_client())
+            self.assertEqual(mine.status_code, 200)
+            self.assertNotEqual(mine.headers['ETag'], response.headers['ETag'])
+            self.assertIn('private', mine.headers['Cache-Control'])
+
+    def test_listing_changes_after_comment(self):
+        url = '/blog/article'
+        first = self.client.get(url)
+        self.logged_in_client().post('/blog/post/%d' % self.post.id, data={'body': 'nice post'})
+        response = self.revalidate(url, first)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], first.headers['ETag'])
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import unittest
+from app import create_app
+from app.extensions import db
+from tests import TEST_CONFIG
+from app.blog.models import User, Post, Comment, Category, Tag
+from app.blog.corpus import export_corpus, import_corpus
+
+
+class CorpusTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TEST_CONFIG)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_round_trip_into_non_empty_database(self):
+        user = User('a@example.com', 'pwd', username='a')
+        category = Category('python')
+        post = Post(title='t', body='**hi**', author=user, category=category,
+                    tags=Tag.get_tags(['flask']))
+        db.session.add_all([user, category, post])
+        db.session.flush()
+        db.session.add(Comment(body='c', post_id=post.id, author_id=user.id))
+        db.session.commit()
+
+        fp = io.StringIO()
+        counts = export_corpus(fp, chunk=1)
+        self.assertEqual(counts['post'], 1)
+        self.assertEqual(counts['comment'], 1)
+
+        fp.seek(0)
+        imported = import_corpus(fp, chunk=1)
+        # 用户、分类、标签按名称合并，文章和评论追加一份
+        self.assertNotIn('user', imported)
+        self.assertEqual(User.query.count(), 1)
+        self.assertEqual(Tag.query.count(), 1)
+        self.assertEqual(Post.query.count(), 2)
+        copy = Post.query.filter(Post.id != post.id).one()
+        self.assertEqual(copy.body_html, post.body_html)
+        self.assertEqual(copy.author_id, user.id)
+        self.assertEqual([t.name for t in copy.tags], ['flask'])
+        self.assertEqual(Comment.query.filter_by(post_id=copy.id).count(), 1)
+
+    def test_username_conflict_is_renamed(self):
+        db.session.add(User('a@example.com', 'pwd', username='a'))
+        db.session.commit()
+        fp = io.StringIO()
+        export_corpus(fp)
+
+        # 目标库里同名的是另一个邮箱的用户
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        other = User('other@example.com', 'pwd', username='a')
+        db.session.add(other)
+        db.session.commit()
+
+        fp.seek(0)
+        imported = import_corpus(fp)
+        self.assertEqual((imported['user'], imported['user_renamed']), (1, 1))
+        user = User.query.filter_by(email='a@example.com').one()
+        self.assertNotEqual(user.username, 'a')
+        self.assertTrue(user.username.startswith('a-'))
+        self.assertEqual(User.query.get(other.id).username, 'a')
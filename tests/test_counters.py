@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+from app import create_app
+from app.extensions import db, view_counter
+from tests import TEST_CONFIG
+from app.blog.models import Post
+
+
+class ViewCounterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TEST_CONFIG)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_pending_hits_are_flushed_in_batch(self):
+        post = Post(title='t', body='b', view_times=1)
+        db.session.add(post)
+        db.session.commit()
+
+        view_counter.hit(Post, post.id)
+        view_counter.hit(Post, post.id, 2)
+        self.assertEqual(view_counter.pending(Post, post.id), 3)
+        self.assertEqual(post.view_count, 4)
+
+        view_counter.flush()
+        db.session.refresh(post)
+        self.assertEqual(view_counter.pending(Post, post.id), 0)
+        self.assertEqual(post.view_times, 4)
+
+    def test_flush_at_exit_needs_no_app_context(self):
+        post = Post(title='t', body='b', view_times=1)
+        db.session.add(post)
+        db.session.commit()
+        post_id = post.id
+        view_counter.hit(Post, post_id)
+
+        # atexit 调用 flush 时没有应用上下文
+        self.ctx.pop()
+        try:
+            view_counter.flush()
+        finally:
+            self.ctx.push()
+        self.assertEqual(view_counter.pending(Post, post_id), 0)
+        self.assertEqual(Post.query.get(post_id).view_times, 2)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+from sqlalchemy import create_engine
+from app.database import MonitoredQueuePool
+
+
+class MonitoredPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        self.engine = create_engine('sqlite:///' + self.path, poolclass=MonitoredQueuePool,
+                                    ping_on_checkout=True, pool_size=1, max_overflow=0, pool_timeout=0.1)
+
+    def tearDown(self):
+        self.engine.dispose()
+        os.remove(self.path)
+
+    def test_checkouts_and_timeouts_are_counted(self):
+        conn = self.engine.connect()
+        self.assertEqual(self.engine.pool.status()['checked_out'], 1)
+        with self.assertRaises(Exception):
+            self.engine.connect()
+        conn.close()
+        self.engine.connect().close()
+
+        status = self.engine.pool.status()
+        self.assertEqual(status['checkouts'], 3)
+        self.assertEqual(status['timeouts'], 1)
+        self.assertEqual(status['checked_out'], 0)
+        self.assertGreaterEqual(status['max_wait_ms'], 100)
+
+    def test_settings_survive_dispose(self):
+        self.engine.dispose()
+        self.assertIsInstance(self.engine.pool, MonitoredQueuePool)
+        self.assertTrue(self.engine.pool.ping_on_checkout)
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    """用两个 SQLite 文件分别充当主库和副本，两边写入不同的数据来判断查询走了哪个库"""
+
+    def setUp(self):
+        from app import create_app
+        from app.extensions import db
+        from tests import TEST_CONFIG
+        from app.blog.models import Category
+        self.db, self.Category = db, Category
+        self.paths = []
+        for _ in range(2):
+            fd, path = tempfile.mkstemp(suffix='.sqlite')
+            os.close(fd)
+            self.paths.append(path)
+        self.app = create_app(dict(TEST_CONFIG, SQLALCHEMY_DATABASE_URI='sqlite:///' + self.paths[0],
+                                   SQLALCHEMY_REPLICA_URIS=['sqlite:///' + self.paths[1]]))
+        with self.app.app_context():
+            db.create_all()
+            replica = db.get_engine(self.app, 'replica0')
+            db.Model.metadata.create_all(replica)
+            db.session.add(Category('primary'))
+            db.session.commit()
+            replica.execute(Category.__table__.insert(), id=1, category_name='replica')
+
+    def tearDown(self):
+        with self.app.app_context():
+            self.db.session.remove()
+            for bind in (None, 'replica0'):
+                self.db.get_engine(self.app, bind).dispose()
+        for path in self.paths:
+            os.remove(path)
+
+    def category_name(self):
+        name = self.Category.query.get(1).category_name
+        self.db.session.remove()
+        return name
+
+    def test_get_reads_from_replica(self):
+        with self.app.test_request_context('/', method='GET'):
+            self.assertEqual(self.category_name(), 'replica')
+        with self.app.test_request_context('/', method='POST'):
+            self.assertEqual(self.category_name(), 'primary')
+        with self.app.app_context():
+            self.assertEqual(self.category_name(), 'primary')
+
+    def test_reads_after_write_stick_to_primary(self):
+        from flask import session
+        from app.database import LAST_WRITE_KEY
+        with self.app.test_request_context('/', method='POST'):
+            self.db.session.add(self.Category('new'))
+            self.db.session.commit()
+            last_write = session[LAST_WRITE_KEY]
+        with self.app.test_request_context('/', method='GET'):
+            session[LAST_WRITE_KEY] = last_write
+            self.assertEqual(self.category_name(), 'primary')
+            session[LAST_WRITE_KEY] = last_write - self.app.config['SQLALCHEMY_REPLICA_STICKY_SECONDS']
+            self.assertEqual(self.category_name(), 'replica')
+
+    def test_flushed_session_reads_from_primary(self):
+        with self.app.test_request_context('/', method='GET'):
+            self.db.session.add(self.Category('new'))
+            self.db.session.flush()
+            self.assertEqual(self.Category.query.get(1).category_name, 'primary')
+            self.db.session.rollback()
+            self.db.session.remove()
+
+
+class PoolStatsViewTestCase(unittest.TestCase):
+    def setUp(self):
+        from app import create_app
+        from app.extensions import db
+        from app.permissions import role_admin
+        from tests import TEST_CONFIG
+        from app.blog.models import User, Role
+        from benchmarks.runner import _login
+        self.db = db
+        self.app = create_app(dict(TEST_CONFIG, WTF_CSRF_ENABLED=True))
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        admin = User('admin@example.com', 'pwd', username='admin', active=True)
+        admin.roles.append(Role(name=role_admin.value))
+        db.session.add(admin)
+        db.session.commit()
+        self.client = self.app.test_client()
+        _login(self.client, admin.id)
+        # SQLite 不使用 MonitoredQueuePool，这里只检查视图有没有调用 reset_stats
+        self.reset_stats = db.get_engine(self.app).pool.reset_stats = mock.Mock()
+
+    def tearDown(self):
+        del self.db.get_engine(self.app).pool.reset_stats
+        self.db.session.remove()
+        self.db.drop_all()
+        self.ctx.pop()
+
+    def test_reset_requires_post_with_csrf(self):
+        # GET 只查看状态，不再清零
+        response = self.client.get('/blog/admin/pool-stats?reset=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/blog/admin/pool-stats/reset').status_code, 405)
+        self.assertEqual(self.client.post('/blog/admin/pool-stats/reset').status_code, 400)
+        self.assertFalse(self.reset_stats.called)
+
+        token = json.loads(response.get_data(as_text=True))['csrf_token']
+        response = self.client.post('/blog/admin/pool-stats/reset', headers={'X-CSRFToken': token})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.reset_stats.call_count, 1)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import socketserver
+import threading
+import unittest
+from unittest import mock
+from flask_mail import Message
+from app import create_app
+from app.extensions import mail_dispatcher
+from tests import TEST_CONFIG
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """只实现 smtplib 发信用到的几条命令"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply('220 localhost')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command = line.strip().upper()
+            if command == b'DATA':
+                self.reply('354 end with <CRLF>.<CRLF>')
+                data = []
+                while True:
+                    line = self.rfile.readline()
+                    if line in (b'.\r\n', b''):
+                        break
+                    data.append(line)
+                with server.lock:
+                    if server.failures:
+                        server.failures -= 1
+                        self.reply('451 try again later')
+                        continue
+                    server.messages.append(b''.join(data))
+                self.reply('250 queued')
+            elif command.startswith(b'QUIT'):
+                self.reply('221 bye')
+                break
+            else:
+                self.reply('250 ok')
+
+
+class _SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), _SMTPHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.failures = 0
+        self.messages = []
+
+
+class MailDispatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = _SMTPServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.app = create_app(dict(TEST_CONFIG, MAIL_SERVER='127.0.0.1', MAIL_PORT=self.server.server_address[1],
+                                   MAIL_USE_SSL=False, MAIL_USE_TLS=False, MAIL_SUPPRESS_SEND=False,
+                                   MAIL_RETRY_BACKOFF=0.01))
+
+    def tearDown(self):
+        mail_dispatcher.drain()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def message(self, i):
+        return Message('subject %d' % i, sender='blog@example.com', recipients=['user%d@example.com' % i],
+                       body='body %d' % i)
+
+    def test_messages_share_connections(self):
+        for i in range(30):
+            self.assertTrue(mail_dispatcher.submit(self.message(i)))
+        mail_dispatcher.drain()
+        self.assertEqual(len(self.server.messages), 30)
+        self.assertLessEqual(self.server.connections, mail_dispatcher.workers)
+
+    def test_failed_send_is_retried_on_new_connection(self):
+        self.server.failures = 1
+        mail_dispatcher.submit(self.message(0))
+        mail_dispatcher.drain()
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_drain_is_registered_once(self):
+        with mock.patch('atexit.register') as register:
+            create_app(TEST_CONFIG)
+            create_app(TEST_CONFIG)
+        self.assertNotIn(mock.call(mail_dispatcher.drain), register.call_args_list)
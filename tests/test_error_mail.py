@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import unittest
+from unittest import mock
+from queue import Queue
+from app import create_app, error_mail
+from app.error_mail import DigestMailHandler, ErrorQueueHandler, install_error_mail
+from tests import TEST_CONFIG
+
+
+class _CapturingDigest(DigestMailHandler):
+    def __init__(self, **kwargs):
+        super(_CapturingDigest, self).__init__(('localhost', 25), 'a@example.com', ['b@example.com'],
+                                               'Application Error', **kwargs)
+        self.sent = []
+        self.failures = 0
+
+    def send(self, subject, body):
+        if self.failures:
+            self.failures -= 1
+            raise IOError('smtp unavailable')
+        self.sent.append((subject, body))
+
+
+class ErrorMailTestCase(unittest.TestCase):
+    def setUp(self):
+        self.digest = _CapturingDigest(max_per_window=2)
+        self.handler = ErrorQueueHandler(Queue(5))
+        self.digest.source = self.handler
+        self.logger = logging.getLogger('test_error_mail')
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def drain(self):
+        while not self.handler.queue.empty():
+            self.digest.handle(self.handler.queue.get_nowait())
+
+    def test_identical_errors_are_aggregated(self):
+        for i in range(4):
+            self.logger.error('post %d not found', i)
+        self.logger.error('something else')
+        self.logger.error('dropped')
+        self.drain()
+        self.digest.flush()
+
+        self.assertEqual(len(self.digest.sent), 1)
+        subject, body = self.digest.sent[0]
+        self.assertIn('(5)', subject)
+        self.assertIn('4 occurrence(s)', body)
+        self.assertIn('1 log records were dropped', body)
+
+    def test_emails_are_rate_limited(self):
+        for _ in range(3):
+            self.logger.error('boom')
+            self.drain()
+            self.digest.flush()
+        self.assertEqual(len(self.digest.sent), 2)
+        self.assertEqual(self.digest.pending.popitem()[1]['count'], 1)
+
+    def test_failed_sends_do_not_use_up_the_quota(self):
+        self.digest.failures = 2
+        for _ in range(4):
+            self.logger.error('boom')
+            self.drain()
+            self.digest.flush()
+        # 前两次发送失败，错误留到下一轮，配额仍然够发两封
+        self.assertEqual(len(self.digest.sent), 2)
+        self.assertIn('(3)', self.digest.sent[0][0])
+        self.assertEqual(self.digest.pending, {})
+
+    def test_dropped_count_survives_failed_send(self):
+        self.digest.failures = 1
+        for _ in range(6):
+            self.logger.error('boom')
+        self.drain()
+        self.digest.flush()
+        self.digest.flush()
+        self.assertEqual(len(self.digest.sent), 1)
+        self.assertIn('1 log records were dropped', self.digest.sent[0][1])
+
+
+class InstallErrorMailTestCase(unittest.TestCase):
+    def tearDown(self):
+        for logger, (listener, digest) in list(error_mail._installed.items()):
+            listener.stop()
+            digest._stopped.set()
+            logger.removeHandler(digest.source)
+        error_mail._installed.clear()
+
+    def test_installed_once_per_logger(self):
+        config = dict(TEST_CONFIG, LOGGER_NAME='test_install_error_mail')
+        with mock.patch('atexit.register') as register:
+            first = install_error_mail(create_app(config))
+            app = create_app(config)
+            second = install_error_mail(app)
+        self.assertIs(first, second)
+        self.assertEqual(register.call_args_list.count(mock.call(error_mail._stop_all)), 1)
+        handlers = [h for h in app.logger.handlers if isinstance(h, ErrorQueueHandler)]
+        self.assertEqual(len(handlers), 1)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+from app import create_app
+from app.extensions import db, cache
+from tests import TEST_CONFIG
+from app.blog.models import User, Role, load_user, IDENTITY_CACHE_KEY
+
+
+class IdentityCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TEST_CONFIG)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        cache.clear()
+        self.role = Role(name='admin')
+        self.user = User('a@example.com', 'pwd', username='a', active=True)
+        db.session.add_all([self.role, self.user])
+        db.session.commit()
+        self.key = IDENTITY_CACHE_KEY % self.user.id
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_cached_identity_is_reused(self):
+        load_user(str(self.user.id))
+        self.assertEqual(load_user(str(self.user.id)).role_names, [])
+        self.assertIsNotNone(cache.get(self.key))
+
+    def assert_evicted_on_commit(self, change):
+        load_user(str(self.user.id))
+        change()
+        db.session.flush()
+        # 提交之前其他请求仍可能读到旧数据，这时删除缓存没有意义
+        self.assertIsNotNone(cache.get(self.key))
+        db.session.commit()
+        self.assertIsNone(cache.get(self.key))
+
+    def test_role_change_evicts_identity(self):
+        self.assert_evicted_on_commit(lambda: self.user.roles.append(self.role))
+        self.assertEqual(load_user(str(self.user.id)).role_names, ['admin'])
+
+    def test_password_change_evicts_identity(self):
+        def change():
+            self.user.password = 'new'
+        self.assert_evicted_on_commit(change)
+
+    def test_deletion_evicts_identity(self):
+        user_id = self.user.id
+        self.assert_evicted_on_commit(lambda: db.session.delete(self.user))
+        self.assertIsNone(load_user(str(user_id)))
+
+    def test_rollback_keeps_identity(self):
+        load_user(str(self.user.id))
+        self.user.password = 'new'
+        db.session.flush()
+        db.session.rollback()
+        db.session.commit()
+        self.assertIsNotNone(cache.get(self.key))
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+from app import create_app
+from app.extensions import cache, page_cache
+from tests import TEST_CONFIG
+
+
+class PageCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TEST_CONFIG)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        cache.clear()
+
+    def tearDown(self):
+        self.ctx.pop()
+
+    def key_for(self, url):
+        with self.app.test_request_context(url):
+            return page_cache.make_key()
+
+    def test_key_depends_on_query_string(self):
+        self.assertNotEqual(self.key_for('/blog/article'), self.key_for('/blog/article?cursor=abc'))
+        self.assertEqual(self.key_for('/blog/article?a=1&b=2'), self.key_for('/blog/article?b=2&a=1'))
+        self.assertEqual(self.key_for('/blog/article'), self.key_for('/blog/article?cursor='))
+
+    def test_invalidated_tag_makes_entry_stale(self):
+        entry = {'tags': page_cache._snapshot_versions(['post:1', 'posts'])}
+        self.assertTrue(page_cache._is_fresh(entry))
+        page_cache.invalidate('post:1')
+        self.assertFalse(page_cache._is_fresh(entry))
+
+    def render(self, view):
+        with self.app.test_request_context('/blog/race'):
+            return page_cache.cached()(view)().get_data(as_text=True)
+
+    def test_invalidation_during_render_is_not_hidden(self):
+        def view():
+            page_cache.tag('posts')
+            # 读取数据之后、渲染完成之前发生了写操作
+            page_cache.invalidate('posts')
+            return 'old'
+        self.assertEqual(self.render(view), 'old')
+        self.assertEqual(self.render(lambda: 'new'), 'new')
+
+    def test_late_tag_invalidated_after_start_skips_store(self):
+        def view():
+            page_cache.invalidate('post:1')
+            page_cache.tag('post:1')
+            return 'old'
+        self.assertEqual(self.render(view), 'old')
+        self.assertEqual(self.render(lambda: 'new'), 'new')
+
+    def test_unchanged_page_is_served_from_cache(self):
+        def view():
+            page_cache.tag('posts', 'post:1')
+            return 'cached'
+        self.render(view)
+        self.assertEqual(self.render(lambda: 'new'), 'cached')
@@ -3,12 +3,14 @@
 
 import unittest
 from flask import current_app
-from app import app, db
+from app import create_app
+from app.extensions import db
+from tests import TEST_CONFIG
 
 
 class PermissionsTestCase(unittest.TestCase):
     def setUp(self):
-        self.app = app
+        self.app = create_app(TEST_CONFIG)
         self.ctx = self.app.app_context()
         self.ctx.push()
         db.create_all()
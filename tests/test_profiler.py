@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import unittest
+from threading import get_ident
+from unittest import mock
+from app import create_app
+from app.extensions import db, cache, profiler
+from app.permissions import role_admin
+from tests import TEST_CONFIG
+from app.blog.models import User, Role
+from benchmarks.runner import _login
+
+
+class SamplingProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TEST_CONFIG)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        cache.clear()
+        profiler.switch(True)
+
+    def tearDown(self):
+        profiler.switch(False)
+        profiler.reset()
+        self.ctx.pop()
+
+    def start(self, pick):
+        with mock.patch('random.randrange', return_value=0 if pick else 1):
+            profiler._start_request()
+        return get_ident() in profiler._active
+
+    def test_unpicked_requests_are_not_sampled(self):
+        with self.app.test_request_context('/blog/article'):
+            self.assertFalse(self.start(pick=False))
+        with self.app.test_request_context('/blog/article'):
+            self.assertTrue(self.start(pick=True))
+            profiler._finish_request()
+        self.assertNotIn(get_ident(), profiler._active)
+
+    def test_latency_threshold_samples_every_request(self):
+        profiler.latency_threshold = 10
+        try:
+            with self.app.test_request_context('/blog/article'):
+                self.assertTrue(self.start(pick=False))
+                profiler._active[get_ident()]['frame'] += 1
+                profiler._finish_request()
+        finally:
+            profiler.latency_threshold = None
+        # 没被选中又不慢的请求在结束时丢弃
+        self.assertEqual(profiler.status()['endpoints'], {})
+
+
+class ProfilerSwitchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(dict(TEST_CONFIG, WTF_CSRF_ENABLED=True))
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        cache.clear()
+        admin = User('admin@example.com', 'pwd', username='admin', active=True)
+        admin.roles.append(Role(name=role_admin.value))
+        db.session.add(admin)
+        db.session.commit()
+        self.client = self.app.test_client()
+        _login(self.client, admin.id)
+
+    def tearDown(self):
+        profiler.switch(False)
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_switch_requires_post_with_csrf(self):
+        self.assertEqual(self.client.get('/blog/admin/profiler/on').status_code, 405)
+        self.assertEqual(self.client.post('/blog/admin/profiler/on').status_code, 400)
+        self.assertFalse(profiler.enabled)
+
+        token = json.loads(self.client.get('/blog/admin/profiler').get_data(as_text=True))['csrf_token']
+        response = self.client.post('/blog/admin/profiler/on', headers={'X-CSRFToken': token})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(profiler.enabled)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from app import create_app
+from app.extensions import db, cache
+from tests import TEST_CONFIG
+from app.blog.models import User, Post, Comment, Category, Tag
+from app.blog.pagination import keyset_paginate, encode_cursor, decode_cursor
+
+
+class ListingQueriesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TEST_CONFIG)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        cache.clear()
+        self.client = self.app.test_client()
+
+        author = User('author@example.com', 'pwd', username='author', active=True)
+        category = Category('python')
+        db.session.add_all([author, category])
+        for i in range(20):
+            post = Post(title='post %d' % i, body='body %d' % i, author=author, category=category)
+            post.tags = [Tag('tag%d' % i), Tag('common%d' % i)]
+            db.session.add(post)
+            db.session.add(Comment(body='comment', post=post, author=author))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def count_queries(self, url):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        engine = db.get_engine(self.app)
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = self.client.get(url)
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        self.assertEqual(response.status_code, 200)
+        return len(statements)
+
+    def test_article_query_count_does_not_grow_with_page_size(self):
+        self.app.config['FLASKY_POSTS_PER_PAGE'] = 2
+        small = self.count_queries('/blog/article/python')
+        cache.clear()
+        self.app.config['FLASKY_POSTS_PER_PAGE'] = 20
+        large = self.count_queries('/blog/article/python')
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, 6)
+
+
+class KeysetPaginationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TEST_CONFIG)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        author = User('author@example.com', 'pwd', username='author', active=True)
+        db.session.add(author)
+        # 8 篇文章，其中每两篇的发表时间相同，分页边界会落在时间相同的两篇之间
+        start = datetime(2017, 1, 1)
+        for i in range(8):
+            db.session.add(Post(title='post %d' % i, body='body', author=author,
+                                post_date=start + timedelta(hours=i // 2)))
+        db.session.commit()
+        self.expected = [post.id for post in Post.query.order_by(Post.post_date.desc(), Post.id.desc())]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def page(self, cursor=None):
+        return keyset_paginate(Post.query, Post.post_date, Post.id, cursor, per_page=3)
+
+    def ids(self, pagination):
+        return [post.id for post in pagination.items]
+
+    def test_cursor_round_trip(self):
+        key = (datetime(2017, 1, 1, 12, 30, 0, 250), 42)
+        self.assertEqual(decode_cursor(encode_cursor(key, 'prev')), (key, 'prev'))
+        key = (datetime(2017, 1, 1, 12, 30), 7)
+        self.assertEqual(decode_cursor(encode_cursor(key, 'next')), (key, 'next'))
+
+    def test_invalid_cursors_are_rejected(self):
+        valid = encode_cursor((datetime(2017, 1, 1), 1), 'next')
+        for token in ('', 'not base64!', valid[:-3], 'WzEsMiwibmV4dCJd',  # [1,2,"next"]
+                      encode_cursor((datetime(2017, 1, 1), 1), 'sideways'),
+                      encode_cursor((datetime(2017, 1, 1), '1'), 'next')):
+            self.assertIsNone(decode_cursor(token), token)
+            self.assertEqual(self.ids(self.page(token)), self.expected[:3])
+
+    def test_walk_forward_and_back(self):
+        first = self.page()
+        self.assertEqual(self.ids(first), self.expected[:3])
+        self.assertFalse(first.has_prev)
+        self.assertTrue(first.has_next)
+
+        second = self.page(first.next_cursor)
+        self.assertEqual(self.ids(second), self.expected[3:6])
+        self.assertTrue(second.has_prev and second.has_next)
+
+        last = self.page(second.next_cursor)
+        self.assertEqual(self.ids(last), self.expected[6:])
+        self.assertTrue(last.has_prev)
+        self.assertFalse(last.has_next)
+
+        # 往回翻时按相反顺序查询再倒回来，结果和往前翻时完全一致
+        back = self.page(last.prev_cursor)
+        self.assertEqual(self.ids(back), self.ids(second))
+        self.assertTrue(back.has_prev and back.has_next)
+        front = self.page(back.prev_cursor)
+        self.assertEqual(self.ids(front), self.expected[:3])
+        self.assertFalse(front.has_prev)
+        self.assertTrue(front.has_next)
+
+    def test_cursor_past_the_end_falls_back_to_first_page(self):
+        for direction in ('next', 'prev'):
+            edge = datetime(2000, 1, 1) if direction == 'next' else datetime(2100, 1, 1)
+            pagination = self.page(encode_cursor((edge, 0), direction))
+            self.assertEqual(self.ids(pagination), self.expected[:3])
+            self.assertFalse(pagination.has_prev)
+            self.assertTrue(pagination.has_next)
+
+    def test_cursor_after_last_row_falls_back_to_first_page(self):
+        last = self.page(self.page(self.page().next_cursor).next_cursor)
+        cursor = encode_cursor((last.items[-1].post_date, last.items[-1].id), 'next')
+        self.assertEqual(self.ids(self.page(cursor)), self.expected[:3])
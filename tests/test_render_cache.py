@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from app.lru import LRUCache
+from app.render_cache import RenderCache, RenderProfile
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        lru = LRUCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        self.assertEqual(lru.get('a'), 1)
+        lru.set('c', 3)
+        self.assertNotIn('b', lru)
+        self.assertEqual(len(lru), 2)
+        # 覆盖已有的键不淘汰其他条目，并把它移到最近使用的位置
+        lru.set('a', 10)
+        lru.set('d', 4)
+        self.assertEqual([lru.get(k) for k in 'abcd'], [10, None, None, 4])
+        self.assertEqual(lru.get('b', 'missing'), 'missing')
+
+
+class RenderCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = RenderCache()
+        self.cache.register_profile('comment', ['p', 'em'], {})
+
+    def test_repeated_text_is_rendered_once(self):
+        with mock.patch.object(RenderProfile, 'render', return_value='<p>hi</p>') as render:
+            self.assertEqual(self.cache.render('hi', 'comment'), '<p>hi</p>')
+            self.assertEqual(self.cache.render('hi', 'comment'), '<p>hi</p>')
+            self.cache.render('other', 'comment')
+        self.assertEqual(render.call_count, 2)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (1, 2, 2))
+
+    def test_key_depends_on_text_and_profile(self):
+        self.cache.register_profile('post', ['p', 'em', 'h1'], {})
+        key = self.cache.key('*hi*', 'comment')
+        self.assertEqual(key, self.cache.key('*hi*', 'comment'))
+        self.assertNotEqual(key, self.cache.key('*ho*', 'comment'))
+        self.assertNotEqual(key, self.cache.key('*hi*', 'post'))
+        self.assertEqual(self.cache.key(None, 'comment'), self.cache.key('', 'comment'))
+
+    def test_changing_the_whitelist_invalidates_results(self):
+        self.assertEqual(self.cache.render('*hi*', 'comment'), '<p><em>hi</em></p>')
+        key = self.cache.key('*hi*', 'comment')
+        self.cache.register_profile('comment', ['p'], {})
+        self.assertNotEqual(self.cache.key('*hi*', 'comment'), key)
+        self.assertEqual(self.cache.render('*hi*', 'comment'), '<p>hi</p>')
+        # 白名单里标签的顺序不影响指纹
+        self.cache.register_profile('comment', ['em', 'p'], {})
+        self.assertEqual(self.cache.key('*hi*', 'comment'), key)
+
+    def test_results_are_shared_through_the_disk_cache(self):
+        self.cache.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache.cache_dir)
+        html = self.cache.render('*中文*', 'comment')
+        key = self.cache.key('*中文*', 'comment')
+        self.assertTrue(os.path.isfile(os.path.join(self.cache.cache_dir, key[:2], key + '.html')))
+
+        # 另一个进程的缓存从磁盘读取，不再渲染
+        other = RenderCache()
+        other.register_profile('comment', ['p', 'em'], {})
+        other.cache_dir = self.cache.cache_dir
+        with mock.patch.object(RenderProfile, 'render') as render:
+            self.assertEqual(other.render('*中文*', 'comment'), html)
+        self.assertFalse(render.called)
+        self.assertEqual(other.stats()['disk_hits'], 1)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from app import create_app
+from app.extensions import db, render_cache
+from tests import TEST_CONFIG
+from app.blog.models import Post, Comment
+
+
+class RerenderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TEST_CONFIG)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        for i in range(5):
+            db.session.add(Post(title='post %d' % i, body='*post %d*' % i))
+        db.session.commit()
+        self.posts = Post.query.order_by(Post.id).all()
+        for post in self.posts:
+            db.session.add(Comment(body='**comment**', post_id=post.id))
+        db.session.commit()
+        # 模拟修改白名单前的旧渲染结果
+        posts = Post.__table__
+        db.session.execute(posts.update().where(posts.c.id.in_([self.posts[1].id, self.posts[3].id])).
+                           values(body_html='<p>stale</p>'))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def rerender(self, from_id=0, dry_run=False):
+        from manage import _rerender_model
+        with ThreadPoolExecutor(max_workers=1) as executor, redirect_stdout(io.StringIO()):
+            return _rerender_model(Post, 'post', executor, from_id, 2, 1, dry_run)
+
+    def html(self):
+        db.session.expire_all()
+        return [post.body_html for post in Post.query.order_by(Post.id)]
+
+    def test_only_changed_rows_are_written(self):
+        scanned, changed, _ = self.rerender()
+        self.assertEqual((scanned, changed), (5, 2))
+        self.assertEqual(self.html(), [render_cache.render('*post %d*' % i, 'post') for i in range(5)])
+        # 再跑一次没有需要更新的行
+        self.assertEqual(self.rerender()[:2], (5, 0))
+
+    def test_dry_run_and_resume(self):
+        self.assertEqual(self.rerender(dry_run=True)[:2], (5, 2))
+        self.assertEqual(self.html().count('<p>stale</p>'), 2)
+        self.assertEqual(self.rerender(from_id=self.posts[2].id)[:2], (3, 1))
+        html = self.html()
+        self.assertEqual(html[1], '<p>stale</p>')
+        self.assertNotEqual(html[3], '<p>stale</p>')
+
+    def test_from_id_is_rejected_for_all_targets(self):
+        from manage import rerender
+        with self.assertRaises(ValueError):
+            rerender('all', 3, 1000, 1, False)
+
+    def test_render_posts_backfills_in_chunks(self):
+        from manage import render_posts
+        posts = Post.__table__
+        db.session.execute(posts.update().where(posts.c.id != self.posts[0].id).values(body_html=None))
+        db.session.commit()
+        with redirect_stdout(io.StringIO()) as out:
+            render_posts(chunk=2)
+        self.assertEqual(out.getvalue().strip(), 'rendered 4 posts')
+        html = self.html()
+        self.assertEqual(html[0], render_cache.render('*post 0*', 'post'))
+        self.assertEqual(html[1:], [render_cache.render('*post %d*' % i, 'post') for i in range(1, 5)])
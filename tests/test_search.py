@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+from app import create_app
+from app.extensions import db
+from tests import TEST_CONFIG
+from app.blog.models import Post, Tag
+from app.blog.search import tokenize, search, reindex
+
+
+class SearchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TEST_CONFIG)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_tokenize_uses_bigrams_for_cjk(self):
+        self.assertEqual(tokenize('全文搜索 Flask-SQLAlchemy'),
+                         ['全文', '文搜', '搜索', 'flask', 'sqlalchemy'])
+        self.assertEqual(tokenize('的'), ['的'])
+
+    def test_index_follows_post_changes(self):
+        a = Post(title='数据库连接池', body='讲连接池的配置')
+        b = Post(title='模板渲染', body='顺便提到连接池', tags=Tag.get_tags(['python']))
+        db.session.add_all([a, b])
+        db.session.commit()
+
+        total, hits = search('连接池')
+        self.assertEqual(total, 2)
+        self.assertEqual(hits[0][0], a.id)
+        self.assertEqual(search('python')[1][0][0], b.id)
+
+        a.title = '缓存'
+        a.body = '与数据库无关'
+        db.session.commit()
+        self.assertEqual([post_id for post_id, score in search('连接池')[1]], [b.id])
+
+        db.session.delete(b)
+        db.session.commit()
+        self.assertEqual(search('连接池')[0], 0)
+
+        self.assertEqual(reindex(), 1)
+        self.assertEqual(search('缓存')[1][0][0], a.id)
+
+    def test_scoring_and_paging_in_the_database(self):
+        posts = [Post(title='连接池' * (i + 1), body='正文 %d' % i) for i in range(5)]
+        posts.append(Post(title='连接池', body='未公开', publish=False))
+        db.session.add_all(posts)
+        db.session.commit()
+
+        total, first = search('连接池', limit=3)
+        self.assertEqual(total, 5)
+        rest = search('连接池', limit=3, offset=3)[1]
+        ids = [post_id for post_id, score in first + rest]
+        self.assertEqual(sorted(ids), sorted(post.id for post in posts[:5]))
+        scores = [score for post_id, score in first + rest]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertTrue(all(isinstance(score, float) for score in scores))
+        self.assertEqual(search('连接池', include_unpublished=True)[0], 6)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from app import create_app, basedir
+from app.extensions import avatars
+from app.avatars import IDENTICON_VERSION
+from app.sendfile import nginx_etag, FileOffload
+from tests import TEST_CONFIG
+
+FAVICON = os.path.join(basedir, 'static', 'img', 'favicon.ico')
+
+
+class FileOffloadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.app = create_app(dict(TEST_CONFIG, SENDFILE_MODE='x-accel-redirect', AVATAR_CACHE_DIR=self.cache_dir,
+                                   SENDFILE_ACCEL_MAPPING={basedir: '/_app/', self.cache_dir: '/_avatars/'}))
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        avatars.clear()
+        shutil.rmtree(self.cache_dir)
+
+    def test_favicon_is_offloaded(self):
+        response = self.client.get('/favicon.ico')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Accel-Redirect'], '/_app/static/img/favicon.ico')
+        self.assertNotIn('X-Sendfile', response.headers)
+        self.assertEqual(response.data, b'')
+
+    def test_etag_matches_nginx(self):
+        response = self.client.get('/favicon.ico', headers={'If-None-Match': '"%s"' % nginx_etag(FAVICON)})
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn('X-Accel-Redirect', response.headers)
+
+    def test_mapping_respects_path_boundaries(self):
+        offload = FileOffload()
+        offload.mapping = [('/srv/app-cache/', '/_cache/'), ('/srv/app', '/_app/')]
+        self.assertEqual(offload.internal_uri('/srv/app/static/x.png'), '/_app/static/x.png')
+        self.assertEqual(offload.internal_uri('/srv/app-cache/x.png'), '/_cache/x.png')
+        offload.mapping = [('/srv/app', '/_app/')]
+        self.assertIsNone(offload.internal_uri('/srv/app-cache/x.png'))
+        self.assertIsNone(offload.internal_uri('/srv/application.py'))
+
+    def test_range_is_left_to_the_server(self):
+        response = self.client.get('/favicon.ico', headers={'Range': 'bytes=0-9'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Range', response.headers)
+        self.assertIn('X-Accel-Redirect', response.headers)
+
+    def test_cached_avatar_is_offloaded(self):
+        response = self.client.get('/avatar/v%d/%s-64.png' % (IDENTICON_VERSION, '0' * 32))
+        self.assertTrue(response.headers['X-Accel-Redirect'].startswith('/_avatars/'))
+        self.assertIn('immutable', response.headers['Cache-Control'])
+
+    def test_unmapped_file_is_sent_by_worker(self):
+        self.app.extensions['file_offload'].mapping = []
+        response = self.client.get('/favicon.ico')
+        with open(FAVICON, 'rb') as fp:
+            self.assertEqual(response.data, fp.read())
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import unittest
+from unittest import mock
+from app import create_app
+from app.extensions import db, cache, sql_monitor
+from app.permissions import role_admin
+from app.sql_monitor import fingerprint
+from benchmarks.runner import _login
+from tests import TEST_CONFIG
+from app.blog.models import User, Role
+
+
+class FingerprintTestCase(unittest.TestCase):
+    def test_literals_are_replaced(self):
+        self.assertEqual(fingerprint("SELECT * FROM posts WHERE title = 'it''s' AND id = 42 AND score > 1.5"),
+                         'SELECT * FROM posts WHERE title = ? AND id = ? AND score > ?')
+        # 标识符里的数字不是字面量
+        self.assertEqual(fingerprint('SELECT t1.id FROM t1 WHERE t1.id = :id_1'),
+                         'SELECT t1.id FROM t1 WHERE t1.id = ?')
+
+    def test_in_lists_of_any_length_share_a_fingerprint(self):
+        self.assertEqual(fingerprint('SELECT * FROM tags WHERE id IN (?, ?, ?)'),
+                         fingerprint('SELECT * FROM tags WHERE id in (7)'))
+        self.assertEqual(fingerprint('SELECT * FROM tags WHERE name IN (%(name_1)s,\n %(name_2)s)'),
+                         'SELECT * FROM tags WHERE name IN (?)')
+
+
+class QueryMonitorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TEST_CONFIG)
+        self.app.add_url_rule('/users-one-by-one', 'users_one_by_one', self.users_one_by_one)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        cache.clear()
+        sql_monitor.reset()
+        admin = User('admin@example.com', 'pwd', username='admin', active=True)
+        admin.roles.append(Role(name=role_admin.value))
+        db.session.add(admin)
+        for i in range(5):
+            db.session.add(User('user%d@example.com' % i, 'pwd', username='user%d' % i))
+        db.session.commit()
+        self.client = self.app.test_client()
+        _login(self.client, admin.id)
+
+    def tearDown(self):
+        sql_monitor.reset()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    @staticmethod
+    def users_one_by_one():
+        names = [User.query.filter_by(username='user%d' % i).first().username for i in range(5)]
+        return ','.join(names)
+
+    def test_server_timing_header(self):
+        response = self.client.get('/users-one-by-one')
+        self.assertEqual(response.status_code, 200)
+        timing = response.headers.get_all('Server-Timing')
+        self.assertEqual(len(timing), 2)
+        self.assertRegex(timing[0], r'^db;dur=[\d.]+;desc="\d+ queries"$')
+        self.assertRegex(timing[1], r'^app;dur=[\d.]+$')
+
+    def test_n_plus_one_is_logged_and_reported(self):
+        with mock.patch.object(self.app.logger, 'warning') as warning:
+            self.client.get('/users-one-by-one')
+        messages = [call[0][0] for call in warning.call_args_list]
+        self.assertTrue(any(m.startswith('Probable N+1: 5 x SELECT') for m in messages), messages)
+
+        response = self.client.get('/blog/admin/sql-stats')
+        self.assertEqual(response.status_code, 200)
+        stats = json.loads(response.get_data(as_text=True))['users_one_by_one']
+        self.assertEqual(stats['requests'], 1)
+        self.assertGreaterEqual(stats['max_queries'], 5)
+        self.assertEqual(len(stats['n_plus_one']), 1)
+        suspect = stats['n_plus_one'][0]
+        self.assertIn('WHERE users.username = ?', suspect['statement'])
+        self.assertEqual(suspect['origin'], 'users_one_by_one (view)')
+
+    def test_stats_require_admin(self):
+        self.assertEqual(self.app.test_client().get('/blog/admin/sql-stats').status_code, 401)
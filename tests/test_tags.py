@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+from sqlalchemy import create_engine
+from app import create_app
+from app.extensions import db
+from tests import TEST_CONFIG
+from app.blog import models
+from app.blog.models import Tag
+
+
+class TagsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TEST_CONFIG)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_get_tags_keeps_order_and_reuses_existing(self):
+        db.session.add(Tag('flask'))
+        db.session.commit()
+
+        tags = Tag.get_tags([' Python', 'flask', '', 'python ', 'SQL'])
+        self.assertEqual([tag.name for tag in tags], ['python', 'flask', 'sql'])
+        self.assertEqual(Tag.query.count(), 3)
+        self.assertEqual(Tag.get_tags(['sql', 'flask']), [tags[2], tags[1]])
+
+
+class ConcurrentTagsTestCase(unittest.TestCase):
+    """用 SQLite 文件数据库，另一个连接在本事务 INSERT 之前抢先插入同名标签"""
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        self.app = create_app(dict(TEST_CONFIG, SQLALCHEMY_DATABASE_URI='sqlite:///' + self.path))
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.other = create_engine('sqlite:///' + self.path)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.other.dispose()
+        self.ctx.pop()
+        os.remove(self.path)
+
+    def insert_concurrently(self, name):
+        original = models._insert_ignoring_conflicts
+        pending = [name]
+
+        def insert(table, rows):
+            # 只在第一次 INSERT 之前抢先插入，之后本事务已持有写锁
+            if pending:
+                self.other.execute(table.insert(), name=pending.pop())
+            return original(table, rows)
+        return mock.patch.object(models, '_insert_ignoring_conflicts', insert)
+
+    def test_conflicting_insert_is_read_back(self):
+        with self.insert_concurrently('python'):
+            tags = Tag.get_tags(['python', 'flask'])
+        db.session.commit()
+        self.assertEqual([tag.name for tag in tags], ['python', 'flask'])
+        self.assertEqual(Tag.query.count(), 2)
+
+    def test_row_missing_from_snapshot_is_retried(self):
+        original = Tag._by_name
+        calls = []
+
+        def by_name(names, for_update=False):
+            calls.append(for_update)
+            # 第一次加锁读模拟读不到并发事务插入的行
+            if for_update and calls.count(True) == 1:
+                return {}
+            return original(names, for_update)
+
+        with self.insert_concurrently('python'), mock.patch.object(Tag, '_by_name', staticmethod(by_name)):
+            tags = Tag.get_tags(['python'])
+        self.assertEqual(tags[0].name, 'python')
+        self.assertEqual(calls, [False, True, True])
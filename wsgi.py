@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+gunicorn 入口：gunicorn wsgi:app
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+from app import create_app
+
+app = create_app()